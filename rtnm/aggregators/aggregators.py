@@ -0,0 +1,198 @@
+"""
+.. module:: aggregators
+   :platform: Unix, Windows
+   :synopsis: Streaming window aggregation of parsed responses
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from array import array
+from time import time_ns
+from typing import List, Dict, Any, Tuple, Optional
+from parsers.Parsers import ParsedResponse
+from errors.errors import ConfigError
+from metrics.metrics import metrics
+
+AGGREGATION_FUNCTIONS: Tuple[str, ...] = ("min", "max", "avg", "last", "sum", "count")
+_MIN, _MAX, _SUM, _LAST = range(4)
+_STRIDE: int = 4
+
+
+class Window:
+    """The running state of a single window of a series. The statistics of every field are
+    kept in one flat typed array (min, max, sum, last per field) with a parallel array of counts
+
+    :param start: The start of the window in nanoseconds
+    :type start: int
+    :param template: A response of the series, used for the metadata of the aggregated response
+    :type template: ParsedResponse
+    :param keys: The group by keys of the series
+    :type keys: Dict[str, Any]
+
+    """
+
+    __slots__ = ("start", "template", "keys", "fields", "values", "counts")
+
+    def __init__(self, start: int, template: ParsedResponse, keys: Dict[str, Any]) -> None:
+        self.start: int = start
+        self.template: ParsedResponse = template
+        self.keys: Dict[str, Any] = keys
+        self.fields: Dict[str, int] = {}
+        self.values: array = array("d")
+        self.counts: array = array("Q")
+
+    def add(self, field: str, value: float) -> None:
+        index: Optional[int] = self.fields.get(field)
+        if index is None:
+            self.fields[field] = len(self.counts)
+            self.values.extend((value, value, value, value))
+            self.counts.append(1)
+            return
+        offset: int = index * _STRIDE
+        values: array = self.values
+        if value < values[offset + _MIN]:
+            values[offset + _MIN] = value
+        if value > values[offset + _MAX]:
+            values[offset + _MAX] = value
+        values[offset + _SUM] += value
+        values[offset + _LAST] = value
+        self.counts[index] += 1
+
+    def result(self, functions: List[str]) -> Dict[str, Any]:
+        content: Dict[str, Any] = {}
+        for field, index in self.fields.items():
+            offset: int = index * _STRIDE
+            count: int = self.counts[index]
+            for function in functions:
+                if function == "min":
+                    content[f"{field}_min"] = self.values[offset + _MIN]
+                elif function == "max":
+                    content[f"{field}_max"] = self.values[offset + _MAX]
+                elif function == "sum":
+                    content[f"{field}_sum"] = self.values[offset + _SUM]
+                elif function == "avg":
+                    content[f"{field}_avg"] = self.values[offset + _SUM] / count
+                elif function == "last":
+                    content[f"{field}_last"] = self.values[offset + _LAST]
+                else:
+                    content[f"{field}_count"] = count
+        return content
+
+
+class WindowAggregator:
+    """Aggregate the numeric fields of a sensor path into tumbling windows
+
+    :param name: The name of the aggregation section in the configuration file
+    :type name: str
+    :param sensor: The yang path prefix of the responses to aggregate
+    :type sensor: str
+    :param window: The length of a window in seconds
+    :type window: int
+    :param functions: The aggregation functions to apply to every field
+    :type functions: List[str]
+    :param group_by: The keys to group the series by, all keys are used if empty
+    :type group_by: List[str]
+    :param fields: The fields to aggregate, all numeric fields are used if empty
+    :type fields: List[str]
+    :param forward_raw: Also upload the raw responses of the sensor path
+    :type forward_raw: bool
+
+    """
+
+    def __init__(self, name: str, sensor: str, window: int, functions: List[str], group_by: List[str],
+                 fields: List[str], forward_raw: bool) -> None:
+        for function in functions:
+            if function not in AGGREGATION_FUNCTIONS:
+                raise ConfigError(f"Unknown aggregation function {function} in {name}")
+        self.name: str = name
+        self.sensor: str = sensor
+        self.window: int = window * 1000000000
+        self.functions: List[str] = functions
+        self.group_by: List[str] = group_by
+        self.fields: List[str] = fields
+        self.forward_raw: bool = forward_raw
+        self._windows: Dict[Tuple[Any, ...], Window] = {}
+
+    def matches(self, yang_path: str) -> bool:
+        return yang_path.startswith(self.sensor)
+
+    def _emit(self, window: Window, emitted: List[ParsedResponse]) -> None:
+        # A window without any numeric field would be a row without fields, which the outputs reject
+        if not window.fields:
+            return
+        template: ParsedResponse = window.template
+        emitted.append(ParsedResponse(template.yang_path, {"keys": window.keys,
+                                                           "content": window.result(self.functions)},
+                                      template.version, template.hostname, template.encoding, window.start,
+                                      template.ip_addr))
+
+    def add(self, response: ParsedResponse) -> List[ParsedResponse]:
+        """Add a response to the window of its series
+
+        :param response: A parsed response of the sensor path
+        :type response: ParsedResponse
+        :returns: The aggregated responses of the windows closed by this response
+
+        """
+        emitted: List[ParsedResponse] = []
+        keys: Dict[str, Any] = response.data["keys"]
+        if self.group_by:
+            keys = {key: keys.get(key) for key in self.group_by}
+        series: Tuple[Any, ...] = (response.ip_addr, response.yang_path, *keys.values())
+        start: int = response.timestamp - response.timestamp % self.window
+        window: Optional[Window] = self._windows.get(series)
+        if window is not None and start < window.start:
+            # The window of the response was already emitted
+            metrics.inc("rtnm_aggregation_late_samples_total", aggregation=self.name)
+            return emitted
+        if window is None or start > window.start:
+            if window is not None:
+                self._emit(window, emitted)
+            window = Window(start, response, keys)
+            self._windows[series] = window
+        content: Dict[str, Any] = response.data["content"]
+        for field in self.fields or content.keys():
+            value: Any = content.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                window.add(field, value)
+        return emitted
+
+    def flush(self, now: Optional[int] = None) -> List[ParsedResponse]:
+        """Close the windows that haven't seen a response for a full window length
+
+        :param now: The current time in nanoseconds, if None every window is closed
+        :type now: Optional[int]
+        :returns: The aggregated responses of the closed windows
+
+        """
+        emitted: List[ParsedResponse] = []
+        for series, window in list(self._windows.items()):
+            if now is None or window.start + 2 * self.window <= now:
+                self._emit(window, emitted)
+                del self._windows[series]
+        return emitted
+
+
+def aggregate(aggregators: List[WindowAggregator],
+              responses: List[ParsedResponse]) -> Tuple[List[ParsedResponse], List[ParsedResponse]]:
+    """Run the parsed responses through the aggregators
+
+    :param aggregators: The configured aggregators
+    :type aggregators: List[WindowAggregator]
+    :param responses: The parsed responses of a batch
+    :type responses: List[ParsedResponse]
+    :returns: The raw responses to forward and the aggregated responses of any closed windows
+
+    """
+    raw: List[ParsedResponse] = []
+    aggregated: List[ParsedResponse] = []
+    for response in responses:
+        forward: bool = True
+        for aggregator in aggregators:
+            if aggregator.matches(response.yang_path):
+                aggregated.extend(aggregator.add(response))
+                forward = forward and aggregator.forward_raw
+        if forward:
+            raw.append(response)
+    now: int = time_ns()
+    for aggregator in aggregators:
+        aggregated.extend(aggregator.flush(now))
+    return raw, aggregated
@@ -0,0 +1,315 @@
+"""
+.. module:: alerts
+   :platform: Unix, Windows
+   :synopsis: Threshold, rate of change and absence alerts evaluated inline on the parsed responses
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import re
+import json
+import operator
+from fnmatch import translate
+from queue import Queue, Empty, Full
+from threading import Thread
+from time import time, time_ns, sleep
+from logging import Logger
+from typing import List, Dict, Any, Tuple, Optional, Callable, Pattern
+from requests import request
+from parsers.Parsers import ParsedResponse
+from errors.errors import ConfigError
+from metrics.metrics import metrics
+
+ALERT_CONDITIONS: Tuple[str, ...] = ("threshold", "rate", "absence")
+ALERT_OPERATORS: Dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne,
+}
+# ip, yang path, keys of a series
+SeriesKey = Tuple[str, str, Tuple[Tuple[str, Any], ...]]
+
+
+class AlertState:
+    """The state of a rule for a single series"""
+
+    __slots__ = ("pending_since", "firing", "notified", "previous", "last_seen", "template")
+
+    def __init__(self) -> None:
+        self.pending_since: int = 0
+        self.firing: bool = False
+        self.notified: float = 0.0
+        # Timestamp and value of the previous response, for rates
+        self.previous: Optional[Tuple[int, float]] = None
+        self.last_seen: int = 0
+        self.template: Optional[ParsedResponse] = None
+
+
+class AlertRule:
+    """A condition on a field of the responses of a sensor path, evaluated for every series (device, yang path
+    and keys). threshold compares the value of the field, rate its per second rate of change (a decrease of
+    a counter is a reset and skipped) and absence fires when a series hasn't sent a response for a number of
+    seconds. A condition has to hold for the for duration before the alert fires
+
+    :param name: The name of the alert section in the configuration file
+    :type name: str
+    :param sensor: The yang path prefix of the responses the rule applies to
+    :type sensor: str
+    :param condition: One of threshold, rate or absence
+    :type condition: str
+    :param field: The field compared, not needed for absence
+    :type field: str
+    :param operator: One of >, >=, <, <=, == or != comparing the value or rate to the threshold
+    :type operator: str
+    :param threshold: The threshold, or the number of seconds without a response for absence
+    :type threshold: float
+    :param duration: The number of seconds the condition has to hold before the alert fires
+    :type duration: float
+    :param keys: name=pattern shell globs the keys of a series have to match
+    :type keys: List[str]
+    :param webhook: The URL the notifications are posted to
+    :type webhook: str
+    :param severity: The severity included in the notifications
+    :type severity: str
+    :param repeat_interval: The number of seconds after which a firing alert is notified again, never if 0
+    :type repeat_interval: float
+
+    """
+
+    def __init__(self, name: str, sensor: str, condition: str, field: str, operator: str, threshold: float,
+                 duration: float, keys: List[str], webhook: str, severity: str, repeat_interval: float) -> None:
+        if condition not in ALERT_CONDITIONS:
+            raise ConfigError(f"Unknown alert condition {condition} in {name}")
+        if condition != "absence" and operator not in ALERT_OPERATORS:
+            raise ConfigError(f"Unknown alert operator {operator} in {name}")
+        if condition != "absence" and not field:
+            raise ConfigError(f"Alert {name} requires a field")
+        self.name: str = name
+        self.sensor: str = sensor
+        self.condition: str = condition
+        self.field: str = field
+        self.operator: str = operator
+        self.compare: Callable[[float, float], bool] = ALERT_OPERATORS.get(operator, ALERT_OPERATORS[">"])
+        self.threshold: float = threshold
+        self.duration: int = int(duration * 1e9)
+        self.keys: Dict[str, Pattern] = {}
+        for key in keys:
+            key_name, _, pattern = key.partition("=")
+            self.keys[key_name.strip()] = re.compile(translate(pattern.strip() or "*"))
+        self.webhook: str = webhook
+        self.severity: str = severity
+        self.repeat_interval: float = repeat_interval
+        self.states: Dict[SeriesKey, AlertState] = {}
+
+    def matches(self, yang_path: str) -> bool:
+        return yang_path.startswith(self.sensor)
+
+    def _notification(self, status: str, state: AlertState, value: Optional[float], timestamp: int) -> Dict[str, Any]:
+        template: ParsedResponse = state.template
+        return {
+            "alert": self.name, "status": status, "severity": self.severity, "condition": self.condition,
+            "field": self.field, "operator": self.operator, "threshold": self.threshold, "value": value,
+            "hostname": template.hostname, "ip": template.ip_addr, "yang_path": template.yang_path,
+            "keys": template.data["keys"], "timestamp": timestamp,
+        }
+
+    def _transition(self, state: AlertState, active: bool, value: Optional[float],
+                    timestamp: int) -> Optional[Dict[str, Any]]:
+        if not active:
+            state.pending_since = 0
+            if state.firing:
+                state.firing = False
+                metrics.inc("rtnm_alerts_total", alert=self.name, status="resolved")
+                return self._notification("resolved", state, value, timestamp)
+            return None
+        if not state.pending_since:
+            state.pending_since = timestamp
+        if timestamp - state.pending_since < self.duration:
+            return None
+        if not state.firing:
+            state.firing = True
+            state.notified = time()
+            metrics.inc("rtnm_alerts_total", alert=self.name, status="firing")
+            return self._notification("firing", state, value, timestamp)
+        if self.repeat_interval and time() - state.notified >= self.repeat_interval:
+            state.notified = time()
+            return self._notification("firing", state, value, timestamp)
+        return None
+
+    def evaluate(self, response: ParsedResponse) -> Optional[Dict[str, Any]]:
+        """Evaluate the rule against a response of its sensor path
+
+        :param response: The parsed response
+        :type response: ParsedResponse
+        :returns: The notification if the alert of the series fired or resolved
+
+        """
+        keys: Dict[str, Any] = response.data["keys"]
+        for name, pattern in self.keys.items():
+            if name not in keys or not pattern.match(str(keys[name])):
+                return None
+        series: SeriesKey = (response.ip_addr, response.yang_path, tuple(sorted(keys.items())))
+        state: Optional[AlertState] = self.states.get(series)
+        if state is None:
+            state = self.states[series] = AlertState()
+        state.template = response
+        if self.condition == "absence":
+            # Absence is measured on the clock of RTNM, the clocks of the devices may be off
+            state.last_seen = time_ns()
+            return self._transition(state, False, None, state.last_seen)
+        value: Any = response.data["content"].get(self.field)
+        if not isinstance(value, (int, float)):
+            return None
+        if self.condition == "threshold":
+            return self._transition(state, self.compare(value, self.threshold), value, response.timestamp)
+        previous: Optional[Tuple[int, float]] = state.previous
+        state.previous = (response.timestamp, value)
+        if previous is None or response.timestamp <= previous[0] or value < previous[1]:
+            return None
+        rate: float = (value - previous[1]) / ((response.timestamp - previous[0]) / 1e9)
+        return self._transition(state, self.compare(rate, self.threshold), rate, response.timestamp)
+
+    def check_absence(self, now: int) -> List[Dict[str, Any]]:
+        """Fire the absence alerts of the series that haven't sent a response for the threshold
+
+        :param now: The current time in nanoseconds
+        :type now: int
+        :returns: The notifications of the alerts that fired
+
+        """
+        notifications: List[Dict[str, Any]] = []
+        for state in self.states.values():
+            if now - state.last_seen >= self.threshold * 1e9:
+                notification: Optional[Dict[str, Any]] = self._transition(state, True, None, now)
+                if notification is not None:
+                    notifications.append(notification)
+        return notifications
+
+
+class WebhookNotifier:
+    """Posts the notifications of the alerts to their webhooks from a thread, so the worker never waits on a
+    webhook. The notifications are batched per webhook for the batch interval and posted as
+    {"alerts": [...]} in the order they happened, a notification repeated within a batch is only sent once
+
+    :param log: The logger failures are written to
+    :type log: Logger
+    :param batch_interval: The number of seconds notifications are batched for
+    :type batch_interval: float
+    :param retries: The number of times a failed post is retried
+    :type retries: int
+
+    """
+
+    def __init__(self, log: Logger, batch_interval: float = 1.0, retries: int = 3) -> None:
+        self.log: Logger = log
+        self.batch_interval: float = batch_interval
+        self.retries: int = retries
+        self.queue: Queue = Queue(10000)
+        self._thread: Thread = Thread(target=self._run, name="alert-notifier", daemon=True)
+        self._thread.start()
+
+    def notify(self, webhook: str, notification: Dict[str, Any]) -> None:
+        """Queue a notification
+
+        :param webhook: The URL the notification is posted to
+        :type webhook: str
+        :param notification: The notification
+        :type notification: Dict[str, Any]
+
+        """
+        try:
+            self.queue.put_nowait((webhook, notification))
+        except Full:
+            metrics.inc("rtnm_alert_notifications_total", status="dropped")
+
+    def _post(self, webhook: str, notifications: List[Dict[str, Any]]) -> None:
+        body: str = json.dumps({"alerts": notifications})
+        delay: float = 1.0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(delay)
+                delay *= 2
+            try:
+                response = request("POST", webhook, data=body, headers={"Content-Type": "application/json"},
+                                   timeout=10)
+                if response.status_code < 300:
+                    metrics.inc("rtnm_alert_notifications_total", len(notifications), status="sent")
+                    return
+                self.log.error(f"Posting {len(notifications)} alerts to {webhook} failed with {response.status_code}")
+            except Exception as error:
+                self.log.error(f"Posting {len(notifications)} alerts to {webhook} failed: {error}")
+        metrics.inc("rtnm_alert_notifications_total", len(notifications), status="failed")
+
+    def _run(self) -> None:
+        done: bool = False
+        while not done:
+            batches: Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]] = {}
+            deadline: float = time() + self.batch_interval
+            while time() < deadline:
+                try:
+                    item: Optional[Tuple[str, Dict[str, Any]]] = self.queue.get(timeout=max(deadline - time(), 0))
+                except Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                webhook, notification = item
+                alert: Tuple[Any, ...] = (notification["alert"], notification["status"], notification["ip"],
+                                          notification["yang_path"], json.dumps(notification["keys"], sort_keys=True))
+                # A repeated notification replaces the earlier one and moves after the ones queued since
+                batch: Dict[Tuple[Any, ...], Dict[str, Any]] = batches.setdefault(webhook, {})
+                batch.pop(alert, None)
+                batch[alert] = notification
+            for webhook, notifications in batches.items():
+                self._post(webhook, list(notifications.values()))
+
+    def close(self) -> None:
+        """Post the queued notifications and stop the thread"""
+        self.queue.put(None)
+        self._thread.join()
+
+
+class AlertEngine:
+    """Evaluates the alert rules against the parsed responses of a worker. The rules are indexed by yang path
+    the first time a yang path is seen, so a response is only evaluated against the rules of its sensor path
+
+    :param rules: The alert rules
+    :type rules: List[AlertRule]
+    :param log: The logger failures are written to
+    :type log: Logger
+    :param batch_interval: The number of seconds notifications are batched for
+    :type batch_interval: float
+
+    """
+
+    def __init__(self, rules: List[AlertRule], log: Logger, batch_interval: float = 1.0) -> None:
+        self.rules: List[AlertRule] = rules
+        self.absence_rules: List[AlertRule] = [rule for rule in self.rules if rule.condition == "absence"]
+        self.index: Dict[str, List[AlertRule]] = {}
+        self.notifier: WebhookNotifier = WebhookNotifier(log, batch_interval)
+
+    def _rules(self, yang_path: str) -> List[AlertRule]:
+        rules: Optional[List[AlertRule]] = self.index.get(yang_path)
+        if rules is None:
+            rules = self.index[yang_path] = [rule for rule in self.rules if rule.matches(yang_path)]
+        return rules
+
+    def evaluate(self, responses: List[ParsedResponse]) -> None:
+        """Evaluate the rules against the parsed responses of a batch
+
+        :param responses: The parsed responses
+        :type responses: List[ParsedResponse]
+
+        """
+        for response in responses:
+            for rule in self._rules(response.yang_path):
+                notification: Optional[Dict[str, Any]] = rule.evaluate(response)
+                if notification is not None:
+                    self.notifier.notify(rule.webhook, notification)
+
+    def check_absence(self) -> None:
+        """Fire the absence alerts of the series that stopped sending, called periodically by the worker"""
+        now: int = time_ns()
+        for rule in self.absence_rules:
+            for notification in rule.check_absence(now):
+                self.notifier.notify(rule.webhook, notification)
+
+    def close(self) -> None:
+        """Post the queued notifications"""
+        self.notifier.close()
@@ -0,0 +1,159 @@
+"""
+.. module:: benchmarks
+   :platform: Unix, Windows
+   :synopsis: Throughput benchmarks of the parsers and the uploader encodings
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import tracemalloc
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import List, Dict, Any, Tuple, Callable, Optional
+import databases.databases
+from databases.databases import Uploader, ElasticSearchUploader, InfluxdbUploader, Influxdb2Uploader
+from parsers.Parsers import RTNMParser, ParsedResponse
+from benchmarks.fixtures import SHAPES, generate_batch, load_fixture
+
+LOG_NAME: str = "rtnm-benchmarks"
+
+
+class StubResponse:
+    """Stands in for the response of a successful post, 200 being accepted by every output"""
+    status_code: int = 200
+
+    def json(self) -> Dict[str, Any]:
+        return {}
+
+
+class StubRequest:
+    """Replaces the requests call of the uploaders, counting the posted bytes instead of sending them"""
+
+    def __init__(self) -> None:
+        self.posted_bytes: int = 0
+
+    def __call__(self, method: str, url: str, data: Any = None, **kwargs) -> StubResponse:
+        if data is not None:
+            self.posted_bytes += len(data)
+        return StubResponse()
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, rows: int, in_bytes: int, seconds: float, peak_memory: int) -> None:
+        self.name: str = name
+        self.rows: int = rows
+        self.in_bytes: int = in_bytes
+        self.seconds: float = seconds
+        self.peak_memory: int = peak_memory
+
+    def __str__(self):
+        return (f"{self.name:32} {self.rows:>10} {self.rows / self.seconds:>14,.0f} "
+                f"{self.in_bytes / self.seconds / 1048576:>10.2f} {self.peak_memory / 1048576:>10.2f}")
+
+
+def measure(name: str, func: Callable[[], Tuple[int, int]], repeat: int) -> BenchmarkResult:
+    """Time a benchmark, keeping the fastest run, then run it once more to record the peak memory
+
+    :param name: The name of the benchmark
+    :type name: str
+    :param func: Runs the benchmark once and returns the number of rows and bytes it handled
+    :type func: Callable[[], Tuple[int, int]]
+    :param repeat: The number of timed runs
+    :type repeat: int
+    :returns: The result of the benchmark
+
+    """
+    best: Optional[float] = None
+    rows, in_bytes = 0, 0
+    for _ in range(repeat):
+        start: float = perf_counter()
+        rows, in_bytes = func()
+        elapsed: float = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return BenchmarkResult(name, rows, in_bytes, best, peak_memory)
+
+
+def create_uploaders() -> Dict[str, Uploader]:
+    return {
+        "elasticsearch": ElasticSearchUploader(address="127.0.0.1", port="9200", log_name=LOG_NAME),
+        "influxdb": InfluxdbUploader(address="127.0.0.1", port="8086", database="bench", log_name=LOG_NAME),
+        "influxdbv2": Influxdb2Uploader(address="127.0.0.1", port="8086", token="bench", org="bench",
+                                        bucket="bench", log_name=LOG_NAME),
+    }
+
+
+def bench_batch(name: str, batch: List[Tuple[str, bytes, Optional[str], Optional[str], str, float]],
+                uploaders: Dict[str, Uploader], stub: StubRequest, repeat: int) -> List[BenchmarkResult]:
+    """Benchmark the parsing of a batch and the encoding of its parsed responses by every uploader
+
+    :param name: The name of the batch
+    :type name: str
+    :param batch: The raw responses
+    :type batch: List[Tuple[str, bytes, Optional[str], Optional[str], str, float]]
+    :param uploaders: The uploaders to benchmark, keyed by output type
+    :type uploaders: Dict[str, Uploader]
+    :param stub: The stubbed network call used by the uploaders
+    :type stub: StubRequest
+    :param repeat: The number of timed runs of each benchmark
+    :type repeat: int
+    :returns: The results of the benchmarks
+
+    """
+    raw_bytes: int = sum(len(response[1]) for response in batch)
+    parsed: List[ParsedResponse] = RTNMParser(batch, LOG_NAME).decode_and_parse_raw_responses()
+
+    def parse() -> Tuple[int, int]:
+        return len(RTNMParser(batch, LOG_NAME).decode_and_parse_raw_responses()), raw_bytes
+
+    results: List[BenchmarkResult] = [measure(f"parse {name}", parse, repeat)]
+    for output, uploader in uploaders.items():
+        def encode(uploader: Uploader = uploader) -> Tuple[int, int]:
+            stub.posted_bytes = 0
+            uploader.upload(parsed)
+            return len(parsed), stub.posted_bytes
+
+        results.append(measure(f"encode {name} {output}", encode, repeat))
+    return results
+
+
+def main():
+    """Run the benchmarks of the synthetic shapes and any recorded fixtures and print the
+    rows per second, megabytes per second and peak memory of each one
+
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-m", "--messages", dest="messages", type=int, default=1000,
+                        help="Number of messages in each synthetic batch")
+    parser.add_argument("-s", "--shapes", dest="shapes", default=",".join(SHAPES),
+                        help="Comma separated synthetic shapes to benchmark")
+    parser.add_argument("-e", "--encodings", dest="encodings", default="ems,gnmi",
+                        help="Comma separated encodings to benchmark")
+    parser.add_argument("-f", "--fixture", dest="fixtures", action="append", default=[],
+                        help="Capture segment or directory recorded with --capture to benchmark, can be given multiple times")
+    parser.add_argument("-o", "--outputs", dest="outputs", default="elasticsearch,influxdb,influxdbv2",
+                        help="Comma separated uploaders to benchmark")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="Number of timed runs")
+    args = parser.parse_args()
+    stub: StubRequest = StubRequest()
+    databases.databases.request = stub
+    all_uploaders: Dict[str, Uploader] = create_uploaders()
+    uploaders: Dict[str, Uploader] = {output.strip(): all_uploaders[output.strip()]
+                                      for output in args.outputs.split(",") if output.strip()}
+    batches: Dict[str, List[Tuple[str, bytes, Optional[str], Optional[str], str, float]]] = {}
+    for encoding in args.encodings.split(","):
+        for shape in args.shapes.split(","):
+            batches[f"{encoding.strip()}/{shape.strip()}"] = generate_batch(encoding.strip(), shape.strip(),
+                                                                            args.messages)
+    for fixture in args.fixtures:
+        batches[fixture] = load_fixture(fixture)
+    print(f"{'benchmark':32} {'rows':>10} {'rows/s':>14} {'MB/s':>10} {'peak MB':>10}")
+    for name, batch in batches.items():
+        for result in bench_batch(name, batch, uploaders, stub, args.repeat):
+            print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+.. module:: fixtures
+   :platform: Unix, Windows
+   :synopsis: Synthetic telemetry responses of varying shapes used for benchmarking
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import pathlib
+from time import time, time_ns
+from typing import List, Dict, Tuple, Optional
+from protos.gnmi_pb2 import Notification, Path, PathElem, SubscribeResponse, TypedValue, Update
+from protos.telemetry_pb2 import Telemetry, TelemetryField
+from capture.capture import read_capture, read_segment
+
+EMS_SENSOR: str = "Cisco-IOS-XR-infra-statsd-oper:infra-statistics/interfaces/interface/latest/generic-counters"
+GNMI_ORIGIN: str = "Cisco-IOS-XR-infra-statsd-oper"
+GNMI_SENSOR: List[str] = ["infra-statistics", "interfaces", "interface", "latest", "generic-counters"]
+
+# name: (rows per message, leaves per row, depth of the containers holding the leaves)
+SHAPES: Dict[str, Tuple[int, int, int]] = {
+    "small": (1, 8, 0),
+    "wide": (4, 64, 0),
+    "deep": (4, 16, 3),
+    "many-rows": (64, 8, 0),
+}
+
+
+def _ems_leaf(index: int) -> TelemetryField:
+    if index % 4 == 0:
+        return TelemetryField(name=f"string-field-{index}", string_value=f"value {index}")
+    if index % 4 == 1:
+        return TelemetryField(name=f"double-field-{index}", double_value=index * 1.5)
+    return TelemetryField(name=f"counter-field-{index}", uint64_value=index * 1000003)
+
+
+def _ems_content(leaves: int, depth: int) -> TelemetryField:
+    content: TelemetryField = TelemetryField(name="content")
+    container: TelemetryField = content
+    for level in range(depth):
+        child: TelemetryField = TelemetryField(name=f"container-{level}")
+        container.fields.append(child)
+        container = container.fields[-1]
+    for index in range(leaves):
+        container.fields.append(_ems_leaf(index))
+    return content
+
+
+def ems_telemetry(rows: int, leaves: int, depth: int, node: str = "router-1") -> Telemetry:
+    """Build a Cisco kv-GPB Telemetry message
+
+    :param rows: The number of rows (keys and content) in the message
+    :type rows: int
+    :param leaves: The number of leaves in the content of each row
+    :type leaves: int
+    :param depth: The number of containers the leaves are nested in
+    :type depth: int
+    :param node: The hostname of the device sending the message
+    :type node: str
+    :returns: The message
+
+    """
+    telemetry: Telemetry = Telemetry(node_id_str=node, subscription_id_str="bench", encoding_path=EMS_SENSOR,
+                                     msg_timestamp=time_ns() // 1000000)
+    for row in range(rows):
+        gpbkv: TelemetryField = TelemetryField(timestamp=time_ns() // 1000000)
+        keys: TelemetryField = TelemetryField(name="keys")
+        keys.fields.append(TelemetryField(name="interface-name", string_value=f"HundredGigE0/0/0/{row}"))
+        gpbkv.fields.append(keys)
+        gpbkv.fields.append(_ems_content(leaves, depth))
+        telemetry.data_gpbkv.append(gpbkv)
+    return telemetry
+
+
+def ems_message(rows: int, leaves: int, depth: int, node: str = "router-1") -> bytes:
+    """Build a serialized Cisco kv-GPB Telemetry message, see ems_telemetry"""
+    return ems_telemetry(rows, leaves, depth, node).SerializeToString()
+
+
+def _gnmi_value(index: int) -> TypedValue:
+    if index % 4 == 0:
+        return TypedValue(string_val=f"value {index}")
+    if index % 4 == 1:
+        return TypedValue(float_val=index * 1.5)
+    return TypedValue(uint_val=index * 1000003)
+
+
+def gnmi_response(rows: int, leaves: int, depth: int) -> SubscribeResponse:
+    """Build a gNMI SubscribeResponse, every row is sent as its own set of updates
+
+    :param rows: The number of rows in the message
+    :type rows: int
+    :param leaves: The number of leaves in each row
+    :type leaves: int
+    :param depth: The number of containers the leaves are nested in
+    :type depth: int
+    :returns: The message
+
+    """
+    prefix: Path = Path(origin=GNMI_ORIGIN, elem=[PathElem(name=name) for name in GNMI_SENSOR])
+    prefix.elem[2].key["interface-name"] = "HundredGigE0/0/0/0"
+    notification: Notification = Notification(timestamp=time_ns(), prefix=prefix)
+    for row in range(rows):
+        containers: List[PathElem] = [PathElem(name=f"row-{row}")]
+        containers.extend(PathElem(name=f"container-{level}") for level in range(depth))
+        for index in range(leaves):
+            path: Path = Path(elem=[*containers, PathElem(name=f"field-{index}")])
+            notification.update.append(Update(path=path, val=_gnmi_value(index)))
+    return SubscribeResponse(update=notification)
+
+
+def gnmi_message(rows: int, leaves: int, depth: int) -> bytes:
+    """Build a serialized gNMI SubscribeResponse, see gnmi_response"""
+    return gnmi_response(rows, leaves, depth).SerializeToString()
+
+
+def generate_batch(encoding: str, shape: str, messages: int,
+                   devices: int = 1) -> List[Tuple[str, bytes, Optional[str], Optional[str], str, float]]:
+    """Build a batch of raw responses as they are put on the data queue by the collectors
+
+    :param encoding: Either gnmi or ems
+    :type encoding: str
+    :param shape: One of the names in SHAPES
+    :type shape: str
+    :param messages: The number of messages in the batch
+    :type messages: int
+    :param devices: The number of devices the messages are spread across
+    :type devices: int
+    :returns: The raw responses
+
+    """
+    rows, leaves, depth = SHAPES[shape]
+    batch: List[Tuple[str, bytes, Optional[str], Optional[str], str, float]] = []
+    for index in range(messages):
+        device: int = index % devices
+        if encoding == "gnmi":
+            batch.append(("gnmi", gnmi_message(rows, leaves, depth), f"router-{device}", "7.3.2",
+                          f"10.0.0.{device}", time()))
+        else:
+            batch.append(("ems", ems_message(rows, leaves, depth, f"router-{device}"), None, "7.3.2",
+                          f"10.0.0.{device}", time()))
+    return batch
+
+
+def load_fixture(path: str) -> List[Tuple[str, bytes, Optional[str], Optional[str], str, float]]:
+    """Load the raw responses recorded by RTNM with --capture
+
+    :param path: A capture segment or a capture directory, whose segments are read in order
+    :type path: str
+    :returns: The raw responses
+
+    """
+    capture: pathlib.Path = pathlib.Path(path)
+    return list(read_capture(capture) if capture.is_dir() else read_segment(capture))
@@ -0,0 +1,135 @@
+"""
+.. module:: capture
+   :platform: Unix, Windows
+   :synopsis: Capture of the raw responses sent by the devices into segment files and reading them back
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from datetime import datetime
+from pathlib import Path
+from struct import Struct
+from typing import List, Tuple, Optional, Iterator, BinaryIO, Any
+
+SEGMENT_MAGIC: bytes = b"RTNMCAP1"
+# receive time, encoding, hostname length, version length, ip length, payload length
+RECORD_HEADER: Struct = Struct(">dBHHHI")
+ENCODINGS: Tuple[str, ...] = ("gnmi", "ems")
+# Length of a hostname or version of None
+NONE_LENGTH: int = 0xFFFF
+
+
+def _encode_str(value: Optional[str]) -> Tuple[int, bytes]:
+    if value is None:
+        return NONE_LENGTH, b""
+    data: bytes = value.encode()
+    return len(data), data
+
+
+def _decode_str(data: bytes, length: int) -> Optional[str]:
+    if length == NONE_LENGTH:
+        return None
+    return data.decode()
+
+
+class CaptureWriter:
+    """Appends raw responses to length prefixed segment files, a new segment is started once the current one
+    reaches the segment size. Each segment starts with SEGMENT_MAGIC followed by records made of RECORD_HEADER,
+    the hostname, version and ip of the device and the payload
+
+    :param directory: The directory the segments are written to
+    :type directory: Path
+    :param segment_size: The size in bytes at which a new segment is started
+    :type segment_size: int
+
+    """
+
+    def __init__(self, directory: Path, segment_size: int = 268435456) -> None:
+        self.directory: Path = directory
+        self.segment_size: int = segment_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._prefix: str = f"capture-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        self._sequence: int = 0
+        self._file: Optional[BinaryIO] = None
+        self._size: int = 0
+
+    def _open_segment(self) -> None:
+        self.close()
+        path: Path = self.directory / f"{self._prefix}-{self._sequence:06d}.seg"
+        self._sequence += 1
+        self._file = open(path, "wb", buffering=1048576)
+        self._file.write(SEGMENT_MAGIC)
+        self._size = len(SEGMENT_MAGIC)
+
+    def write(self, response: Tuple[Any, ...]) -> None:
+        """Append a raw response
+
+        :param response: The raw response as put on the data queue (encoding, bytes, hostname, version, ip,
+                         receive time)
+        :type response: Tuple[Any, ...]
+
+        """
+        if self._file is None or self._size >= self.segment_size:
+            self._open_segment()
+        hostname_length, hostname = _encode_str(response[2])
+        version_length, version = _encode_str(response[3])
+        ip: bytes = response[4].encode()
+        payload: bytes = response[1]
+        record: List[bytes] = [
+            RECORD_HEADER.pack(response[5], ENCODINGS.index(response[0]), hostname_length, version_length,
+                               len(ip), len(payload)),
+            hostname, version, ip, payload
+        ]
+        self._file.writelines(record)
+        self._size += RECORD_HEADER.size + len(hostname) + len(version) + len(ip) + len(payload)
+
+    def flush(self) -> None:
+        """Write the buffered records of the current segment to disk"""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        """Close the current segment"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_segment(path: Path) -> Iterator[Tuple[str, bytes, Optional[str], Optional[str], str, float]]:
+    """Read the raw responses of a segment, a record cut short by RTNM stopping ends the segment
+
+    :param path: The segment file
+    :type path: Path
+    :returns: The raw responses (encoding, bytes, hostname, version, ip, receive time)
+    :raises: ValueError if the file isn't a segment
+
+    """
+    with open(path, "rb", buffering=1048576) as file_desc:
+        if file_desc.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError(f"{path} isn't a capture segment")
+        while True:
+            header: bytes = file_desc.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            receive_time, encoding, hostname_length, version_length, ip_length, payload_length = \
+                RECORD_HEADER.unpack(header)
+            sizes: List[int] = [0 if length == NONE_LENGTH else length for length in (hostname_length, version_length)]
+            body_length: int = sizes[0] + sizes[1] + ip_length + payload_length
+            body: bytes = file_desc.read(body_length)
+            if len(body) < body_length:
+                return
+            ip_start: int = sizes[0] + sizes[1]
+            payload_start: int = ip_start + ip_length
+            yield (ENCODINGS[encoding], body[payload_start:], _decode_str(body[:sizes[0]], hostname_length),
+                   _decode_str(body[sizes[0]:ip_start], version_length), body[ip_start:payload_start].decode(),
+                   receive_time)
+
+
+def read_capture(directory: Path) -> Iterator[Tuple[str, bytes, Optional[str], Optional[str], str, float]]:
+    """Read the raw responses of every segment in a directory in the order they were captured
+
+    :param directory: The directory of the segments
+    :type directory: Path
+    :returns: The raw responses (encoding, bytes, hostname, version, ip, receive time)
+
+    """
+    for path in sorted(directory.glob("capture-*.seg")):
+        yield from read_segment(path)
@@ -0,0 +1,306 @@
+"""
+.. module:: AsyncDialInClients
+   :platform: Unix, Windows
+   :synopsis: A gRPC asyncio collector multiplexing the dial in subscriptions of many devices
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import asyncio
+import grpc
+from multiprocessing import Process, Queue
+from time import time
+from typing import List, Dict, Any, Tuple, Optional
+from logging import Logger
+from protos.cisco_mdt_dial_in_pb2_grpc import gRPCConfigOperStub
+from protos.cisco_mdt_dial_in_pb2 import CreateSubsArgs
+from protos.gnmi_pb2_grpc import gNMIStub
+from protos.gnmi_pb2 import (
+    GetResponse,
+    Subscription,
+    SubscriptionList,
+    SubscribeRequest,
+    SubscribeResponse
+)
+from discovery.discovery import DiscoveryCache, input_encoding
+from connectors.ReconnectSchedulers import ReconnectScheduler, Backoff
+from connectors.QueueBatchers import QueueBatcher
+from metrics.metrics import metrics
+from loggers.loggers import category_logger
+from connectors.DialInClients import GNMI_UPDATE, GNMI_SYNC_RESPONSE, peek_subscribe_response
+from utils.utils import (
+    create_gnmi_path,
+    version_request,
+    parse_version_response,
+    hostname_request,
+    parse_hostname_response
+)
+
+
+class AsyncDialInDevice:
+    """The dial in subscription of a single device running in the event loop of an AsyncDialInCollector.
+    Takes the same arguments as a DialInClient
+
+    :param data_queue: The queue used from transfer the raw string data from the collector process
+    to the main process for upload
+    :type data_queue: Queue
+    :param log: The log of the collector
+    :type log: Logger
+    :param pem: The contents of the pem file if TLS is used
+    :type pem: Optional[bytes]
+    :param discovery_cache: The cache of the hostname and version of devices
+    :type discovery_cache: Optional[DiscoveryCache]
+    :param discovery_started: When the discovery of this run of RTNM started
+    :type discovery_started: float
+    :param reconnect_scheduler: The reconnect rate limit shared by every connector
+    :type reconnect_scheduler: Optional[ReconnectScheduler]
+    :param healthy_stream_time: The number of seconds a stream has to stay up for the backoff to reset
+    :type healthy_stream_time: float
+
+    """
+
+    def __init__(self, data_queue: Queue, log: Logger, pem: Optional[bytes] = None, timeout: int = 100000000,
+                 discovery_cache: Optional[DiscoveryCache] = None, discovery_started: float = 0.0,
+                 reconnect_scheduler: Optional[ReconnectScheduler] = None, healthy_stream_time: float = 60.0,
+                 **kwargs) -> None:
+        self.name: str = kwargs["name"]
+        self.options: List[Tuple[str, Any]] = [("grpc.ssl_target_name_override", "ems.cisco.com"),
+                                               ("grpc.keepalive_time_ms", 60000),
+                                               ("grpc.keepalive_timeout_ms", 50000)]
+        self._host: str = kwargs["address"]
+        self._port: str = kwargs["port"]
+        self._pem: Optional[bytes] = pem
+        self.queue: Queue = data_queue
+        self.log: Logger = log
+        self._metadata: List[Tuple[str, str]] = [
+            ("username", kwargs["username"]),
+            ("password", kwargs["password"])
+        ]
+        self._format: str = kwargs["format"]
+        self.encoding: int = kwargs["encoding"]
+        self.retry: bool = kwargs["retry"]
+        self.compression: bool = kwargs["compression"]
+        self.upload: bool = kwargs["upload"]
+        self.batcher: QueueBatcher = QueueBatcher(data_queue, kwargs.get("batch-count", 64),
+                                                  kwargs.get("batch-bytes", 1048576),
+                                                  kwargs.get("batch-linger-ms", 5) / 1000,
+                                                  kwargs.get("overload-policy", "block"),
+                                                  kwargs.get("overload-sample", 10), self.log)
+        self.passthrough: bool = kwargs.get("passthrough", False)
+        if self._format == "gnmi":
+            self.sub_mode: int = kwargs["subscription-mode"]
+            self.sensors: List[str] = kwargs["sensors"]
+            self.sample_interval: int = kwargs["sample-interval"]
+            self.stream_mode: int = kwargs["stream-mode"]
+        else:
+            self.subs: List[str] = kwargs["subscriptions"]
+        self._timeout: float = float(timeout)
+        self.backoff: Backoff = Backoff(1, 128, healthy_stream_time)
+        self.reconnect_scheduler: Optional[ReconnectScheduler] = reconnect_scheduler
+        self.hostname: str = ""
+        self.version: str = ""
+        self.discovery_cache: Optional[DiscoveryCache] = discovery_cache
+        self.discovery_started: float = discovery_started
+        self._discovery_loaded: bool = False
+
+    def connect(self) -> grpc.aio.Channel:
+        self._load_discovery()
+        target: str = ":".join([self._host, self._port])
+        compression: Optional[grpc.Compression] = grpc.Compression.Gzip if self.compression else None
+        if self._pem is not None:
+            credentials = grpc.ssl_channel_credentials(self._pem)
+            return grpc.aio.secure_channel(target, credentials, self.options, compression=compression)
+        return grpc.aio.insecure_channel(target, self.options, compression=compression)
+
+    async def _get_version(self, channel: grpc.aio.Channel) -> str:
+        response: GetResponse = await gNMIStub(channel).Get(version_request(), metadata=self._metadata,
+                                                            timeout=self._timeout)
+        return parse_version_response(response)
+
+    async def _get_hostname(self, channel: grpc.aio.Channel) -> str:
+        response: GetResponse = await gNMIStub(channel).Get(hostname_request(), metadata=self._metadata,
+                                                            timeout=self._timeout)
+        return parse_hostname_response(response)
+
+    def _load_discovery(self) -> None:
+        """Use the cached hostname and version of the device so it can be subscribed to immediately. If they
+        weren't discovered by this run of RTNM the discovery process refreshes them in the background, so they
+        are read again on every connection until the refreshed entry is found"""
+        if self.discovery_cache is None or self._discovery_loaded:
+            return
+        entry: Optional[Dict[str, Any]] = self.discovery_cache.get(self._host, input_encoding(self._format))
+        if entry is not None:
+            self.hostname = entry["hostname"]
+            self.version = entry["version"]
+        self._discovery_loaded = entry is None or entry["time"] >= self.discovery_started
+
+    async def _backoff(self) -> None:
+        metrics.inc("rtnm_reconnects_total", device=self._host)
+        await asyncio.sleep(self.backoff.next_delay())
+
+    async def _schedule_connect(self) -> None:
+        if self.reconnect_scheduler is not None:
+            await asyncio.sleep(self.reconnect_scheduler.reserve())
+
+    def _subscribe_request(self) -> SubscribeRequest:
+        subs: List[Subscription] = [
+            Subscription(path=create_gnmi_path(sensor), mode=self.sub_mode, sample_interval=self.sample_interval)
+            for sensor in self.sensors
+        ]
+        sub_list: SubscriptionList = SubscriptionList(subscription=subs, mode=self.stream_mode, encoding=self.encoding)
+        return SubscribeRequest(subscribe=sub_list)
+
+    async def gnmi_subscribe(self) -> None:
+        """ Subscribe to a device via gNMI"""
+        retry: bool = True
+        while retry:
+            channel: Optional[grpc.aio.Channel] = None
+            try:
+                await self._schedule_connect()
+                channel = self.connect()
+                if not self.hostname:
+                    self.hostname = await self._get_hostname(channel)
+                if not self.version:
+                    self.version = await self._get_version(channel)
+                if self.passthrough:
+                    subscribe = channel.stream_stream("/gnmi.gNMI/Subscribe",
+                                                      request_serializer=SubscribeRequest.SerializeToString,
+                                                      response_deserializer=None)
+                else:
+                    subscribe = gNMIStub(channel).Subscribe
+                call = subscribe(iter([self._subscribe_request()]), metadata=self._metadata, timeout=self._timeout)
+                self.backoff.connected()
+                async for response in call:
+                    if self.passthrough:
+                        field: int = peek_subscribe_response(response)
+                        if field == GNMI_SYNC_RESPONSE:
+                            self.log.debug("Got all values atleast once from %s", self.name)
+                            continue
+                        elif field != GNMI_UPDATE:
+                            decoded: SubscribeResponse = SubscribeResponse.FromString(response)
+                            if decoded.error.message:
+                                raise grpc.RpcError(decoded.error.message)
+                            elif not decoded.HasField("update"):
+                                continue
+                        raw_response: bytes = response
+                    else:
+                        if response.error.message:
+                            raise grpc.RpcError(response.error.message)
+                        elif response.sync_response:
+                            self.log.debug("Got all values atleast once from %s", self.name)
+                            continue
+                        raw_response = response.SerializeToString()
+                    if self.upload:
+                        await self.batcher.put_async(("gnmi", raw_response, self.hostname, self.version, self._host,
+                                                      time()))
+            except asyncio.CancelledError:
+                self.retry = False
+                raise
+            except Exception as error:
+                self.log.error("%s: %s", self.name, error)
+            finally:
+                await self.batcher.flush_async()
+                if channel is not None:
+                    self.log.info(f"Closing channel for {self.name}")
+                    await channel.close()
+                retry = self.retry
+                if retry:
+                    await self._backoff()
+
+    async def ems_subscribe(self) -> None:
+        """ Subscribe to a device via Cisco EMS"""
+        retry: bool = True
+        while retry:
+            channel: Optional[grpc.aio.Channel] = None
+            try:
+                await self._schedule_connect()
+                channel = self.connect()
+                if not self.version:
+                    self.version = await self._get_version(channel)
+                sub_args: CreateSubsArgs = CreateSubsArgs(ReqId=1, encode=self.encoding, Subscriptions=self.subs)
+                self.backoff.connected()
+                async for segment in gRPCConfigOperStub(channel).CreateSubs(sub_args, timeout=self._timeout,
+                                                                            metadata=self._metadata):
+                    if segment.errors:
+                        raise grpc.RpcError(segment.errors)
+                    elif self.upload:
+                        await self.batcher.put_async(("ems", segment.data, None, self.version, self._host, time()))
+            except asyncio.CancelledError:
+                self.retry = False
+                raise
+            except Exception as error:
+                self.log.error("%s: %s", self.name, error)
+            finally:
+                await self.batcher.flush_async()
+                if channel is not None:
+                    self.log.info(f"Closing channel for {self.name}")
+                    await channel.close()
+                retry = self.retry
+                if retry:
+                    await self._backoff()
+
+    async def run(self) -> None:
+        linger: asyncio.Task = asyncio.ensure_future(self.batcher.linger_task())
+        try:
+            if self._format == "gnmi":
+                await self.gnmi_subscribe()
+            else:
+                await self.ems_subscribe()
+        finally:
+            linger.cancel()
+
+
+class AsyncDialInCollector(Process):
+    """A process running the dial in subscriptions of many devices in a single gRPC asyncio event loop
+
+    :param collector_id: The index of the collector
+    :type collector_id: int
+    :param data_queue: The queue used from transfer the raw string data from the collector process
+    to the main process for upload
+    :type data_queue: Queue
+    :param log_name: The log name that will be used for logging
+    :type log_name: str
+    :param inputs: The arguments of the dial in inputs assigned to this collector, keyed by section name
+    :type inputs: Dict[str, Dict[str, Any]]
+    :param discovery_cache: The cache of the hostname and version of devices
+    :type discovery_cache: Optional[DiscoveryCache]
+    :param discovery_started: When the discovery of this run of RTNM started
+    :type discovery_started: float
+    :param reconnect_scheduler: The reconnect rate limit shared by every connector
+    :type reconnect_scheduler: Optional[ReconnectScheduler]
+    :param healthy_stream_time: The number of seconds a stream has to stay up for the backoff to reset
+    :type healthy_stream_time: float
+
+    """
+
+    def __init__(self, collector_id: int, data_queue: Queue, log_name: str, inputs: Dict[str, Dict[str, Any]],
+                 discovery_cache: Optional[DiscoveryCache] = None, discovery_started: float = 0.0,
+                 reconnect_scheduler: Optional[ReconnectScheduler] = None, healthy_stream_time: float = 60.0) -> None:
+        super().__init__(name=f"{log_name}-collector-{collector_id}")
+        self.queue: Queue = data_queue
+        self.log: Logger = category_logger(log_name, "collector")
+        self.inputs: Dict[str, Dict[str, Any]] = inputs
+        self.discovery_cache: Optional[DiscoveryCache] = discovery_cache
+        self.discovery_started: float = discovery_started
+        self.reconnect_scheduler: Optional[ReconnectScheduler] = reconnect_scheduler
+        self.healthy_stream_time: float = healthy_stream_time
+
+    def _create_devices(self) -> List[AsyncDialInDevice]:
+        devices: List[AsyncDialInDevice] = []
+        for name, device_args in self.inputs.items():
+            pem: Optional[bytes] = None
+            if "pem-file" in device_args:
+                with open(device_args["pem-file"], "rb") as file_desc:
+                    pem = file_desc.read()
+            devices.append(AsyncDialInDevice(self.queue, self.log, pem, discovery_cache=self.discovery_cache,
+                                             discovery_started=self.discovery_started,
+                                             reconnect_scheduler=self.reconnect_scheduler,
+                                             healthy_stream_time=self.healthy_stream_time,
+                                             **{**device_args, "name": name}))
+        return devices
+
+    async def _collect(self) -> None:
+        devices: List[AsyncDialInDevice] = self._create_devices()
+        self.log.info("Starting collector [%s] for %s devices", self.name, len(devices))
+        await asyncio.gather(*[device.run() for device in devices])
+
+    def run(self) -> None:
+        asyncio.run(self._collect())
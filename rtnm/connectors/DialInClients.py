@@ -4,26 +4,58 @@
    :synopsis: Class file of the gRPC connectors for dial in subscriptions
 .. moduleauthor:: Greg Brown <gsb5067@gmail.com>
 """
-import json
-import random
 import grpc
 from multiprocessing import Process, Queue
-from typing import List, Tuple
-from time import sleep
-from logging import Logger, getLogger
+from typing import List, Tuple, Dict, Any, Optional
+from time import sleep, time
+from logging import Logger
 from protos.cisco_mdt_dial_in_pb2_grpc import gRPCConfigOperStub
 from protos.cisco_mdt_dial_in_pb2 import CreateSubsArgs
 from protos.gnmi_pb2_grpc import gNMIStub
 from protos.gnmi_pb2 import (
-    Encoding,
-    GetRequest,
     GetResponse,
     Subscription,
     SubscriptionList,
     SubscribeRequest,
-    TypedValue
+    SubscribeResponse
 )
-from utils.utils import create_gnmi_path
+from discovery.discovery import DiscoveryCache, input_encoding
+from connectors.ReconnectSchedulers import ReconnectScheduler, Backoff
+from connectors.QueueBatchers import QueueBatcher
+from metrics.metrics import metrics
+from loggers.loggers import category_logger
+from utils.utils import (
+    create_gnmi_path,
+    version_request,
+    parse_version_response,
+    hostname_request,
+    parse_hostname_response
+)
+
+# Field numbers of the response oneof of a gNMI SubscribeResponse
+GNMI_UPDATE: int = 1
+GNMI_SYNC_RESPONSE: int = 3
+GNMI_ERROR: int = 4
+
+
+def peek_subscribe_response(raw_response: bytes) -> int:
+    """Get the field number of the first field of a serialized SubscribeResponse without
+    deserializing it. Encoders write fields in field number order, so this is the field set
+    in the response oneof unless the message only has extensions
+
+    :param raw_response: The serialized SubscribeResponse
+    :type raw_response: bytes
+    :returns: The field number of the first field or 0 if the message is empty
+
+    """
+    key: int = 0
+    shift: int = 0
+    for byte in raw_response[:5]:
+        key |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return key >> 3
+        shift += 7
+    return 0
 
 
 class DialInClient(Process):
@@ -38,7 +70,10 @@ class DialInClient(Process):
 
     """
 
-    def __init__(self, data_queue: Queue, log_name: str, options: List[Tuple[str, str]] = None, timeout: int = 100000000, *args, **kwargs):
+    def __init__(self, data_queue: Queue, log_name: str, options: List[Tuple[str, str]] = None, timeout: int = 100000000,
+                 discovery_cache: Optional[DiscoveryCache] = None, discovery_started: float = 0.0,
+                 reconnect_scheduler: Optional[ReconnectScheduler] = None, healthy_stream_time: float = 60.0,
+                 *args, **kwargs):
         super().__init__(name=kwargs["name"])
         if options is None:
             opts: List[Tuple[str, str]] = [("grpc.ssl_target_name_override", "ems.cisco.com"), ("grpc.keepalive_time_ms", 60000), ("grpc.keepalive_timeout_ms", 50000)]
@@ -46,7 +81,7 @@ class DialInClient(Process):
         self._host: str = kwargs["address"]
         self._port: int = kwargs["port"]
         self.queue: Queue = data_queue
-        self.log: Logger = getLogger(log_name)
+        self.log: Logger = category_logger(log_name, "collector")
         self._metadata: List[Tuple[str, str]] = [
             ("username", kwargs["username"]),
             ("password", kwargs["password"])
@@ -57,6 +92,12 @@ class DialInClient(Process):
         self.retry: bool = kwargs["retry"]
         self.compression: bool = kwargs["compression"]
         self.upload: bool = kwargs["upload"]
+        self.batcher: QueueBatcher = QueueBatcher(data_queue, kwargs.get("batch-count", 64),
+                                                  kwargs.get("batch-bytes", 1048576),
+                                                  kwargs.get("batch-linger-ms", 5) / 1000,
+                                                  kwargs.get("overload-policy", "block"),
+                                                  kwargs.get("overload-sample", 10), self.log)
+        self.passthrough: bool = kwargs.get("passthrough", False)
         if self._format == "gnmi":
             self.sub_mode = kwargs["subscription-mode"]
             self.sensors: List[str] = kwargs["sensors"]
@@ -68,8 +109,13 @@ class DialInClient(Process):
         self.gnmi_stub: gNMIStub = None
         self.cisco_ems_stub: gRPCConfigOperStub = None
         self.log.info(f"Starting dial in client [%s]", self.name)
-        self.min_backoff_time: int = 1
-        self.max_backoff_time: int = 128
+        self.backoff: Backoff = Backoff(1, 128, healthy_stream_time)
+        self.reconnect_scheduler: Optional[ReconnectScheduler] = reconnect_scheduler
+        self.hostname: str = ""
+        self.version: str = ""
+        self.discovery_cache: Optional[DiscoveryCache] = discovery_cache
+        self.discovery_started: float = discovery_started
+        self._discovery_loaded: bool = False
 
     def _get_gnmi_stub(self) -> gNMIStub:
         self.gnmi_stub: gNMIStub = gNMIStub(self.channel)
@@ -81,64 +127,70 @@ class DialInClient(Process):
 
     def _get_version(self) -> str:
         stub: gNMIStub = self._get_gnmi_stub()
-        get_message: GetRequest = GetRequest(
-            path=[create_gnmi_path(
-                'Cisco-IOS-XR-install-oper:install/version')],
-            type=GetRequest.DataType.Value("STATE"),
-            encoding=Encoding.Value("JSON_IETF"),
-        )
-        response: GetResponse = stub.Get(get_message, metadata=self._metadata, timeout=self._timeout)
-        def _parse_version(version: GetResponse) -> str:
-            rc = ""
-            for notification in version.notification:
-                for update in notification.update:
-                    if update.val.json_ietf_val:
-                        rc = json.loads(update.val.json_ietf_val)
-                        return rc["label"]
-                    else:
-                        return "Error"
-        return _parse_version(response)
+        response: GetResponse = stub.Get(version_request(), metadata=self._metadata, timeout=self._timeout)
+        return parse_version_response(response)
 
     def _get_hostname(self) -> str:
         stub: gNMIStub = self._get_gnmi_stub()
-        get_message: GetRequest = GetRequest(
-            path=[create_gnmi_path("Cisco-IOS-XR-shellutil-cfg:host-names")],
-            type=GetRequest.DataType.Value("CONFIG"),
-            encoding=Encoding.Value("JSON_IETF"),
-        )
-        response: GetResponse = stub.Get(get_message, metadata=self._metadata, timeout=self._timeout)
-        def _parse_hostname(hostname_response: GetResponse) -> str:
-            for notification in hostname_response.notification:
-                for update in notification.update:
-                    hostname: str = update.val.json_ietf_val
-                    if not hostname:
-                        return "Error"
-                    return json.loads(hostname)["host-name"]
-
-        return _parse_hostname(response)
+        response: GetResponse = stub.Get(hostname_request(), metadata=self._metadata, timeout=self._timeout)
+        return parse_hostname_response(response)
 
     def _backoff(self) -> None:
-        delay: float = self.min_backoff_time + random.randint(0, 1000) / 1000.0
-        sleep(delay)
-        if self.min_backoff_time < self.max_backoff_time:
-            self.min_backoff_time *= 2
+        metrics.inc("rtnm_reconnects_total", device=self._host)
+        sleep(self.backoff.next_delay())
 
     def sub_to_path(self, request):
         yield request
 
+    def _load_discovery(self) -> None:
+        """Use the cached hostname and version of the device so it can be subscribed to immediately. If they
+        weren't discovered by this run of RTNM the discovery process refreshes them in the background, so they
+        are read again on every connection until the refreshed entry is found"""
+        if self.discovery_cache is None or self._discovery_loaded:
+            return
+        entry: Optional[Dict[str, Any]] = self.discovery_cache.get(self._host, input_encoding(self._format))
+        if entry is not None:
+            self.hostname = entry["hostname"]
+            self.version = entry["version"]
+        self._discovery_loaded = entry is None or entry["time"] >= self.discovery_started
+
+    def _passthrough_subscribe(self, sub_request: SubscribeRequest) -> None:
+        """Subscribe with an identity response deserializer so the serialized responses go
+        straight to the queue, only errors are deserialized
+
+        :param sub_request: The subscribe request to send
+        :type sub_request: SubscribeRequest
+
+        """
+        subscribe = self.channel.stream_stream("/gnmi.gNMI/Subscribe",
+                                               request_serializer=SubscribeRequest.SerializeToString,
+                                               response_deserializer=None)
+        self.backoff.connected()
+        for raw_response in subscribe(self.sub_to_path(sub_request), metadata=self._metadata, timeout=self._timeout):
+            field: int = peek_subscribe_response(raw_response)
+            if field == GNMI_UPDATE:
+                if self.upload:
+                    self.batcher.put(("gnmi", raw_response, self.hostname, self.version, self._host, time()))
+            elif field == GNMI_SYNC_RESPONSE:
+                self.log.debug("Got all values atleast once")
+            else:
+                response: SubscribeResponse = SubscribeResponse.FromString(raw_response)
+                if response.error.message:
+                    raise grpc.RpcError(response.error.message)
+                elif response.HasField("update") and self.upload:
+                    self.batcher.put(("gnmi", raw_response, self.hostname, self.version, self._host, time()))
+
     def gnmi_subscribe(self) -> None:
         """ Subscribe to a device via gNMI"""
         retry: bool = True
         subs: List[Subscription] = []
-        hostname: str = ""
-        version: str = ""
         while retry:
             try:
                 self.connect()
-                if not hostname:
-                    hostname: str = self._get_hostname()
-                if not version:
-                    version: str = self._get_version()
+                if not self.hostname:
+                    self.hostname = self._get_hostname()
+                if not self.version:
+                    self.version = self._get_version()
                 for sensor in self.sensors:
                     subs.append(
                         Subscription(path=create_gnmi_path(sensor), mode=self.sub_mode,
@@ -147,7 +199,11 @@ class DialInClient(Process):
                     subscription=subs, mode=self.stream_mode, encoding=self.encoding,
                 )
                 sub_request: SubscribeRequest = SubscribeRequest(subscribe=sub_list)
+                if self.passthrough:
+                    self._passthrough_subscribe(sub_request)
+                    continue
                 stub: gNMIStub = self._get_gnmi_stub()
+                self.backoff.connected()
                 for response in stub.Subscribe(self.sub_to_path(sub_request), metadata=self._metadata, timeout=self._timeout):
                     if response.error.message:
                         raise grpc.RpcError(response.error.message)
@@ -155,12 +211,13 @@ class DialInClient(Process):
                         self.log.debug("Got all values atleast once")
                     else:
                         if self.upload:
-                            self.queue.put_nowait(("gnmi", response.SerializeToString(), hostname, version, self._host))
+                            self.batcher.put(("gnmi", response.SerializeToString(), self.hostname, self.version, self._host, time()))
             except grpc.RpcError as error:
                 self.log.error(error)
             except Exception as error:
                 self.log.error(error)
             finally:
+                self.batcher.flush()
                 self.disconnect()
                 retry = self.retry
                 if retry:
@@ -168,44 +225,52 @@ class DialInClient(Process):
 
     def ems_subscribe(self) -> None:
         retry: bool = True
-        version: str = ""
         while retry:
             try:
                 self.connect()
-                if not version:
-                    version: str = self._get_version()
+                if not self.version:
+                    self.version = self._get_version()
                 stub: gRPCConfigOperStub = self._get_ems_stub()
                 sub_args: CreateSubsArgs = CreateSubsArgs(ReqId=1, encode=self.encoding,
                                                           Subscriptions=self.subs)
+                self.backoff.connected()
                 for segment in stub.CreateSubs(sub_args, timeout=self._timeout,
                                                metadata=self._metadata):
                     if segment.errors:
                         raise grpc.RpcError(segment.errors)
                     else:
                         if self.upload:
-                            self.queue.put_nowait(("ems", segment.data, None, version, self._host))
+                            self.batcher.put(("ems", segment.data, None, self.version, self._host, time()))
             except grpc.RpcError as error:
                 self.log.error(error)
                 retry = self.retry
             except Exception as error:
                 self.log.error(error)
             finally:
+                self.batcher.flush()
                 self.disconnect()
                 if retry:
                     self._backoff()
 
-    def connect(self) -> None:
+    def _create_channel(self) -> grpc.Channel:
         if self.compression:
-            self.channel = grpc.insecure_channel(":".join([self._host, self._port]), self.options,
-                                                 compression=grpc.Compression.Gzip)
+            return grpc.insecure_channel(":".join([self._host, self._port]), self.options,
+                                         compression=grpc.Compression.Gzip)
         else:
-            self.channel = grpc.insecure_channel(":".join([self._host, self._port]), self.options)
+            return grpc.insecure_channel(":".join([self._host, self._port]), self.options)
+
+    def connect(self) -> None:
+        if self.reconnect_scheduler is not None:
+            sleep(self.reconnect_scheduler.reserve())
+        self._load_discovery()
+        self.channel = self._create_channel()
 
     def disconnect(self) -> None:
         self.log.info(f"Closing channel for {self.name}")
         self.channel.close()
 
     def run(self):
+        self.batcher.start_linger_thread()
         if self._format == "gnmi":
             self.gnmi_subscribe()
         else:
@@ -217,10 +282,10 @@ class TLSDialInClient(DialInClient):
         super().__init__(*args, **kwargs)
         self._pem = pem
 
-    def connect(self):
+    def _create_channel(self) -> grpc.Channel:
         credentials = grpc.ssl_channel_credentials(self._pem)
         if self.compression:
-            self.channel = grpc.secure_channel(
+            return grpc.secure_channel(
                 ":".join([self._host, self._port]), credentials, self.options, compression=grpc.Compression.Gzip)
         else:
-            self.channel = grpc.secure_channel(":".join([self._host, self._port]), credentials, self.options)
+            return grpc.secure_channel(":".join([self._host, self._port]), credentials, self.options)
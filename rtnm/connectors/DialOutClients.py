@@ -6,9 +6,10 @@
 """
 import json
 import gzip
-from logging import getLogger, Logger
+from logging import Logger
 from datetime import datetime
 from struct import Struct
+from time import time
 from typing import List, Dict, Tuple, Any
 from concurrent.futures import ThreadPoolExecutor, Future
 from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest, HTTPResponse
@@ -19,6 +20,9 @@ from tornado.process import fork_processes
 from tornado.ioloop import IOLoop
 from tornado.iostream import StreamClosedError
 from multiprocessing import Process, Queue
+from connectors.QueueBatchers import QueueBatcher
+from metrics.metrics import metrics
+from loggers.loggers import category_logger
 
 
 
@@ -42,12 +46,18 @@ class DialOutClient(Process, TCPServer):
         TCPServer.__init__(self, max_buffer_size=10485760000, read_chunk_size=104857600)
         self.address: str = inputs["address"]
         self.port: int = inputs["port"]
-        self.log: Logger = getLogger(log_name)
+        self.log: Logger = category_logger(log_name, "collector")
         self.log.info("Starting dial out client[%s]", self.name)
         self.url: str = f"http://{self.address}:{self.port}"
         self._header_size: int = 12
         self._header_struct: Struct = Struct(">hhhhi")
         self.data_queue: Queue = data_queue
+        self.batch_count: int = inputs.get("batch-count", 64)
+        self.batch_bytes: int = inputs.get("batch-bytes", 1048576)
+        self.batch_linger: float = inputs.get("batch-linger-ms", 5) / 1000
+        self.overload_policy: str = inputs.get("overload-policy", "block")
+        self.overload_sample: int = inputs.get("overload-sample", 10)
+        self.batcher: QueueBatcher = None
         
     async def handle_stream(self, stream: IOStream, address: Tuple[str, str]) -> None:
         """
@@ -61,6 +71,7 @@ class DialOutClient(Process, TCPServer):
 
         try:
             self.log.info(f"Got Connection from {address[0]}:{address[1]}")
+            metrics.inc("rtnm_dial_out_connections_total", device=address[0])
             while not stream.closed():
                 header_data: bytes = await stream.read_bytes(self._header_size)
                 (msg_type, encode_type, msg_version, flags, msg_length,) = self._header_struct.unpack(header_data)
@@ -70,7 +81,7 @@ class DialOutClient(Process, TCPServer):
                 while len(msg_data) < msg_length:
                     packet: bytes = await stream.read_bytes(msg_length - len(msg_data))
                     msg_data += packet
-                self.data_queue.put_nowait(("ems", msg_data, None, None, address[0]))
+                await self.batcher.put_async(("ems", msg_data, None, None, address[0], time()))
         except StreamClosedError as error:
             self.log.error(f'{address[0]}:{address[1]}  {error}')
             stream.close()
@@ -81,5 +92,8 @@ class DialOutClient(Process, TCPServer):
         fork_processes(0)
         self.log.info("Started dial out server listening on %s:%s", self.address, self.port)
         self.add_sockets(sockets)
+        self.batcher = QueueBatcher(self.data_queue, self.batch_count, self.batch_bytes, self.batch_linger,
+                                    self.overload_policy, self.overload_sample, self.log)
+        IOLoop.current().spawn_callback(self.batcher.linger_task)
         IOLoop.current().set_default_executor(ThreadPoolExecutor(10))
         IOLoop.current().start()
@@ -0,0 +1,315 @@
+"""
+.. module:: QueueBatchers
+   :platform: Unix, Windows
+   :synopsis: Micro-batching of the raw responses put on the data queue by the connectors
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import asyncio
+from logging import Logger
+from multiprocessing import Queue
+from queue import Full, Empty
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import List, Tuple, Optional, Any, Dict, Iterator
+from metrics.metrics import metrics, SIZE_BUCKETS
+
+OVERLOAD_POLICIES = ("block", "drop-newest", "drop-oldest", "sample")
+
+
+def _read_varint(data: memoryview, pos: int) -> Tuple[int, int]:
+    value: int = 0
+    shift: int = 0
+    while True:
+        byte: int = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _length_delimited(data: memoryview) -> Iterator[Tuple[int, memoryview]]:
+    """Walk the top level fields of a protobuf message yielding the length delimited ones"""
+    pos: int = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        wire_type: int = key & 0x7
+        if wire_type == 0:
+            _, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            yield key >> 3, data[pos:pos + length]
+            pos += length
+        else:
+            return
+
+
+def peek_sensor_path(response: Tuple[Any, ...]) -> str:
+    """Get the sensor path of a raw response without decoding it, used for accounting the responses dropped
+    under overload. That is the encoding path of a Cisco EMS Telemetry message and the prefix of the
+    first notification of a gNMI SubscribeResponse
+
+    :param response: The raw response as put on the data queue (encoding, bytes, hostname, version, ip, receive time)
+    :type response: Tuple[Any, ...]
+    :returns: The sensor path or an empty string if it can't be found
+
+    """
+    try:
+        data: memoryview = memoryview(response[1])
+        if response[0] == "ems":
+            for field, value in _length_delimited(data):
+                if field == 6:
+                    return bytes(value).decode()
+            return ""
+        for field, notification in _length_delimited(data):
+            if field == 1:
+                for notification_field, prefix in _length_delimited(notification):
+                    if notification_field == 2:
+                        origin: str = ""
+                        elems: List[str] = []
+                        for path_field, value in _length_delimited(prefix):
+                            if path_field == 2:
+                                origin = bytes(value).decode()
+                            elif path_field == 3:
+                                for elem_field, name in _length_delimited(value):
+                                    if elem_field == 1:
+                                        elems.append(bytes(name).decode())
+                        path: str = "/".join(elems)
+                        return f"{origin}:{path}" if origin else path
+                return ""
+    except (IndexError, UnicodeDecodeError):
+        pass
+    return ""
+
+
+class QueueBatcher:
+    """Accumulate the raw responses of a connector and put them on the data queue as a list,
+    so the lock, pickling and pipe write of a put is paid once per batch instead of once per message.
+    A batch is put once it reaches a number of messages or bytes, or once its oldest message has
+    waited for the linger time
+
+    :param queue: The data queue read by the main process
+    :type queue: Queue
+    :param max_count: The maximum number of messages in a batch
+    :type max_count: int
+    :param max_bytes: The maximum number of payload bytes in a batch
+    :type max_bytes: int
+    :param linger: The maximum number of seconds a message waits in a batch
+    :type linger: float
+    :param overload_policy: What to do when the bounded data queue is full. block waits for room, which stops
+                            reading the stream so gRPC or TCP flow control pushes back on the device. drop-newest
+                            drops the batch being put, drop-oldest evicts the oldest batch on the queue and
+                            sample keeps one out of every overload_sample responses until the queue has room again
+    :type overload_policy: str
+    :param overload_sample: The one out of every N responses kept by the sample policy
+    :type overload_sample: int
+    :param log: The logger the dropped responses are reported to
+    :type log: Logger
+    :param report_interval: The minimum number of seconds between reports of the dropped responses
+    :type report_interval: float
+
+    """
+
+    def __init__(self, queue: Queue, max_count: int = 64, max_bytes: int = 1048576, linger: float = 0.005,
+                 overload_policy: str = "block", overload_sample: int = 10, log: Optional[Logger] = None,
+                 report_interval: float = 10.0) -> None:
+        self.queue: Queue = queue
+        self.max_count: int = max_count
+        self.max_bytes: int = max_bytes
+        self.linger: float = linger
+        self.overload_policy: str = overload_policy
+        self.overload_sample: int = max(1, overload_sample)
+        self.log: Optional[Logger] = log
+        self.report_interval: float = report_interval
+        self.drops: Dict[Tuple[str, str], int] = {}
+        self._reported: Dict[Tuple[str, str], int] = {}
+        self._last_report: float = monotonic()
+        self._overloaded: bool = False
+        self._sampled: int = 0
+        self._lock: Lock = Lock()
+        self._pending: List[Tuple[Any, ...]] = []
+        self._bytes: int = 0
+        self._oldest: float = 0.0
+        # Created in the event loop by the first batch put from it
+        self._put_lock: Optional[asyncio.Lock] = None
+
+    def put(self, response: Tuple[Any, ...]) -> None:
+        """Add a raw response to the current batch
+
+        :param response: The raw response as put on the data queue (encoding, bytes, hostname, version, ip, receive time)
+        :type response: Tuple[Any, ...]
+
+        """
+        with self._lock:
+            if self._add(response):
+                self._flush()
+
+    async def put_async(self, response: Tuple[Any, ...]) -> None:
+        """Add a raw response to the current batch from an event loop. Under the block policy a full data queue
+        is waited on in the default executor, so only the stream of this connector stops being read while the
+        other connectors of the event loop keep going
+
+        :param response: The raw response as put on the data queue (encoding, bytes, hostname, version, ip, receive time)
+        :type response: Tuple[Any, ...]
+
+        """
+        batch: List[Tuple[Any, ...]] = []
+        with self._lock:
+            if self._add(response):
+                if self.overload_policy == "block":
+                    batch = self._take()
+                else:
+                    self._flush()
+        if batch:
+            await self._put_from_loop(batch)
+
+    def _add(self, response: Tuple[Any, ...]) -> bool:
+        # Returns if the batch has to be put
+        if self._overloaded and self.overload_policy == "sample":
+            self._sampled += 1
+            if self._sampled % self.overload_sample:
+                self._drop([response])
+                return False
+        if not self._pending:
+            self._oldest = monotonic()
+        self._pending.append(response)
+        self._bytes += len(response[1])
+        return (len(self._pending) >= self.max_count or self._bytes >= self.max_bytes
+                or monotonic() - self._oldest >= self.linger)
+
+    def _take(self) -> List[Tuple[Any, ...]]:
+        batch: List[Tuple[Any, ...]] = self._pending
+        self._pending = []
+        self._bytes = 0
+        if metrics.enabled and batch:
+            self._record(batch)
+        return batch
+
+    async def _put_from_loop(self, batch: List[Tuple[Any, ...]]) -> None:
+        # The lock keeps the batches in order while one of them waits in the executor
+        if self._put_lock is None:
+            self._put_lock = asyncio.Lock()
+        async with self._put_lock:
+            try:
+                self.queue.put_nowait(batch)
+            except Full:
+                await asyncio.get_running_loop().run_in_executor(None, self.queue.put, batch)
+
+    def _flush(self) -> None:
+        if self._pending:
+            batch: List[Tuple[Any, ...]] = self._take()
+            if self.overload_policy == "block":
+                self.queue.put(batch)
+                return
+            try:
+                self.queue.put_nowait(batch)
+                self._overloaded = False
+            except Full:
+                self._overloaded = True
+                if self.overload_policy == "drop-oldest":
+                    self._evict_and_put(batch)
+                elif self.overload_policy == "sample":
+                    self._sampled = 0
+                    sampled: List[Tuple[Any, ...]] = batch[::self.overload_sample]
+                    self._drop([response for index, response in enumerate(batch) if index % self.overload_sample])
+                    try:
+                        self.queue.put_nowait(sampled)
+                    except Full:
+                        self._drop(sampled)
+                else:
+                    self._drop(batch)
+            self._report()
+
+    def _evict_and_put(self, batch: List[Tuple[Any, ...]]) -> None:
+        for _ in range(3):
+            try:
+                self._drop(self.queue.get_nowait())
+            except Empty:
+                pass
+            try:
+                self.queue.put_nowait(batch)
+                return
+            except Full:
+                continue
+        self._drop(batch)
+
+    def _record(self, batch: List[Tuple[Any, ...]]) -> None:
+        received: Dict[Tuple[str, str], List[int]] = {}
+        for response in batch:
+            counts: List[int] = received.setdefault((response[4], peek_sensor_path(response)), [0, 0])
+            counts[0] += 1
+            counts[1] += len(response[1])
+        for (device, sensor), (messages, size) in received.items():
+            metrics.inc("rtnm_received_messages_total", messages, device=device, sensor=sensor)
+            metrics.inc("rtnm_received_bytes_total", size, device=device, sensor=sensor)
+        metrics.observe("rtnm_collector_batch_size", len(batch), SIZE_BUCKETS)
+
+    def _drop(self, responses: List[Tuple[Any, ...]]) -> None:
+        for response in responses:
+            key: Tuple[str, str] = (response[4], peek_sensor_path(response))
+            self.drops[key] = self.drops.get(key, 0) + 1
+            metrics.inc("rtnm_dropped_messages_total", device=key[0], sensor=key[1], policy=self.overload_policy)
+
+    def _report(self) -> None:
+        if self.log is None or monotonic() - self._last_report < self.report_interval:
+            return
+        self._last_report = monotonic()
+        for (device, sensor), count in self.drops.items():
+            dropped: int = count - self._reported.get((device, sensor), 0)
+            if dropped:
+                self.log.warning(f"Data queue is full, dropped {dropped} responses of {sensor or 'unknown sensor'} "
+                                 f"from {device} ({count} in total) with policy {self.overload_policy}")
+        self._reported = dict(self.drops)
+
+    def flush(self, expired_only: bool = False) -> None:
+        """Put the current batch on the data queue
+
+        :param expired_only: Only put the batch if its oldest message has waited for the linger time
+        :type expired_only: bool
+
+        """
+        with self._lock:
+            if not expired_only or monotonic() - self._oldest >= self.linger:
+                self._flush()
+            self._report()
+
+    def start_linger_thread(self) -> Thread:
+        """Start a daemon thread putting batches that are older than the linger time, used by connectors
+        that block while waiting for the next message"""
+
+        def linger() -> None:
+            while True:
+                sleep(self.linger)
+                self.flush(expired_only=True)
+
+        thread: Thread = Thread(target=linger, name="queue-batcher-linger", daemon=True)
+        thread.start()
+        return thread
+
+    async def flush_async(self, expired_only: bool = False) -> None:
+        """Put the current batch on the data queue from an event loop, without blocking it under the block policy
+
+        :param expired_only: Only put the batch if its oldest message has waited for the linger time
+        :type expired_only: bool
+
+        """
+        if self.overload_policy != "block":
+            self.flush(expired_only)
+            return
+        batch: List[Tuple[Any, ...]] = []
+        with self._lock:
+            if not expired_only or monotonic() - self._oldest >= self.linger:
+                batch = self._take()
+            self._report()
+        if batch:
+            await self._put_from_loop(batch)
+
+    async def linger_task(self) -> None:
+        """Put batches that are older than the linger time, used by connectors running an event loop"""
+        while True:
+            await asyncio.sleep(self.linger)
+            await self.flush_async(expired_only=True)
@@ -0,0 +1,82 @@
+"""
+.. module:: ReconnectSchedulers
+   :platform: Unix, Windows
+   :synopsis: Reconnect storm control shared by every connector process
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import random
+from multiprocessing import Lock, Value
+from time import monotonic
+from typing import Optional
+
+
+class ReconnectScheduler:
+    """A token bucket shared across every connector process limiting the rate of new connections,
+    so devices don't all reconnect at once after a restart or a network outage. Reservations may
+    take the bucket negative, the caller then waits until its token has been refilled
+
+    :param rate: The number of connections allowed per second
+    :type rate: float
+    :param burst: The number of connections allowed at once
+    :type burst: int
+
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate: float = rate
+        self.burst: int = burst
+        self._lock = Lock()
+        self._tokens = Value("d", float(burst), lock=False)
+        self._updated = Value("d", monotonic(), lock=False)
+
+    def reserve(self) -> float:
+        """Take a token for a new connection
+
+        :returns: The number of seconds to wait before connecting
+
+        """
+        with self._lock:
+            now: float = monotonic()
+            tokens: float = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rate)
+            self._updated.value = now
+            self._tokens.value = tokens - 1
+            if tokens >= 1:
+                return 0.0
+            return (1 - tokens) / self.rate
+
+
+class Backoff:
+    """Decorrelated jitter backoff of a single connection, which goes back to the minimum delay once
+    a stream stayed up for the healthy stream time
+
+    :param min_backoff_time: The minimum delay in seconds
+    :type min_backoff_time: float
+    :param max_backoff_time: The maximum delay in seconds
+    :type max_backoff_time: float
+    :param healthy_stream_time: The number of seconds a stream has to stay up for the backoff to reset
+    :type healthy_stream_time: float
+
+    """
+
+    def __init__(self, min_backoff_time: float, max_backoff_time: float, healthy_stream_time: float) -> None:
+        self.min_backoff_time: float = min_backoff_time
+        self.max_backoff_time: float = max_backoff_time
+        self.healthy_stream_time: float = healthy_stream_time
+        self.delay: float = min_backoff_time
+        self._connected_at: Optional[float] = None
+
+    def connected(self) -> None:
+        """Mark the start of a stream"""
+        self._connected_at = monotonic()
+
+    def next_delay(self) -> float:
+        """Get the delay before reconnecting after a stream or connection attempt ended
+
+        :returns: The number of seconds to wait
+
+        """
+        if self._connected_at is not None and monotonic() - self._connected_at >= self.healthy_stream_time:
+            self.delay = self.min_backoff_time
+        self._connected_at = None
+        self.delay = min(self.max_backoff_time, random.uniform(self.min_backoff_time, self.delay * 3))
+        return self.delay
@@ -1,25 +1,109 @@
+import os
+import re
 import json
 import gzip
 import base64
-from logging import Logger, getLogger
+from io import BytesIO
+from struct import Struct
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Queue, Empty
+from threading import Thread
+from datetime import datetime, timezone
+from pathlib import Path
+from logging import Logger
 from requests import request, Response
-from errors.errors import ElasticSearchUploaderError
-from typing import Dict, Any, List
+from errors.errors import ElasticSearchUploaderError, UploaderError
+from typing import Dict, Any, List, Union, Tuple, Optional
 from parsers.Parsers import ParsedResponse
-from datetime import datetime
-from utils.utils import yang_path_to_es_index
+from time import perf_counter, monotonic, sleep
+from utils.utils import yang_path_to_es_index, yang_path_to_table_name
+from metrics.metrics import metrics
+from loggers.loggers import category_logger, Payload
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+# Statuses of the outputs that don't post over HTTP meaning the data was accepted
+ACCEPTED_STATUSES: Tuple[str, ...] = ("written", "copied", "queued")
+
+
+def is_accepted(status: Optional[Union[int, str]]) -> bool:
+    """Check if the status returned by an uploader means the output accepted the data
+
+    :param status: The HTTP status code or status of the post, None if nothing was posted
+    :type status: Optional[Union[int, str]]
+
+    """
+    if isinstance(status, int):
+        return status < 300
+    return status in ACCEPTED_STATUSES
+
 
 class Uploader:
 
     def __init__(self, *args, **kwargs) -> None:
-        self.address: str = kwargs["address"]
-        self.port: str = kwargs["port"]
+        self.address: str = kwargs.get("address", "")
+        self.port: str = kwargs.get("port", "")
         self.url: str = f"http://{self.address}:{self.port}"
-        self.log: Logger = getLogger(kwargs["log_name"])
+        self.log: Logger = category_logger(kwargs["log_name"], "upload")
         self.log.debug(self.url)
+        self.name: str = kwargs.get("name", self.url)
+
+    def encode(self, data: List[ParsedResponse]) -> Any:
+        raise NotImplementedError("Can't call encode in base class")
+
+    def post(self, payload: Any) -> Union[int, str]:
+        raise NotImplementedError("Can't call post in base class")
+
+    def flush(self) -> None:
+        """Called periodically by the worker when it is idle, for outputs that buffer data"""
+        pass
 
-    def upload(self, data: List[ParsedResponse]):
-        raise NotImplementedError("Can't call upload in base class")
+    def close(self) -> None:
+        """Called by the worker when stopping, for outputs that hold files or connections"""
+        pass
+
+    def upload(self, data: List[ParsedResponse]) -> Optional[Union[int, str]]:
+        """Encode the parsed responses and post them to the output, recording the time of each step
+        and the status of the post
+
+        :param data: The parsed responses to upload
+        :type data: List[ParsedResponse]
+        :returns: The status of the post, None if there was nothing to post or error if encoding failed
+
+        """
+        status: Optional[Union[int, str]] = None
+        try:
+            start: float = perf_counter()
+            payload: Any = self.encode(data)
+            encoded: float = perf_counter()
+            metrics.observe("rtnm_encode_seconds", encoded - start, output=self.name)
+            if payload:
+                status = self.post(payload)
+                posted: float = perf_counter()
+                metrics.observe("rtnm_upload_seconds", posted - encoded, output=self.name)
+                metrics.inc("rtnm_uploads_total", output=self.name, status=status)
+                if is_accepted(status):
+                    metrics.inc("rtnm_uploaded_rows_total", len(data), output=self.name)
+            self.log.info(f"Total upload time took {perf_counter() - start:.6f}s for {self.name}")
+        except Exception as error:
+            self.log.error(error)
+            status = "error"
+        return status
 
 
 class ElasticSearchUploader(Uploader):
@@ -50,56 +134,52 @@ class ElasticSearchUploader(Uploader):
                 'Content-Type': 'application/x-ndjson',
             }
 
-    def _post_parsed_response(self, data: str) -> None:
+    def post(self, data: str) -> Union[int, str]:
         """ Post data to an ES instance with a given index
         :param data: The data you want to post
         :type data: ParsedGetResponse
-        :param index: The index to post the data to
-        :type index: str
+        :returns: The status code of the post or error if it failed
         :raises: ElasticSearchUploaderException
         """
-        self.log.debug(data)
+        self.log.debug("Posting bulk request %s", Payload(data))
         data_to_post: bytes = gzip.compress(data.encode("utf-8"))
         try:
             post_response: Response = request("POST", f"{self.url}/_bulk", data=data_to_post, headers=self.headers)
             if post_response.status_code not in [200, 201]:
-                self.log.error(data)
+                self.log.error("Failed bulk request %s", Payload(data))
                 self.log.error(post_response)
                 self.log.error(post_response.json())
                 raise ElasticSearchUploaderError("Error while posting data to ElasticSearch")
+            return post_response.status_code
         except Exception as error:
             self.log.error(error)
+            return "error"
 
-    def upload(self, data: List[ParsedResponse]):
-        """Upload operation data into Elasticsearch
+    def encode(self, data: List[ParsedResponse]) -> str:
+        """Encode operation data as an Elasticsearch bulk request
         :param data: The data to upload to Elastic Search
         :type data: List[ParsedGetResponse]
+        :returns: The newline delimited JSON body of the bulk request
         """
-        try:
-            start = datetime.now()
-            payload_list: List[Dict[str, Any]] = []
-            for parsed_response in data:
-                index: str = yang_path_to_es_index(parsed_response.yang_path)
-                elastic_index: Dict[str, Any] = {"index": {"_index": f"{index}"}}
-                elastic_data: Dict[str, Any] = {}
-                elastic_data["hostname"] = parsed_response.hostname
-                elastic_data["version"] = parsed_response.version
-                elastic_data["yang_path"] = parsed_response.yang_path
-                elastic_data["@timestamp"] = parsed_response.timestamp
-                elastic_data["encoding"] = parsed_response.encoding
-                elastic_data.update(parsed_response.data)
-                self.log.debug(elastic_data)
-                payload_list.append(elastic_index)
-                payload_list.append(elastic_data)
-            data_to_post: str = "\n".join(json.dumps(d) for d in payload_list)
-            if data_to_post.strip():
-                data_to_post += "\n"
-                self._post_parsed_response(data_to_post)
-            end = datetime.now()
-            total_time = end - start
-            self.log.info(f"Total upload time took {total_time} for Elasticsearch")
-        except Exception as error:
-            self.log.error(error)
+        payload_list: List[Dict[str, Any]] = []
+        for parsed_response in data:
+            index: str = yang_path_to_es_index(parsed_response.yang_path)
+            elastic_index: Dict[str, Any] = {"index": {"_index": f"{index}"}}
+            elastic_data: Dict[str, Any] = {}
+            elastic_data["hostname"] = parsed_response.hostname
+            elastic_data["version"] = parsed_response.version
+            elastic_data["yang_path"] = parsed_response.yang_path
+            elastic_data["@timestamp"] = parsed_response.timestamp
+            elastic_data["encoding"] = parsed_response.encoding
+            elastic_data.update(parsed_response.data)
+            self.log.debug("Elasticsearch document %s", Payload(elastic_data))
+            payload_list.append(elastic_index)
+            payload_list.append(elastic_data)
+        data_to_post: str = "\n".join(json.dumps(d) for d in payload_list)
+        if data_to_post.strip():
+            data_to_post += "\n"
+            return data_to_post
+        return ""
 
 
 class InfluxdbUploader(Uploader):
@@ -122,9 +202,7 @@ class InfluxdbUploader(Uploader):
                 'Content-Type': 'text/plain',
             }
 
-    def post_data(self, data: List[str]):
-        post_str: str = "\n".join(data)
-        start = datetime.now()
+    def post(self, post_str: str) -> Union[int, str]:
         try:
             post_response = request("POST", self.url, headers=self.headers, data=post_str, timeout=120)
             self.log.debug(post_response)
@@ -132,13 +210,12 @@ class InfluxdbUploader(Uploader):
                 self.log.error(post_response)
                 self.log.error(post_response.raw)
                 self.log.error(post_response.json())
+            return post_response.status_code
         except Exception as error:
             self.log.error(error)
-        end = datetime.now()
-        total_time = end - start
-        self.log.info(f"Total upload time took {total_time} for Influxdb")
+            return "error"
 
-    def upload(self, data: List[ParsedResponse]):
+    def encode(self, data: List[ParsedResponse]) -> str:
         influxdb_lines: List[str] = []
         timestamp_inc_counter = 0
         for entry in data:
@@ -175,7 +252,7 @@ class InfluxdbUploader(Uploader):
             influxdb_lines.append(f"{entry.yang_path},{tag_line} {field_line} {timestamp}")
             timestamp_inc_counter += 1
         self.log.debug(f"Influxdb length: {len(influxdb_lines)}")
-        self.post_data(influxdb_lines)
+        return "\n".join(influxdb_lines)
 
 
 
@@ -193,10 +270,8 @@ class Influxdb2Uploader(Uploader):
             'Content-Type': 'text/plain'
         }
 
-    def post_data(self, data: List[str]):
-        post_str: str = "\n".join(data)
-        self.log.debug(post_str)
-        start = datetime.now()
+    def post(self, post_str: str) -> Union[int, str]:
+        self.log.debug("Posting lines %s", Payload(post_str))
         try:
             post_response = request("POST", self.url, headers=self.headers, data=post_str, timeout=120)
             self.log.debug(post_response)
@@ -204,13 +279,12 @@ class Influxdb2Uploader(Uploader):
                 self.log.error(post_response)
                 self.log.error(post_response.raw)
                 self.log.error(post_response.json())
+            return post_response.status_code
         except Exception as error:
             self.log.error(error)
-        end = datetime.now()
-        total_time = end - start
-        self.log.info(f"Total upload time took {total_time} for Influxdb")
+            return "error"
 
-    def upload(self, data: List[ParsedResponse]):
+    def encode(self, data: List[ParsedResponse]) -> str:
         influxdb_lines: List[str] = []
         timestamp_inc_counter = 0
         for entry in data:
@@ -247,5 +321,1013 @@ class Influxdb2Uploader(Uploader):
             influxdb_lines.append(f"{entry.yang_path},{tag_line} {field_line} {timestamp}")
             timestamp_inc_counter += 1
         self.log.debug(f"Influxdb length: {len(influxdb_lines)}")
-        self.post_data(influxdb_lines)
+        return "\n".join(influxdb_lines)
+
+
+# Columns every parquet file starts with, followed by the keys and the content of the yang path
+PARQUET_BASE_COLUMNS: Tuple[str, ...] = ("timestamp", "hostname", "ip", "version", "encoding")
+
+
+def _arrow_type(value: Any) -> "pyarrow.DataType":
+    if isinstance(value, bool):
+        return pyarrow.bool_()
+    if isinstance(value, int):
+        # Counters above the int64 range (uint64) would make the whole table fail to convert
+        return pyarrow.int64() if -2 ** 63 <= value < 2 ** 63 else pyarrow.float64()
+    if isinstance(value, float):
+        return pyarrow.float64()
+    if isinstance(value, bytes):
+        # gNMI bytes_val and proto_bytes
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+def _promote_arrow_type(current: "pyarrow.DataType", new: "pyarrow.DataType") -> "pyarrow.DataType":
+    if current == new:
+        return current
+    numeric: Tuple["pyarrow.DataType", ...] = (pyarrow.int64(), pyarrow.float64())
+    if current in numeric and new in numeric:
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def _json_bytes(value: Any) -> str:
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _arrow_value(value: Any, arrow_type: "pyarrow.DataType") -> Any:
+    if value is None:
+        return None
+    if arrow_type == pyarrow.string():
+        if isinstance(value, bytes):
+            return base64.b64encode(value).decode()
+        return value if isinstance(value, str) else json.dumps(value, default=_json_bytes)
+    if arrow_type == pyarrow.float64():
+        return float(value)
+    return value
+
+
+class ParquetBuffer:
+    """The tables of a partition waiting to be written to its file as a single row group"""
+
+    __slots__ = ("tables", "rows", "size", "started")
+
+    def __init__(self) -> None:
+        self.tables: List["pyarrow.Table"] = []
+        self.rows: int = 0
+        self.size: int = 0
+        self.started: float = monotonic()
+
+    def add(self, table: "pyarrow.Table") -> None:
+        self.tables.append(table)
+        self.rows += table.num_rows
+        self.size += table.nbytes
+
+
+class ParquetUploader(Uploader):
+    """ParquetUploader writes the parsed responses to Parquet files partitioned by yang path, date and host
+    (<path>/<yang path>/date=<YYYY-MM-DD>/host=<hostname>/part-*.parquet). The schema of each yang path is
+    inferred from the data and cached, new fields are added to it and fields seen with different types are
+    widened (int to double, anything else to string). The rows of each partition are buffered and written as
+    a single row group once they reach row-group-rows rows or row-group-size MB, once the buffers of every
+    partition reach max-buffer-size MB (largest first) or when the file is rolled. Files are written under a
+    .inprogress name and renamed once rolled, which happens when they reach the roll size, get older than the
+    roll interval or the schema of their yang path changes. At most max-open-files files are open at once,
+    the least recently written one is rolled to open another
+
+    :param path: The directory the partitions are written to
+    :type path: str
+    :param roll-size: The size in MB at which a file is rolled
+    :type roll-size: int
+    :param roll-interval: The number of seconds after which a file is rolled
+    :type roll-interval: int
+    :param compression: The Parquet compression codec
+    :type compression: str
+    :param row-group-rows: The number of rows at which the buffer of a partition is written as a row group
+    :type row-group-rows: int
+    :param row-group-size: The size in MB at which the buffer of a partition is written as a row group
+    :type row-group-size: int
+    :param max-buffer-size: The size in MB of the buffers of every partition at which the largest are written
+    :type max-buffer-size: int
+    :param max-open-files: The maximum number of files open at once
+    :type max-open-files: int
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if pyarrow is None:
+            raise UploaderError("The pyarrow package is required for parquet outputs")
+        self.log.debug("Created ParquetUploader")
+        self.path: Path = Path(kwargs["path"])
+        self.roll_size: int = kwargs.get("roll-size", 128) * 1048576
+        self.roll_interval: int = kwargs.get("roll-interval", 300)
+        self.compression: str = kwargs.get("compression", "zstd")
+        self.row_group_rows: int = kwargs.get("row-group-rows", 100000)
+        self.row_group_size: int = kwargs.get("row-group-size", 16) * 1048576
+        self.max_buffer_size: int = kwargs.get("max-buffer-size", 256) * 1048576
+        self.max_open_files: int = max(1, kwargs.get("max-open-files", 64))
+        self.schemas: Dict[str, pyarrow.Schema] = {}
+        # (yang path, date, host) -> (writer, in progress path, time opened), least recently written first
+        self.writers: Dict[Tuple[str, str, str], Tuple[Any, Path, float]] = {}
+        self.buffers: Dict[Tuple[str, str, str], ParquetBuffer] = {}
+        self._buffered: int = 0
+        self._sequence: int = 0
+
+    def _merge_schema(self, yang_path: str, columns: Dict[str, "pyarrow.DataType"]) -> "pyarrow.Schema":
+        schema: Optional[pyarrow.Schema] = self.schemas.get(yang_path)
+        if schema is None:
+            fields: List[pyarrow.Field] = [pyarrow.field("timestamp", pyarrow.timestamp("ns"))]
+            fields.extend(pyarrow.field(name, pyarrow.string()) for name in PARQUET_BASE_COLUMNS[1:])
+        else:
+            fields = list(schema)
+        positions: Dict[str, int] = {field.name: index for index, field in enumerate(fields)}
+        changed: bool = schema is None
+        for name, arrow_type in columns.items():
+            if name not in positions:
+                positions[name] = len(fields)
+                fields.append(pyarrow.field(name, arrow_type))
+                changed = True
+            elif name not in PARQUET_BASE_COLUMNS:
+                promoted: pyarrow.DataType = _promote_arrow_type(fields[positions[name]].type, arrow_type)
+                if promoted != fields[positions[name]].type:
+                    fields[positions[name]] = pyarrow.field(name, promoted)
+                    changed = True
+        if changed:
+            if schema is not None:
+                self.log.info(f"Schema of {yang_path} changed to {len(fields)} columns")
+            schema = pyarrow.schema(fields)
+            self.schemas[yang_path] = schema
+        return schema
+
+    def encode(self, data: List[ParsedResponse]) -> Dict[Tuple[str, str, str], "pyarrow.Table"]:
+        """Convert the parsed responses to a table per yang path, date and host
+
+        :param data: The parsed responses
+        :type data: List[ParsedResponse]
+        :returns: The tables keyed by yang path, date and host
+
+        """
+        partitions: Dict[Tuple[str, str, str], List[Tuple[ParsedResponse, Dict[str, Any]]]] = {}
+        columns: Dict[str, Dict[str, pyarrow.DataType]] = {}
+        for entry in data:
+            # Keys take precedence over content fields of the same name
+            values: Dict[str, Any] = {**entry.data["content"], **entry.data["keys"]}
+            path_columns: Dict[str, pyarrow.DataType] = columns.setdefault(entry.yang_path, {})
+            for name, value in values.items():
+                if value is None:
+                    continue
+                arrow_type: pyarrow.DataType = _arrow_type(value)
+                path_columns[name] = _promote_arrow_type(path_columns.get(name, arrow_type), arrow_type)
+            date: str = datetime.fromtimestamp(entry.timestamp / 1e9, timezone.utc).strftime("%Y-%m-%d")
+            host: str = (entry.hostname or entry.ip_addr).replace("/", "_")
+            partitions.setdefault((entry.yang_path, date, host), []).append((entry, values))
+        schemas: Dict[str, pyarrow.Schema] = {
+            yang_path: self._merge_schema(yang_path, path_columns) for yang_path, path_columns in columns.items()
+        }
+        tables: Dict[Tuple[str, str, str], pyarrow.Table] = {}
+        for key, rows in partitions.items():
+            schema: pyarrow.Schema = schemas[key[0]]
+            table_columns: Dict[str, List[Any]] = {
+                "timestamp": [entry.timestamp for entry, _ in rows],
+                "hostname": [entry.hostname for entry, _ in rows],
+                "ip": [entry.ip_addr for entry, _ in rows],
+                "version": [entry.version for entry, _ in rows],
+                "encoding": [entry.encoding for entry, _ in rows],
+            }
+            for field in schema:
+                if field.name not in table_columns:
+                    table_columns[field.name] = [_arrow_value(values.get(field.name), field.type) for _, values in rows]
+            tables[key] = pyarrow.Table.from_pydict(table_columns, schema=schema)
+        return tables
+
+    def _open_writer(self, key: Tuple[str, str, str], schema: "pyarrow.Schema") -> Any:
+        while len(self.writers) >= self.max_open_files:
+            self._roll(next(iter(self.writers)))
+        directory: Path = self.path / yang_path_to_table_name(key[0]) / f"date={key[1]}" / f"host={key[2]}"
+        directory.mkdir(parents=True, exist_ok=True)
+        self._sequence += 1
+        stamp: str = datetime.now().strftime("%Y%m%d-%H%M%S")
+        in_progress: Path = directory / f"part-{stamp}-{os.getpid()}-{self._sequence:06d}.parquet.inprogress"
+        writer = pyarrow.parquet.ParquetWriter(str(in_progress), schema, compression=self.compression)
+        self.writers[key] = (writer, in_progress, monotonic())
+        return writer
+
+    def _roll(self, key: Tuple[str, str, str]) -> None:
+        writer, in_progress, _ = self.writers.pop(key)
+        writer.close()
+        os.replace(in_progress, in_progress.with_suffix(""))
+
+    def _write(self, key: Tuple[str, str, str], roll: bool = False) -> str:
+        """Write the buffer of a partition to its file as a single row group
+
+        :param key: The yang path, date and host of the partition
+        :type key: Tuple[str, str, str]
+        :param roll: Roll the file afterwards
+        :type roll: bool
+        :returns: written or error if the rows couldn't be written, in which case they are dropped
+
+        """
+        buffer: Optional[ParquetBuffer] = self.buffers.pop(key, None)
+        try:
+            if buffer is not None:
+                self._buffered -= buffer.size
+                table: pyarrow.Table = pyarrow.concat_tables(buffer.tables) if len(buffer.tables) > 1 \
+                    else buffer.tables[0]
+                if key in self.writers and not self.writers[key][0].schema.equals(table.schema):
+                    self._roll(key)
+                if key in self.writers:
+                    # Most recently written last
+                    self.writers[key] = self.writers.pop(key)
+                else:
+                    self._open_writer(key, table.schema)
+                self.writers[key][0].write_table(table, row_group_size=table.num_rows)
+            if key in self.writers and (roll or self.writers[key][1].stat().st_size >= self.roll_size):
+                self._roll(key)
+            return "written"
+        except Exception as error:
+            self.log.error(f"Writing {key[0]} to parquet failed: {error}")
+            return "error"
+
+    def post(self, tables: Dict[Tuple[str, str, str], "pyarrow.Table"]) -> Union[int, str]:
+        """Add the tables to the buffer of their partition, writing the buffers that are full
+
+        :param tables: The tables keyed by yang path, date and host
+        :type tables: Dict[Tuple[str, str, str], pyarrow.Table]
+        :returns: queued if the tables were only buffered, written if buffers were written or error if a
+                  buffer couldn't be written
+
+        """
+        status: str = "queued"
+        for key, table in tables.items():
+            buffer: Optional[ParquetBuffer] = self.buffers.get(key)
+            if buffer is not None and not buffer.tables[0].schema.equals(table.schema):
+                # The schema of the yang path changed, finish the file of the old schema
+                written: str = self._write(key, roll=True)
+                status = written if status != "error" else status
+                buffer = None
+            if buffer is None:
+                buffer = self.buffers[key] = ParquetBuffer()
+            buffer.add(table)
+            self._buffered += table.nbytes
+            if buffer.rows >= self.row_group_rows or buffer.size >= self.row_group_size:
+                written = self._write(key)
+                status = written if status != "error" else status
+        if self._buffered >= self.max_buffer_size:
+            for key in sorted(self.buffers, key=lambda key: self.buffers[key].size, reverse=True):
+                written = self._write(key)
+                status = written if status != "error" else status
+                if self._buffered < self.max_buffer_size // 2:
+                    break
+        return status
+
+    def flush(self) -> None:
+        """Write and roll the partitions whose file or buffer is older than the roll interval"""
+        now: float = monotonic()
+        due: List[Tuple[str, str, str]] = [key for key, (_, _, opened) in self.writers.items()
+                                           if now - opened >= self.roll_interval]
+        due.extend(key for key, buffer in self.buffers.items()
+                   if now - buffer.started >= self.roll_interval and key not in self.writers)
+        for key in due:
+            self._write(key, roll=True)
+
+    def close(self) -> None:
+        """Write every buffer and roll every open file"""
+        for key in list(self.buffers) + [key for key in self.writers if key not in self.buffers]:
+            self._write(key, roll=True)
+
+
+_DOUBLE: Struct = Struct("<d")
+_INVALID_NAME_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _varint(value: int) -> bytes:
+    encoded: bytearray = bytearray()
+    value &= 0xFFFFFFFFFFFFFFFF
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _length_delimited(field: int, data: bytes) -> bytes:
+    return bytes([(field << 3) | 2]) + _varint(len(data)) + data
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """Compress data in the snappy block format, with python-snappy when it is installed, otherwise as
+    uncompressed literals which every snappy decoder accepts
+
+    :param data: The data to compress
+    :type data: bytes
+    :returns: The snappy block
+
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    block: List[bytes] = [_varint(len(data))]
+    for start in range(0, len(data), 65536):
+        chunk: bytes = data[start:start + 65536]
+        length: int = len(chunk) - 1
+        if length < 60:
+            block.append(bytes([length << 2]))
+        elif length < 256:
+            block.append(bytes([60 << 2, length]))
+        else:
+            block.append(bytes([61 << 2]) + length.to_bytes(2, "little"))
+        block.append(chunk)
+    return b"".join(block)
+
+
+class PrometheusRemoteWriteUploader(Uploader):
+    """PrometheusRemoteWriteUploader sends the numeric fields of the parsed responses to a Prometheus
+    remote write endpoint. Each field becomes a time series named after the yang path and the field, labelled
+    with the keys, hostname, ip, version and encoding of the response. The encoded label sets are cached and
+    the samples of a batch are grouped per series. Series are sharded by their label set across concurrency
+    senders, each sending the snappy compressed WriteRequests of at most max-samples-per-send samples of its
+    shard one after another, so the samples of a series always arrive in order. Failed requests are retried
+    with exponential backoff
+
+    :param path: The path of the remote write endpoint
+    :type path: str
+    :param concurrency: The maximum number of requests in flight
+    :type concurrency: int
+    :param max-samples-per-send: The maximum number of samples in a WriteRequest
+    :type max-samples-per-send: int
+    :param retries: The number of times a failed request is retried
+    :type retries: int
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log.debug("Created PrometheusRemoteWriteUploader")
+        self.url = f"{self.url}{kwargs.get('path', '/api/v1/write')}"
+        self.concurrency: int = kwargs.get("concurrency", 4)
+        self.max_samples: int = kwargs.get("max-samples-per-send", 2000)
+        self.retries: int = kwargs.get("retries", 3)
+        self.headers: Dict[str, str] = {
+            "Content-Encoding": "snappy",
+            "Content-Type": "application/x-protobuf",
+            "X-Prometheus-Remote-Write-Version": "0.1.0"
+        }
+        if "token" in kwargs:
+            self.headers["Authorization"] = f'Bearer {kwargs["token"]}'
+        elif "username" in kwargs:
+            base_64_auth: str = base64.b64encode(f'{kwargs["username"]}:{kwargs["password"]}'.encode()).decode()
+            self.headers["Authorization"] = f"Basic {base_64_auth}"
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(self.concurrency)
+        self.metric_names: Dict[Tuple[str, str], str] = {}
+        self.label_sets: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], bytes] = {}
+        self.max_label_sets: int = kwargs.get("label-cache-size", 100000)
+
+    def _metric_name(self, yang_path: str, field: str) -> str:
+        name: Optional[str] = self.metric_names.get((yang_path, field))
+        if name is None:
+            name = _INVALID_NAME_CHARACTERS.sub("_", f"{yang_path}_{field}")
+            if name[0].isdigit():
+                name = f"_{name}"
+            self.metric_names[(yang_path, field)] = name
+        return name
+
+    def _label_set(self, name: str, labels: Tuple[Tuple[str, str], ...]) -> bytes:
+        key: Tuple[str, Tuple[Tuple[str, str], ...]] = (name, labels)
+        encoded: Optional[bytes] = self.label_sets.get(key)
+        if encoded is None:
+            if len(self.label_sets) >= self.max_label_sets:
+                self.label_sets.clear()
+            pairs: List[Tuple[str, str]] = sorted((("__name__", name),) + labels)
+            encoded = b"".join(
+                _length_delimited(1, _length_delimited(1, label.encode()) + _length_delimited(2, value.encode()))
+                for label, value in pairs
+            )
+            self.label_sets[key] = encoded
+        return encoded
+
+    def encode(self, data: List[ParsedResponse]) -> List[List[bytes]]:
+        """Encode the numeric fields of the parsed responses as compressed WriteRequests
+
+        :param data: The parsed responses
+        :type data: List[ParsedResponse]
+        :returns: The snappy compressed WriteRequests of each shard, in the order they have to be sent
+
+        """
+        # Encoded label set -> (timestamp in ms, encoded sample) of each sample of the series
+        series: Dict[bytes, List[Tuple[int, bytes]]] = {}
+        for entry in data:
+            labels: Dict[str, str] = {
+                _INVALID_NAME_CHARACTERS.sub("_", key): str(value) for key, value in entry.data["keys"].items()
+            }
+            labels.update({"hostname": entry.hostname or "", "ip": entry.ip_addr, "version": entry.version or "",
+                           "encoding": entry.encoding})
+            label_items: Tuple[Tuple[str, str], ...] = tuple(labels.items())
+            milliseconds: int = entry.timestamp // 1000000
+            timestamp: bytes = b"\x10" + _varint(milliseconds)
+            for field, value in entry.data["content"].items():
+                if isinstance(value, bool):
+                    value = float(value)
+                elif not isinstance(value, (int, float)):
+                    continue
+                sample: bytes = _length_delimited(2, b"\x09" + _DOUBLE.pack(value) + timestamp)
+                label_set: bytes = self._label_set(self._metric_name(entry.yang_path, field), label_items)
+                series.setdefault(label_set, []).append((milliseconds, sample))
+        shards: List[List[bytes]] = [[] for _ in range(self.concurrency)]
+        chunks: List[List[bytes]] = [[] for _ in range(self.concurrency)]
+        counts: List[int] = [0] * self.concurrency
+        for label_set, samples in series.items():
+            shard: int = hash(label_set) % self.concurrency
+            samples.sort(key=lambda sample: sample[0])
+            for start in range(0, len(samples), self.max_samples):
+                part: List[Tuple[int, bytes]] = samples[start:start + self.max_samples]
+                if counts[shard] + len(part) > self.max_samples and chunks[shard]:
+                    shards[shard].append(snappy_compress(b"".join(chunks[shard])))
+                    chunks[shard], counts[shard] = [], 0
+                chunks[shard].append(_length_delimited(1, label_set + b"".join(sample for _, sample in part)))
+                counts[shard] += len(part)
+        for shard, chunk in enumerate(chunks):
+            if chunk:
+                shards[shard].append(snappy_compress(b"".join(chunk)))
+        return [requests for requests in shards if requests]
+
+    def _send(self, body: bytes) -> Union[int, str]:
+        delay: float = 0.5
+        status: Union[int, str] = "error"
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(delay)
+                delay *= 2
+            try:
+                post_response: Response = request("POST", self.url, data=body, headers=self.headers, timeout=30)
+                status = post_response.status_code
+                if status < 300:
+                    return status
+                self.log.error(f"Remote write to {self.url} failed with {status}: {post_response.text[:512]}")
+                # Only server errors and throttling are worth retrying
+                if status < 500 and status != 429:
+                    return status
+            except Exception as error:
+                self.log.error(error)
+                status = "error"
+        return status
+
+    def _send_shard(self, requests: List[bytes]) -> Union[int, str]:
+        # The next request of a shard can hold later samples of the same series, stop at the first failure
+        status: Union[int, str] = "error"
+        for body in requests:
+            status = self._send(body)
+            if status == "error" or status >= 300:
+                return status
+        return status
+
+    def post(self, shards: List[List[bytes]]) -> Union[int, str]:
+        """Send the WriteRequests of each shard in order, the shards concurrently
+
+        :param shards: The snappy compressed WriteRequests of each shard
+        :type shards: List[List[bytes]]
+        :returns: The status of the first shard that failed or of the last shard
+
+        """
+        futures: List[Future] = [self.executor.submit(self._send_shard, requests) for requests in shards]
+        statuses: List[Union[int, str]] = [future.result() for future in futures]
+        for status in statuses:
+            if status == "error" or status >= 300:
+                return status
+        return statuses[-1]
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+
+# Columns every ClickHouse table starts with, followed by the keys and the content of the yang path
+CLICKHOUSE_BASE_COLUMNS: Dict[str, str] = {
+    "timestamp": "DateTime64(9) CODEC(DoubleDelta, ZSTD)",
+    "hostname": "LowCardinality(String)",
+    "ip": "LowCardinality(String)",
+    "version": "LowCardinality(String)",
+    "encoding": "LowCardinality(String)",
+}
+CLICKHOUSE_CODECS: Dict[str, str] = {
+    "Nullable(Int64)": "CODEC(T64, ZSTD)",
+    "Nullable(Float64)": "CODEC(Gorilla, ZSTD)",
+    "Nullable(UInt8)": "CODEC(ZSTD)",
+    "Nullable(String)": "CODEC(ZSTD)",
+}
+_INT64: Struct = Struct("<q")
+
+
+def _clickhouse_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "Nullable(UInt8)"
+    if isinstance(value, int):
+        return "Nullable(Int64)" if -2 ** 63 <= value < 2 ** 63 else "Nullable(Float64)"
+    if isinstance(value, float):
+        return "Nullable(Float64)"
+    return "Nullable(String)"
+
+
+def _promote_clickhouse_type(current: str, new: str) -> str:
+    if current == new:
+        return current
+    numeric: Tuple[str, ...] = ("Nullable(Int64)", "Nullable(Float64)")
+    if current in numeric and new in numeric:
+        return "Nullable(Float64)"
+    return "Nullable(String)"
+
+
+def _quote(name: str) -> str:
+    return "`" + name.replace("\\", "\\\\").replace("`", "\\`") + "`"
+
+
+def _row_binary_string(value: str) -> bytes:
+    data: bytes = value.encode()
+    return _varint(len(data)) + data
+
+
+def _row_binary_value(value: Any, column_type: str) -> bytes:
+    if value is None:
+        return b"\x01"
+    if column_type == "Nullable(String)":
+        return b"\x00" + _row_binary_string(value if isinstance(value, str) else json.dumps(value))
+    if column_type == "Nullable(Float64)":
+        return b"\x00" + _DOUBLE.pack(float(value))
+    if column_type == "Nullable(UInt8)":
+        return b"\x00\x01" if value else b"\x00\x00"
+    return b"\x00" + _INT64.pack(value)
+
+
+class ClickHouseUploader(Uploader):
+    """ClickHouseUploader inserts the parsed responses into a ClickHouse table per yang path through the
+    HTTP interface. The rows of a batch are grouped per yang path into one gzip compressed RowBinary insert
+    per table. Tables are created on first use and the columns of each one are cached, new fields are added
+    to the table and fields seen with different types are widened (int to double, anything else to string)
+
+    :param database: The database the tables are created in
+    :type database: str
+    :param username: The user to connect as
+    :type username: str
+    :param password: The password of the user
+    :type password: str
+    :param ttl: The number of days rows are kept for, rows are kept forever if 0
+    :type ttl: int
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log.debug("Created ClickHouseUploader")
+        self.database: str = kwargs.get("database", "default")
+        self.ttl: int = kwargs.get("ttl", 0)
+        self.headers: Dict[str, str] = {"Content-Encoding": "gzip"}
+        if "username" in kwargs:
+            self.headers["X-ClickHouse-User"] = kwargs["username"]
+            self.headers["X-ClickHouse-Key"] = kwargs.get("password", "")
+        # table -> column -> type of the columns after the base columns
+        self.tables: Dict[str, Dict[str, str]] = {}
+
+    def _query(self, query: str, data: Optional[bytes] = None) -> Response:
+        headers: Dict[str, str] = self.headers if data is not None else {
+            key: value for key, value in self.headers.items() if key != "Content-Encoding"
+        }
+        response: Response = request("POST", self.url, params={"query": query, "database": self.database},
+                                     data=data if data is not None else b"", headers=headers, timeout=60)
+        if response.status_code >= 300:
+            raise UploaderError(f"ClickHouse query failed with {response.status_code}: {response.text[:512]}")
+        return response
+
+    def _load_table(self, table: str) -> Dict[str, str]:
+        columns: List[str] = [f"{_quote(name)} {column_type}" for name, column_type in CLICKHOUSE_BASE_COLUMNS.items()]
+        ttl: str = f" TTL toDateTime(timestamp) + INTERVAL {self.ttl} DAY" if self.ttl else ""
+        self._query(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(columns)}) ENGINE = MergeTree "
+                    f"PARTITION BY toDate(timestamp) ORDER BY (hostname, timestamp){ttl}")
+        existing: Response = self._query(f"SELECT name, type FROM system.columns WHERE database = currentDatabase() "
+                                         f"AND table = '{table}' FORMAT TabSeparated")
+        known: Dict[str, str] = {}
+        for line in existing.text.splitlines():
+            name, column_type = line.split("\t", 1)
+            if name not in CLICKHOUSE_BASE_COLUMNS:
+                known[name] = column_type
+        self.tables[table] = known
+        return known
+
+    def _merge_columns(self, table: str, columns: Dict[str, str]) -> Dict[str, str]:
+        known: Dict[str, str] = self.tables[table] if table in self.tables else self._load_table(table)
+        for name, column_type in columns.items():
+            if name in CLICKHOUSE_BASE_COLUMNS:
+                continue
+            if name not in known:
+                self._query(f"ALTER TABLE {_quote(table)} ADD COLUMN IF NOT EXISTS {_quote(name)} {column_type} "
+                            f"{CLICKHOUSE_CODECS[column_type]}")
+                known[name] = column_type
+                self.log.info(f"Added column {name} {column_type} to {table}")
+            else:
+                promoted: str = _promote_clickhouse_type(known[name], column_type)
+                if promoted != known[name]:
+                    self._query(f"ALTER TABLE {_quote(table)} MODIFY COLUMN {_quote(name)} {promoted} "
+                                f"{CLICKHOUSE_CODECS[promoted]}")
+                    known[name] = promoted
+                    self.log.info(f"Changed column {name} of {table} to {promoted}")
+        return known
+
+    def encode(self, data: List[ParsedResponse]) -> Dict[str, Tuple[List[str], bytes]]:
+        """Convert the parsed responses to a compressed RowBinary block per table, creating or altering
+        the tables as needed
+
+        :param data: The parsed responses
+        :type data: List[ParsedResponse]
+        :returns: The columns and the block of each table
+
+        """
+        tables: Dict[str, List[Tuple[ParsedResponse, Dict[str, Any]]]] = {}
+        columns: Dict[str, Dict[str, str]] = {}
+        for entry in data:
+            table: str = yang_path_to_table_name(entry.yang_path)
+            # Keys take precedence over content fields of the same name
+            values: Dict[str, Any] = {**entry.data["content"], **entry.data["keys"]}
+            table_columns: Dict[str, str] = columns.setdefault(table, {})
+            for name, value in values.items():
+                if value is None:
+                    continue
+                column_type: str = _clickhouse_type(value)
+                table_columns[name] = _promote_clickhouse_type(table_columns.get(name, column_type), column_type)
+            tables.setdefault(table, []).append((entry, values))
+        blocks: Dict[str, Tuple[List[str], bytes]] = {}
+        for table, rows in tables.items():
+            known: Dict[str, str] = self._merge_columns(table, columns[table])
+            # Columns changed by hand to types RTNM doesn't create are left out of the inserts
+            names: List[str] = [name for name in known if name in columns[table] and known[name] in CLICKHOUSE_CODECS]
+            block: List[bytes] = []
+            for entry, values in rows:
+                block.append(_INT64.pack(entry.timestamp))
+                block.append(_row_binary_string(entry.hostname or ""))
+                block.append(_row_binary_string(entry.ip_addr))
+                block.append(_row_binary_string(entry.version or ""))
+                block.append(_row_binary_string(entry.encoding))
+                block.extend(_row_binary_value(values.get(name), known[name]) for name in names)
+            blocks[table] = (list(CLICKHOUSE_BASE_COLUMNS) + names, gzip.compress(b"".join(block), 1))
+        return blocks
+
+    def post(self, blocks: Dict[str, Tuple[List[str], bytes]]) -> Union[int, str]:
+        """Insert the block of each table
+
+        :param blocks: The columns and the block of each table
+        :type blocks: Dict[str, Tuple[List[str], bytes]]
+        :returns: The status code of the last insert or error if an insert failed
+
+        """
+        status: Union[int, str] = "error"
+        for table, (names, block) in blocks.items():
+            try:
+                columns: str = ", ".join(_quote(name) for name in names)
+                status = self._query(f"INSERT INTO {_quote(table)} ({columns}) FORMAT RowBinary", block).status_code
+            except Exception as error:
+                self.log.error(error)
+                # The table may have been altered or dropped by someone else, reload it on the next batch
+                self.tables.pop(table, None)
+                return "error"
+        return status
+
+
+# Columns every TimescaleDB table starts with, followed by the keys and the content of the yang path
+TIMESCALEDB_BASE_COLUMNS: Dict[str, str] = {
+    "time": "timestamptz NOT NULL",
+    "hostname": "text",
+    "ip": "text",
+    "version": "text",
+    "encoding": "text",
+}
+COPY_HEADER: bytes = b"PGCOPY\n\xff\r\n\x00" + b"\x00" * 8
+COPY_TRAILER: bytes = b"\xff\xff"
+# Microseconds between the unix epoch and the PostgreSQL epoch (2000-01-01)
+POSTGRES_EPOCH: int = 946684800000000
+_PG_INT16: Struct = Struct(">h")
+_PG_INT32: Struct = Struct(">i")
+_PG_INT64: Struct = Struct(">q")
+_PG_DOUBLE: Struct = Struct(">d")
+# table -> (column types, rows of the parsed response and its column values)
+CopyTables = Dict[str, Tuple[Dict[str, str], List[Tuple[ParsedResponse, Dict[str, Any]]]]]
+
+
+def _postgres_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "bigint" if -2 ** 63 <= value < 2 ** 63 else "double precision"
+    if isinstance(value, float):
+        return "double precision"
+    return "text"
+
+
+def _promote_postgres_type(current: str, new: str) -> str:
+    if current == new:
+        return current
+    numeric: Tuple[str, ...] = ("bigint", "double precision")
+    if current in numeric and new in numeric:
+        return "double precision"
+    return "text"
+
+
+def _copy_field(value: Any, column_type: str) -> bytes:
+    if value is None:
+        return b"\xff\xff\xff\xff"
+    if column_type == "text":
+        data: bytes = (value if isinstance(value, str) else json.dumps(value)).encode()
+    elif column_type == "double precision":
+        data = _PG_DOUBLE.pack(float(value))
+    elif column_type == "bigint":
+        data = _PG_INT64.pack(value)
+    elif column_type == "boolean":
+        data = b"\x01" if value else b"\x00"
+    else:
+        # jsonb, the binary format is a version byte followed by the text
+        data = b"\x01" + json.dumps(value).encode()
+    return _PG_INT32.pack(len(data)) + data
+
+
+class TimescaleDBUploader(Uploader):
+    """TimescaleDBUploader streams the parsed responses into a table per yang path with binary COPY over
+    connections pooled for the lifetime of the worker. The keys of a yang path become text columns and its
+    content either typed columns or a single jsonb column. Tables are created on first use, as hypertables
+    unless disabled, and the columns of each one are cached, new fields are added to the table and fields
+    seen with different types are widened (int to double, anything else to text)
+
+    :param database: The database the tables are created in
+    :type database: str
+    :param username: The user to connect as
+    :type username: str
+    :param password: The password of the user
+    :type password: str
+    :param content: Either columns or jsonb
+    :type content: str
+    :param hypertable: Whether new tables are made hypertables
+    :type hypertable: bool
+    :param pool-size: The maximum number of pooled connections
+    :type pool-size: int
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if psycopg2 is None:
+            raise UploaderError("The psycopg2 package is required for timescaledb outputs")
+        self.log.debug("Created TimescaleDBUploader")
+        self.connect_args: Dict[str, Any] = {
+            "host": self.address, "port": self.port, "dbname": kwargs["database"],
+            "user": kwargs.get("username"), "password": kwargs.get("password"),
+        }
+        self.content: str = kwargs.get("content", "columns")
+        self.hypertable: bool = kwargs.get("hypertable", True)
+        self.pool_size: int = kwargs.get("pool-size", 2)
+        self.pool: Optional[Any] = None
+        # table -> column -> type of the columns after the base columns
+        self.tables: Dict[str, Dict[str, str]] = {}
+
+    def _connection(self) -> Any:
+        # Created on first use so a database that is down doesn't stop the worker from starting
+        if self.pool is None:
+            self.pool = psycopg2.pool.SimpleConnectionPool(1, self.pool_size, **self.connect_args)
+        return self.pool.getconn()
+
+    def _load_table(self, cursor: Any, table: str) -> Dict[str, str]:
+        columns: List[str] = [f'"{name}" {column_type}' for name, column_type in TIMESCALEDB_BASE_COLUMNS.items()]
+        if self.content == "jsonb":
+            columns.append('"content" jsonb')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(columns)})')
+        if self.hypertable:
+            cursor.execute("SELECT create_hypertable(%s, 'time', if_not_exists => TRUE)", (table,))
+        cursor.execute("SELECT column_name, data_type FROM information_schema.columns "
+                       "WHERE table_schema = current_schema() AND table_name = %s", (table,))
+        known: Dict[str, str] = {
+            name: column_type for name, column_type in cursor.fetchall() if name not in TIMESCALEDB_BASE_COLUMNS
+        }
+        self.tables[table] = known
+        return known
+
+    def _merge_columns(self, cursor: Any, table: str, columns: Dict[str, str]) -> Dict[str, str]:
+        known: Dict[str, str] = self.tables[table] if table in self.tables else self._load_table(cursor, table)
+        for name, column_type in columns.items():
+            if name not in known:
+                cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{name}" {column_type}')
+                known[name] = column_type
+                self.log.info(f"Added column {name} {column_type} to {table}")
+            else:
+                promoted: str = _promote_postgres_type(known[name], column_type)
+                if promoted != known[name] and known[name] != "jsonb":
+                    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "{name}" TYPE {promoted} '
+                                   f'USING "{name}"::{promoted}')
+                    known[name] = promoted
+                    self.log.info(f"Changed column {name} of {table} to {promoted}")
+        return known
+
+    def encode(self, data: List[ParsedResponse]) -> CopyTables:
+        """Group the parsed responses per table and infer the types of their columns, the COPY data is
+        built in post once the tables are up to date
+
+        :param data: The parsed responses
+        :type data: List[ParsedResponse]
+        :returns: The column types and the rows of each table
+
+        """
+        tables: CopyTables = {}
+        for entry in data:
+            table: str = yang_path_to_table_name(entry.yang_path, 63)
+            columns, rows = tables.setdefault(table, ({}, []))
+            values: Dict[str, Any] = {}
+            if self.content == "jsonb":
+                values["content"] = entry.data["content"]
+            else:
+                for name, value in entry.data["content"].items():
+                    values[yang_path_to_table_name(name, 63)] = value
+            # Keys take precedence over content fields of the same name
+            for name, value in entry.data["keys"].items():
+                values[yang_path_to_table_name(name, 63)] = str(value)
+            for name in [name for name in values if name in TIMESCALEDB_BASE_COLUMNS]:
+                del values[name]
+            for name, value in values.items():
+                if value is None:
+                    continue
+                column_type: str = "jsonb" if name == "content" and self.content == "jsonb" else _postgres_type(value)
+                columns[name] = _promote_postgres_type(columns.get(name, column_type), column_type)
+            rows.append((entry, values))
+        return tables
+
+    def post(self, tables: CopyTables) -> Union[int, str]:
+        """Copy the rows of each table in one transaction
+
+        :param tables: The column types and the rows of each table
+        :type tables: CopyTables
+        :returns: copied or error if the copy failed
+
+        """
+        connection: Any = self._connection()
+        try:
+            with connection.cursor() as cursor:
+                for table, (columns, rows) in tables.items():
+                    known: Dict[str, str] = self._merge_columns(cursor, table, columns)
+                    names: List[str] = [name for name in known if name in columns]
+                    field_count: bytes = _PG_INT16.pack(len(TIMESCALEDB_BASE_COLUMNS) + len(names))
+                    copy_data: List[bytes] = [COPY_HEADER]
+                    for entry, values in rows:
+                        copy_data.append(field_count)
+                        copy_data.append(_copy_field(entry.timestamp // 1000 - POSTGRES_EPOCH, "bigint"))
+                        copy_data.append(_copy_field(entry.hostname, "text"))
+                        copy_data.append(_copy_field(entry.ip_addr, "text"))
+                        copy_data.append(_copy_field(entry.version, "text"))
+                        copy_data.append(_copy_field(entry.encoding, "text"))
+                        copy_data.extend(_copy_field(values.get(name), known[name]) for name in names)
+                    copy_data.append(COPY_TRAILER)
+                    column_list: str = ", ".join(f'"{name}"' for name in list(TIMESCALEDB_BASE_COLUMNS) + names)
+                    cursor.copy_expert(f'COPY "{table}" ({column_list}) FROM STDIN (FORMAT binary)',
+                                       BytesIO(b"".join(copy_data)))
+            connection.commit()
+            self.pool.putconn(connection)
+            return "copied"
+        except Exception as error:
+            self.log.error(f"Copy to TimescaleDB failed: {error}")
+            # The cached tables may be behind a rolled back ALTER, reload them on the next batch
+            self.tables = {}
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            self.pool.putconn(connection, close=bool(connection.closed))
+            return "error"
+
+    def close(self) -> None:
+        """Close the pooled connections"""
+        if self.pool is not None:
+            self.pool.closeall()
+
+
+# Format of a file output -> (uploader whose bodies are written, file extension)
+FILE_FORMATS: Dict[str, Tuple[type, str]] = {
+    "influxdb": (InfluxdbUploader, "lp"),
+    "influxdbv2": (Influxdb2Uploader, "lp"),
+    "elasticsearch": (ElasticSearchUploader, "ndjson"),
+}
+
+
+class FileUploader(Uploader):
+    """FileUploader writes the exact bodies the InfluxDB or ElasticSearch uploaders would post (line protocol
+    or _bulk NDJSON) to size rotated files, as a copy that can be loaded into the TSDB later with load.py.
+    Bodies are handed to a writer thread which drains everything queued into one buffered write, optionally
+    compressed with gzip, and fsyncs at most once per fsync interval. Files are written under a .inprogress
+    name and renamed once rotated
+
+    :param path: The directory the files are written to
+    :type path: str
+    :param format: The uploader whose bodies are written, influxdb, influxdbv2 or elasticsearch
+    :type format: str
+    :param rotate-size: The size in MB at which a file is rotated
+    :type rotate-size: int
+    :param compression: Either gzip or none
+    :type compression: str
+    :param fsync-interval: The number of seconds between fsyncs, files are never fsynced if 0
+    :type fsync-interval: float
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log.debug("Created FileUploader")
+        self.path: Path = Path(kwargs["path"])
+        self.format: str = kwargs.get("format", "influxdbv2")
+        self.rotate_size: int = kwargs.get("rotate-size", 256) * 1048576
+        self.compression: str = kwargs.get("compression", "gzip")
+        self.fsync_interval: float = kwargs.get("fsync-interval", 0.0)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Bounded so a disk that can't keep up slows the worker down instead of filling the memory
+        self.queue: Queue = Queue(kwargs.get("queue-size", 1024))
+        self._raw: Optional[Any] = None
+        self._file: Optional[Any] = None
+        self._in_progress: Optional[Path] = None
+        self._sequence: int = 0
+        self._last_sync: float = monotonic()
+        self._failed: bool = False
+        self._writer: Thread = Thread(target=self._write_loop, name=f"{self.name}-writer", daemon=True)
+        self._writer.start()
+
+    def encode(self, data: List[ParsedResponse]) -> str:
+        """Encode the parsed responses exactly like the uploader of the format
+
+        :param data: The parsed responses
+        :type data: List[ParsedResponse]
+        :returns: The body the uploader would post
+
+        """
+        return FILE_FORMATS[self.format][0].encode(self, data)
+
+    def post(self, body: str) -> Union[int, str]:
+        """Queue a body for the writer thread
+
+        :param body: The body to write
+        :type body: str
+        :returns: queued or error if the last write of the writer thread failed
+
+        """
+        self.queue.put(body if body.endswith("\n") else f"{body}\n")
+        return "error" if self._failed else "queued"
+
+    def _open(self) -> None:
+        self._sequence += 1
+        stamp: str = datetime.now().strftime("%Y%m%d-%H%M%S")
+        suffix: str = FILE_FORMATS[self.format][1] + (".gz" if self.compression == "gzip" else "")
+        self._in_progress = self.path / f"{self.name}-{stamp}-{os.getpid()}-{self._sequence:06d}.{suffix}.inprogress"
+        self._raw = open(self._in_progress, "wb", buffering=4194304)
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6) \
+            if self.compression == "gzip" else self._raw
+
+    def _rotate(self) -> None:
+        try:
+            if self._file is not self._raw:
+                self._file.close()
+            self._raw.close()
+            os.replace(self._in_progress, self._in_progress.with_suffix(""))
+        finally:
+            # Start a new file on the next write even if the file was moved or removed by someone else
+            self._raw = self._file = self._in_progress = None
+
+    def _sync(self) -> None:
+        self._file.flush()
+        if self._file is not self._raw:
+            self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._last_sync = monotonic()
+
+    def _write_loop(self) -> None:
+        timeout: Optional[float] = self.fsync_interval or None
+        while True:
+            try:
+                bodies: List[Optional[str]] = [self.queue.get(timeout=timeout)]
+                while not self.queue.empty() and bodies[-1] is not None:
+                    bodies.append(self.queue.get())
+            except Empty:
+                bodies = []
+            try:
+                done: bool = bool(bodies) and bodies[-1] is None
+                if done:
+                    bodies.pop()
+                if bodies:
+                    if self._file is None:
+                        self._open()
+                    self._file.write("".join(bodies).encode())
+                if self._file is not None:
+                    if self.fsync_interval and monotonic() - self._last_sync >= self.fsync_interval:
+                        self._sync()
+                    if done or self._raw.tell() >= self.rotate_size:
+                        self._rotate()
+                self._failed = False
+                if done:
+                    return
+            except Exception as error:
+                self._failed = True
+                self.log.error(f"Writing to {self._in_progress or self.path} failed: {error}")
+                if done:
+                    return
 
+    def close(self) -> None:
+        """Write the queued bodies and rotate the open file"""
+        self.queue.put(None)
+        self._writer.join()
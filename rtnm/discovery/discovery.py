@@ -0,0 +1,194 @@
+"""
+.. module:: discovery
+   :platform: Unix, Windows
+   :synopsis: Concurrent discovery of the hostname and version of dial in devices with an on disk cache
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import os
+import json
+import grpc
+from concurrent.futures import ThreadPoolExecutor, Future
+from multiprocessing import Process, Event
+from pathlib import Path
+from time import time, sleep, monotonic
+from logging import Logger, getLogger
+from typing import List, Dict, Any, Tuple, Optional
+from protos.gnmi_pb2_grpc import gNMIStub
+from utils.utils import version_request, parse_version_response, hostname_request, parse_hostname_response
+
+
+class DiscoveryCache:
+    """The hostname and version of devices keyed by address and encoding, gnmi or ems, as a gNMI input
+    gets the hostname of the device while a Cisco EMS input takes it from the telemetry. Stored as a JSON
+    file only written by the DiscoveryProcess, every write merges with the file on disk and atomically
+    replaces it, so the connectors only ever read complete files
+
+    :param path: The location of the cache file
+    :type path: Path
+    :param ttl: The number of seconds an entry can be used for
+    :type ttl: int
+
+    """
+
+    def __init__(self, path: Path, ttl: int) -> None:
+        self.path: Path = path
+        self.ttl: int = ttl
+
+    def _load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        try:
+            with open(self.path, "r") as file_desc:
+                return json.load(file_desc)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, address: str, encoding: str) -> Optional[Dict[str, Any]]:
+        """Get the cached hostname, version and discovery time of a device
+
+        :param address: The address of the device
+        :type address: str
+        :param encoding: The encoding of the input of the device, gnmi or ems
+        :type encoding: str
+        :returns: The entry of the device or None if there isn't one or it expired
+
+        """
+        entry: Optional[Dict[str, Any]] = self._load().get(address, {}).get(encoding)
+        if not isinstance(entry, dict) or entry["time"] + self.ttl < time():
+            return None
+        return entry
+
+    def update(self, entries: Dict[Tuple[str, str], Tuple[str, str]]) -> None:
+        """Store the hostname and version of devices
+
+        :param entries: The hostname and version of each device keyed by address and encoding
+        :type entries: Dict[Tuple[str, str], Tuple[str, str]]
+
+        """
+        if not entries:
+            return
+        self.path.parent.mkdir(exist_ok=True)
+        cache: Dict[str, Dict[str, Dict[str, Any]]] = self._load()
+        now: float = time()
+        for (address, encoding), (hostname, version) in entries.items():
+            cache.setdefault(address, {})[encoding] = {"hostname": hostname, "version": version, "time": now}
+        temp_path: Path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as file_desc:
+            json.dump(cache, file_desc)
+        os.replace(temp_path, self.path)
+
+
+def input_encoding(input_format: str) -> str:
+    """Get the encoding a dial in input is cached under
+
+    :param input_format: The format of the dial in input, gnmi or cisco-ems
+    :type input_format: str
+    :returns: gnmi or ems
+
+    """
+    return "gnmi" if input_format == "gnmi" else "ems"
+
+
+def discover_device(device_args: Dict[str, Any], timeout: float) -> Tuple[str, str]:
+    """Get the hostname and version of a dial in device over gNMI
+
+    :param device_args: The arguments of the dial in input of the device
+    :type device_args: Dict[str, Any]
+    :param timeout: The timeout of each Get
+    :type timeout: float
+    :returns: The hostname (empty for Cisco EMS inputs, which take it from the telemetry) and version
+
+    """
+    target: str = ":".join([device_args["address"], device_args["port"]])
+    options: List[Tuple[str, Any]] = [("grpc.ssl_target_name_override", "ems.cisco.com")]
+    if "pem-file" in device_args:
+        with open(device_args["pem-file"], "rb") as file_desc:
+            credentials = grpc.ssl_channel_credentials(file_desc.read())
+        channel: grpc.Channel = grpc.secure_channel(target, credentials, options)
+    else:
+        channel = grpc.insecure_channel(target, options)
+    metadata: List[Tuple[str, str]] = [("username", device_args["username"]), ("password", device_args["password"])]
+    try:
+        stub: gNMIStub = gNMIStub(channel)
+        hostname: str = ""
+        if device_args["format"] == "gnmi":
+            hostname = parse_hostname_response(stub.Get(hostname_request(), metadata=metadata, timeout=timeout))
+        version: str = parse_version_response(stub.Get(version_request(), metadata=metadata, timeout=timeout))
+        return hostname, version
+    finally:
+        channel.close()
+
+
+class DiscoveryProcess(Process):
+    """Discover the dial in devices that aren't in the cache before the connectors are started, then refresh
+    the cached devices that weren't discovered by this run of RTNM while the connectors run on their cached
+    entries. Both go through a bounded number of concurrent Gets and a bounded rate of new Gets so the devices
+    aren't hit in a burst, and this process is the only writer of the cache. Runs in its own process so no
+    gRPC channel is ever opened in the main process before forking
+
+    :param log_name: The log name that will be used for logging
+    :type log_name: str
+    :param inputs: The arguments of the dial in inputs keyed by section name
+    :type inputs: Dict[str, Dict[str, Any]]
+    :param cache: The cache to store the results in
+    :type cache: DiscoveryCache
+    :param concurrency: The maximum number of devices being discovered at once
+    :type concurrency: int
+    :param rate: The maximum number of devices to start discovering per second
+    :type rate: float
+    :param started: When the discovery of this run of RTNM started, older entries are refreshed
+    :type started: float
+    :param timeout: The timeout of each Get
+    :type timeout: float
+
+    """
+
+    def __init__(self, log_name: str, inputs: Dict[str, Dict[str, Any]], cache: DiscoveryCache,
+                 concurrency: int, rate: float, started: float, timeout: float = 30.0) -> None:
+        super().__init__(name=f"{log_name}-discovery")
+        self.log: Logger = getLogger(log_name)
+        self.inputs: Dict[str, Dict[str, Any]] = inputs
+        self.cache: DiscoveryCache = cache
+        self.concurrency: int = concurrency
+        self.rate: float = rate
+        self.started: float = started
+        self.timeout: float = timeout
+        # Set once the devices that weren't cached have been discovered
+        self.discovered: Event = Event()
+
+    def _discover(self, devices: Dict[Tuple[str, str], Dict[str, Any]]) -> Dict[Tuple[str, str], Tuple[str, str]]:
+        futures: Dict[Tuple[str, str], Future] = {}
+        interval: float = 1 / self.rate if self.rate else 0.0
+        next_start: float = monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for key, device_args in devices.items():
+                delay: float = next_start - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                next_start = max(next_start, monotonic()) + interval
+                futures[key] = executor.submit(discover_device, device_args, self.timeout)
+        entries: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        for (address, encoding), future in futures.items():
+            try:
+                entries[(address, encoding)] = future.result()
+            except Exception as error:
+                self.log.error(f"Discovery of {address} ({encoding}) failed: {error}")
+        self.cache.update(entries)
+        return entries
+
+    def run(self) -> None:
+        pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        stale: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for device_args in self.inputs.values():
+            if device_args["dial"] == "in":
+                key: Tuple[str, str] = (device_args["address"], input_encoding(device_args["format"]))
+                entry: Optional[Dict[str, Any]] = self.cache.get(*key)
+                if entry is None:
+                    pending[key] = device_args
+                elif entry["time"] < self.started:
+                    stale[key] = device_args
+        self.log.info(f"Discovering {len(pending)} devices, {len(stale)} are cached and refreshed afterwards")
+        try:
+            self.log.info(f"Discovered {len(self._discover(pending))} devices")
+        finally:
+            self.discovered.set()
+        if stale:
+            self.log.info(f"Refreshed {len(self._discover(stale))} cached devices")
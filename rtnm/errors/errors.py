@@ -18,3 +18,8 @@ class ElasticSearchUploaderError(Exception):
 
 class ConfigError(Exception):
     pass
+
+
+class UploaderError(Exception):
+    """Generic Error of an output that can't be used"""
+    pass
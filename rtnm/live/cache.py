@@ -0,0 +1,151 @@
+"""
+.. module:: cache
+   :platform: Unix, Windows
+   :synopsis: Last value of every series of parsed telemetry, queried for the current state of the devices
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from sys import intern
+from time import time_ns
+from typing import Dict, Tuple, List, Any, Optional
+
+# Sorted (name, value) pairs of the keys of a series
+SeriesKeys = Tuple[Tuple[str, Any], ...]
+# Field names, values in the same order and timestamp (ns) of the last value of a series
+LastValue = Tuple[Tuple[str, ...], Tuple[Any, ...], int]
+
+
+class LastValueCache:
+    """Keeps the last value of every series, a series being a host, yang path and keys. Series are nested
+    by host then yang path so queries only look at the series of the hosts and yang paths they match. Strings
+    are interned and the field names and keys of a series are tuples shared by every series with the same
+    ones, so a series only holds its values. Rows only carrying some of the fields of a series, as sent
+    on change, are merged into its last value
+
+    :param ttl: The number of seconds after which a series that stopped updating is removed
+    :type ttl: float
+
+    """
+
+    def __init__(self, ttl: float = 86400.0) -> None:
+        self.ttl: float = ttl
+        # hostname or ip -> yang path -> keys -> last value
+        self.series: Dict[str, Dict[str, Dict[SeriesKeys, LastValue]]] = {}
+        self.ips: Dict[str, str] = {}
+        self._keys: Dict[SeriesKeys, SeriesKeys] = {}
+        self._fields: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(series) for paths in self.series.values() for series in paths.values())
+
+    def _shared_keys(self, keys: Dict[str, Any]) -> SeriesKeys:
+        series_keys: SeriesKeys = tuple(sorted(
+            (intern(name), intern(value) if isinstance(value, str) else value) for name, value in keys.items()
+        ))
+        return self._keys.setdefault(series_keys, series_keys)
+
+    def _shared_fields(self, fields: Tuple[str, ...]) -> Tuple[str, ...]:
+        shared: Optional[Tuple[str, ...]] = self._fields.get(fields)
+        if shared is None:
+            shared = tuple(intern(name) for name in fields)
+            self._fields[shared] = shared
+        return shared
+
+    def update(self, rows: List[Tuple[str, str, str, int, Dict[str, Any], Dict[str, Any]]]) -> None:
+        """Update the last values with the rows of a batch
+
+        :param rows: The rows (hostname, ip, yang path, timestamp, keys, content)
+        :type rows: List[Tuple[str, str, str, int, Dict[str, Any], Dict[str, Any]]]
+
+        """
+        for hostname, ip, yang_path, timestamp, keys, content in rows:
+            host: str = hostname or ip
+            paths: Optional[Dict[str, Dict[SeriesKeys, LastValue]]] = self.series.get(host)
+            if paths is None:
+                host = intern(host)
+                paths = self.series[host] = {}
+                self.ips[host] = intern(ip)
+            path_series: Optional[Dict[SeriesKeys, LastValue]] = paths.get(yang_path)
+            if path_series is None:
+                path_series = paths[intern(yang_path)] = {}
+            series_keys: SeriesKeys = self._shared_keys(keys)
+            fields: Tuple[str, ...] = tuple(content)
+            previous: Optional[LastValue] = path_series.get(series_keys)
+            if previous is not None:
+                if timestamp < previous[2]:
+                    continue
+                if previous[0] != fields:
+                    merged: Dict[str, Any] = dict(zip(previous[0], previous[1]))
+                    merged.update(content)
+                    content, fields = merged, tuple(merged)
+            path_series[series_keys] = (self._shared_fields(fields), tuple(content.values()), timestamp)
+
+    def expire(self) -> int:
+        """Remove the series that haven't been updated for longer than the ttl
+
+        :returns: The number of series removed
+
+        """
+        oldest: int = time_ns() - int(self.ttl * 1e9)
+        removed: int = 0
+        for host in list(self.series):
+            paths: Dict[str, Dict[SeriesKeys, LastValue]] = self.series[host]
+            for yang_path in list(paths):
+                path_series: Dict[SeriesKeys, LastValue] = paths[yang_path]
+                for series_keys in [series_keys for series_keys, value in path_series.items() if value[2] < oldest]:
+                    del path_series[series_keys]
+                    removed += 1
+                if not path_series:
+                    del paths[yang_path]
+            if not paths:
+                del self.series[host]
+                del self.ips[host]
+        # Drop the shared tuples no series uses anymore
+        if removed:
+            used_keys: Dict[SeriesKeys, SeriesKeys] = {}
+            used_fields: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+            for paths in self.series.values():
+                for path_series in paths.values():
+                    for series_keys, (fields, _, _) in path_series.items():
+                        used_keys[series_keys] = series_keys
+                        used_fields[fields] = fields
+            self._keys, self._fields = used_keys, used_fields
+        return removed
+
+    def query(self, subscription: Any, fields: Optional[Any] = None, max_age: Optional[float] = None,
+              limit: int = 10000) -> List[Dict[str, Any]]:
+        """Get the last value of the series matching a subscription
+
+        :param subscription: The host, yang path and key filters
+        :type subscription: Subscription
+        :param fields: A compiled pattern of the fields to return, every field if None
+        :type fields: Pattern
+        :param max_age: The number of seconds after which a series is left out as stale
+        :type max_age: float
+        :param limit: The maximum number of series returned
+        :type limit: int
+        :returns: The hostname, ip, yang path, keys, timestamp and content of each series
+
+        """
+        oldest: int = time_ns() - int(max_age * 1e9) if max_age is not None else 0
+        values: List[Dict[str, Any]] = []
+        for host, paths in self.series.items():
+            if not subscription.matches_host(host, self.ips[host]):
+                continue
+            for yang_path, path_series in paths.items():
+                if not subscription.matches_path(yang_path):
+                    continue
+                for series_keys, (names, field_values, timestamp) in path_series.items():
+                    if timestamp < oldest:
+                        continue
+                    keys: Dict[str, Any] = dict(series_keys)
+                    if not subscription.matches_keys(keys):
+                        continue
+                    content: Dict[str, Any] = {
+                        name: value for name, value in zip(names, field_values)
+                        if fields is None or fields.match(name)
+                    }
+                    values.append({"hostname": host, "ip": self.ips[host], "yang_path": yang_path, "keys": keys,
+                                   "timestamp": timestamp, "content": content})
+                    if len(values) >= limit:
+                        return values
+        return values
@@ -0,0 +1,255 @@
+"""
+.. module:: history
+   :platform: Unix, Windows
+   :synopsis: Short retention history of every numeric field of parsed telemetry in fixed size ring buffers
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from array import array
+from sys import intern
+from time import time_ns
+from typing import Dict, Tuple, List, Any, Optional, Callable
+
+# Sorted (name, value) pairs of the keys of a series
+SeriesKeys = Tuple[Tuple[str, Any], ...]
+Point = Tuple[int, float]
+
+
+class Ring:
+    """The samples of a field of a series in arrays of timestamps (ns) and values, which start small and
+    double until they reach the capacity, after which the oldest sample is overwritten
+
+    """
+
+    __slots__ = ("timestamps", "values", "start", "count")
+
+    def __init__(self) -> None:
+        self.timestamps: array = array("q", bytes(64))
+        self.values: array = array("d", bytes(64))
+        self.start: int = 0
+        self.count: int = 0
+
+    def append(self, timestamp: int, value: float, capacity: int) -> None:
+        """Add a sample, samples older than the last one are ignored
+
+        :param timestamp: The timestamp of the sample in ns
+        :type timestamp: int
+        :param value: The value of the sample
+        :type value: float
+        :param capacity: The maximum number of samples kept
+        :type capacity: int
+
+        """
+        size: int = len(self.timestamps)
+        if self.count and timestamp < self.timestamps[(self.start + self.count - 1) % size]:
+            return
+        if self.count == size:
+            if size < capacity:
+                # Unroll the ring into bigger arrays
+                grown: int = min(size * 2, capacity)
+                self.timestamps = self.timestamps[self.start:] + self.timestamps[:self.start] + \
+                    array("q", bytes(8 * (grown - size)))
+                self.values = self.values[self.start:] + self.values[:self.start] + array("d", bytes(8 * (grown - size)))
+                self.start = 0
+                size = grown
+            else:
+                self.timestamps[self.start] = timestamp
+                self.values[self.start] = value
+                self.start = (self.start + 1) % size
+                return
+        index: int = (self.start + self.count) % size
+        self.timestamps[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+
+    @property
+    def last_timestamp(self) -> int:
+        return self.timestamps[(self.start + self.count - 1) % len(self.timestamps)] if self.count else 0
+
+    def points(self, oldest: int) -> List[Point]:
+        """Get the samples from a point in time onwards
+
+        :param oldest: The timestamp in ns of the oldest sample returned
+        :type oldest: int
+        :returns: The timestamp and value of the samples, oldest first
+
+        """
+        size: int = len(self.timestamps)
+        points: List[Point] = []
+        for offset in range(self.count):
+            index: int = (self.start + offset) % size
+            if self.timestamps[index] >= oldest:
+                points.append((self.timestamps[index], self.values[index]))
+        return points
+
+
+def _increase(points: List[Point]) -> float:
+    # Increase of a counter, a decrease is taken as the counter being reset
+    increase: float = 0.0
+    for (_, previous), (_, current) in zip(points, points[1:]):
+        increase += current - previous if current >= previous else current
+    return increase
+
+
+def _rate(points: List[Point]) -> Optional[float]:
+    if len(points) < 2 or points[-1][0] == points[0][0]:
+        return None
+    return _increase(points) / ((points[-1][0] - points[0][0]) / 1e9)
+
+
+def _rates(points: List[Point]) -> List[Point]:
+    return [
+        (timestamp, (current - previous if current >= previous else current) / ((timestamp - previous_time) / 1e9))
+        for (previous_time, previous), (timestamp, current) in zip(points, points[1:]) if timestamp > previous_time
+    ]
+
+
+# Functions of /series returning a single value per series
+AGGREGATES: Dict[str, Callable[[List[Point]], Optional[float]]] = {
+    "min": lambda points: min(value for _, value in points) if points else None,
+    "max": lambda points: max(value for _, value in points) if points else None,
+    "avg": lambda points: sum(value for _, value in points) / len(points) if points else None,
+    "sum": lambda points: sum(value for _, value in points),
+    "count": lambda points: len(points),
+    "last": lambda points: points[-1][1] if points else None,
+    "increase": lambda points: _increase(points) if len(points) > 1 else None,
+    "rate": _rate,
+}
+# Functions of /series returning points per series
+RANGES: Dict[str, Callable[[List[Point]], List[Point]]] = {
+    "raw": lambda points: points,
+    "rates": _rates,
+}
+
+
+class SeriesHistory:
+    """Keeps the last samples of every numeric field of every series, a series being a host, yang path and
+    keys, in a Ring per field. Strings are interned and the keys of a series are tuples shared with every
+    series with the same keys. Samples are kept up to the capacity of the rings and for the retention
+
+    :param retention: The number of seconds of history kept
+    :type retention: float
+    :param capacity: The maximum number of samples kept per field
+    :type capacity: int
+
+    """
+
+    def __init__(self, retention: float = 900.0, capacity: int = 180) -> None:
+        self.retention: float = retention
+        self.capacity: int = max(capacity, 8)
+        # hostname or ip -> yang path -> keys -> field -> samples
+        self.series: Dict[str, Dict[str, Dict[SeriesKeys, Dict[str, Ring]]]] = {}
+        self.ips: Dict[str, str] = {}
+        self._keys: Dict[SeriesKeys, SeriesKeys] = {}
+
+    def __len__(self) -> int:
+        return sum(len(fields) for paths in self.series.values() for series in paths.values()
+                   for fields in series.values())
+
+    def update(self, rows: List[Tuple[str, str, str, int, Dict[str, Any], Dict[str, Any]]]) -> None:
+        """Add the numeric fields of the rows of a batch
+
+        :param rows: The rows (hostname, ip, yang path, timestamp, keys, content)
+        :type rows: List[Tuple[str, str, str, int, Dict[str, Any], Dict[str, Any]]]
+
+        """
+        for hostname, ip, yang_path, timestamp, keys, content in rows:
+            host: str = hostname or ip
+            paths: Optional[Dict[str, Dict[SeriesKeys, Dict[str, Ring]]]] = self.series.get(host)
+            if paths is None:
+                host = intern(host)
+                paths = self.series[host] = {}
+                self.ips[host] = intern(ip)
+            path_series: Optional[Dict[SeriesKeys, Dict[str, Ring]]] = paths.get(yang_path)
+            if path_series is None:
+                path_series = paths[intern(yang_path)] = {}
+            series_keys: SeriesKeys = tuple(sorted(keys.items()))
+            fields: Optional[Dict[str, Ring]] = path_series.get(series_keys)
+            if fields is None:
+                series_keys = self._keys.setdefault(series_keys, tuple(
+                    (intern(name), intern(value) if isinstance(value, str) else value) for name, value in series_keys
+                ))
+                fields = path_series[series_keys] = {}
+            for name, value in content.items():
+                if isinstance(value, (int, float)):
+                    ring: Optional[Ring] = fields.get(name)
+                    if ring is None:
+                        ring = fields[intern(name)] = Ring()
+                    ring.append(timestamp, float(value), self.capacity)
+
+    def expire(self) -> int:
+        """Remove the fields without any sample within the retention
+
+        :returns: The number of fields removed
+
+        """
+        oldest: int = time_ns() - int(self.retention * 1e9)
+        removed: int = 0
+        for host in list(self.series):
+            paths: Dict[str, Dict[SeriesKeys, Dict[str, Ring]]] = self.series[host]
+            for yang_path in list(paths):
+                path_series: Dict[SeriesKeys, Dict[str, Ring]] = paths[yang_path]
+                for series_keys in list(path_series):
+                    fields: Dict[str, Ring] = path_series[series_keys]
+                    for name in [name for name, ring in fields.items() if ring.last_timestamp < oldest]:
+                        del fields[name]
+                        removed += 1
+                    if not fields:
+                        del path_series[series_keys]
+                if not path_series:
+                    del paths[yang_path]
+            if not paths:
+                del self.series[host]
+                del self.ips[host]
+        if removed:
+            self._keys = {
+                series_keys: series_keys for paths in self.series.values() for path_series in paths.values()
+                for series_keys in path_series
+            }
+        return removed
+
+    def query(self, subscription: Any, fields: Optional[Any] = None, seconds: Optional[float] = None,
+              function: str = "raw", limit: int = 10000) -> List[Dict[str, Any]]:
+        """Get the recent history of the fields of the series matching a subscription
+
+        :param subscription: The host, yang path and key filters
+        :type subscription: Subscription
+        :param fields: A compiled pattern of the fields to return, every field if None
+        :type fields: Pattern
+        :param seconds: The number of seconds of history, the whole retention if None
+        :type seconds: float
+        :param function: One of RANGES returning points or AGGREGATES returning a value
+        :type function: str
+        :param limit: The maximum number of fields returned
+        :type limit: int
+        :returns: The hostname, ip, yang path, keys, field and points or value of each field
+        :raises: ValueError if the function is unknown
+
+        """
+        if function not in RANGES and function not in AGGREGATES:
+            raise ValueError(f"Unknown function {function}, use one of {', '.join(list(RANGES) + list(AGGREGATES))}")
+        oldest: int = time_ns() - int(min(seconds or self.retention, self.retention) * 1e9)
+        results: List[Dict[str, Any]] = []
+        for host, paths in self.series.items():
+            if not subscription.matches_host(host, self.ips[host]):
+                continue
+            for yang_path, path_series in paths.items():
+                if not subscription.matches_path(yang_path):
+                    continue
+                for series_keys, series_fields in path_series.items():
+                    keys: Dict[str, Any] = dict(series_keys)
+                    if not subscription.matches_keys(keys):
+                        continue
+                    for name, ring in series_fields.items():
+                        if fields is not None and not fields.match(name):
+                            continue
+                        points: List[Point] = ring.points(oldest)
+                        result: Dict[str, Any] = {"hostname": host, "ip": self.ips[host], "yang_path": yang_path,
+                                                  "keys": keys, "field": name}
+                        if function in RANGES:
+                            result["points"] = RANGES[function](points)
+                        else:
+                            result["value"] = AGGREGATES[function](points)
+                        results.append(result)
+                        if len(results) >= limit:
+                            return results
+        return results
@@ -0,0 +1,433 @@
+"""
+.. module:: live
+   :platform: Unix, Windows
+   :synopsis: Streams the parsed telemetry to subscribed clients and serves the current state of the devices
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import re
+import json
+from fnmatch import translate
+from multiprocessing import Process, Queue
+from queue import Full
+from threading import Thread
+from logging import Logger, getLogger
+from typing import Dict, Tuple, List, Optional, Any, Set, Pattern, Union, Iterable
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.locks import Event
+from tornado.web import Application, RequestHandler
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+from parsers.Parsers import ParsedResponse
+from metrics.metrics import metrics
+from live.cache import LastValueCache
+from live.history import SeriesHistory
+
+# hostname, ip, yang path, timestamp (ns), keys, content
+LiveRow = Tuple[str, str, str, int, Dict[str, Any], Dict[str, Any]]
+
+
+def publish_rows(queue: Queue, parsed_responses: List[ParsedResponse], worker: str) -> None:
+    """Hand the parsed rows of a batch to the live server without ever blocking the worker, the rows are
+    dropped if the live server can't keep up
+
+    :param queue: The queue of the live server
+    :type queue: Queue
+    :param parsed_responses: The parsed rows
+    :type parsed_responses: List[ParsedResponse]
+    :param worker: The name of the worker, used for the metrics
+    :type worker: str
+
+    """
+    if not parsed_responses:
+        return
+    rows: List[LiveRow] = [
+        (row.hostname or "", row.ip_addr, row.yang_path, row.timestamp, row.data["keys"], row.data["content"])
+        for row in parsed_responses
+    ]
+    try:
+        queue.put_nowait(rows)
+    except Full:
+        metrics.inc("rtnm_live_dropped_rows_total", len(rows), worker=worker)
+
+
+def _globs(patterns: Iterable[str]) -> Optional[Pattern]:
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile("|".join(translate(pattern) for pattern in patterns))
+
+
+class Subscription:
+    """The rows a client subscribed to, every given filter has to match. Patterns are shell globs
+
+    :param hosts: Patterns matched against the hostname or the ip of the device
+    :type hosts: List[str]
+    :param paths: Patterns matched against the yang path
+    :type paths: List[str]
+    :param keys: name=pattern, matched against the value of a key of the row
+    :type keys: List[str]
+
+    """
+
+    def __init__(self, hosts: Iterable[str] = (), paths: Iterable[str] = (), keys: Iterable[str] = ()) -> None:
+        self.hosts: Optional[Pattern] = _globs(hosts)
+        self.paths: Optional[Pattern] = _globs(paths)
+        self.keys: Dict[str, Pattern] = {}
+        for key in keys:
+            name, _, pattern = key.partition("=")
+            self.keys[name] = re.compile(translate(pattern or "*"))
+        # Only a handful of hosts and yang paths go through RTNM, remember what each one matched
+        self._matched_hosts: Dict[Tuple[str, str], bool] = {}
+        self._matched_paths: Dict[str, bool] = {}
+
+    @classmethod
+    def from_arguments(cls, arguments: Dict[str, List[Union[str, bytes]]]) -> "Subscription":
+        """Create a subscription from the host, path and key arguments of a request or a message
+
+        :param arguments: The arguments, each a list of values
+        :type arguments: Dict[str, List[Union[str, bytes]]]
+        :returns: The subscription
+
+        """
+        def values(name: str) -> List[str]:
+            return [value.decode() if isinstance(value, bytes) else str(value) for value in arguments.get(name, [])]
+        return cls(values("host"), values("path"), values("key"))
+
+    def matches_host(self, hostname: str, ip: str) -> bool:
+        """Whether a device is part of the subscription
+
+        :param hostname: The hostname of the device
+        :type hostname: str
+        :param ip: The ip of the device
+        :type ip: str
+        :returns: Whether the hostname or the ip matches the host filter
+
+        """
+        if self.hosts is None:
+            return True
+        matched: Optional[bool] = self._matched_hosts.get((hostname, ip))
+        if matched is None:
+            matched = bool(self.hosts.match(hostname) or self.hosts.match(ip))
+            self._matched_hosts[(hostname, ip)] = matched
+        return matched
+
+    def matches_path(self, yang_path: str) -> bool:
+        """Whether a yang path is part of the subscription
+
+        :param yang_path: The yang path
+        :type yang_path: str
+        :returns: Whether the yang path matches the path filter
+
+        """
+        if self.paths is None:
+            return True
+        matched: Optional[bool] = self._matched_paths.get(yang_path)
+        if matched is None:
+            matched = bool(self.paths.match(yang_path))
+            self._matched_paths[yang_path] = matched
+        return matched
+
+    def matches_keys(self, keys: Dict[str, Any]) -> bool:
+        """Whether the keys of a row are part of the subscription
+
+        :param keys: The keys of the row
+        :type keys: Dict[str, Any]
+        :returns: Whether every key filter matches
+
+        """
+        for name, pattern in self.keys.items():
+            if name not in keys or not pattern.match(str(keys[name])):
+                return False
+        return True
+
+    def matches(self, row: LiveRow) -> bool:
+        """Whether a row is part of the subscription
+
+        :param row: The row
+        :type row: LiveRow
+        :returns: Whether the row matches every filter
+
+        """
+        return self.matches_host(row[0], row[1]) and self.matches_path(row[2]) and self.matches_keys(row[4])
+
+
+def _to_json(rows: List[LiveRow]) -> str:
+    return json.dumps([
+        {"hostname": hostname, "ip": ip, "yang_path": yang_path, "timestamp": timestamp, "keys": keys,
+         "content": content}
+        for hostname, ip, yang_path, timestamp, keys, content in rows
+    ])
+
+
+class LiveClient:
+    """Tracks the messages written to a client that haven't reached its socket yet, a client more than
+    buffer_size messages behind is disconnected so it can't hold the rows of the others in memory"""
+
+    def _start_client(self, server: "LiveServer") -> None:
+        self.server: LiveServer = server
+        self.pending: int = 0
+        self.subscription: Subscription = Subscription.from_arguments(self.request.arguments)
+
+    def _written(self, future: Future) -> None:
+        self.pending -= 1
+        # Retrieved so a write to a client that went away isn't logged as an unhandled error
+        future.exception()
+
+    def _track(self, future: Optional[Future]) -> None:
+        if future is None:
+            return
+        self.pending += 1
+        future.add_done_callback(self._written)
+        if self.pending > self.server.buffer_size:
+            self.server.log.warning(f"Disconnecting live client {self.request.remote_ip}, "
+                                    f"{self.pending} messages behind")
+            metrics.inc("rtnm_live_disconnects_total")
+            self.server.clients.discard(self)
+            self.disconnect()
+
+    def send(self, message: str) -> None:
+        raise NotImplementedError("Can't call send in base class")
+
+    def disconnect(self) -> None:
+        raise NotImplementedError("Can't call disconnect in base class")
+
+
+class StreamHandler(LiveClient, WebSocketHandler):
+    """WebSocket on /stream, the subscription is given by the host, path and key arguments of the URL and
+    can be replaced by sending {"host": [...], "path": [...], "key": ["name=pattern", ...]}"""
+
+    def initialize(self, server: "LiveServer") -> None:
+        self._start_client(server)
+
+    def open(self) -> None:
+        self.server.clients.add(self)
+
+    def on_message(self, message: Union[str, bytes]) -> None:
+        try:
+            arguments: Dict[str, Any] = json.loads(message)
+            self.subscription = Subscription.from_arguments(
+                {name: value if isinstance(value, list) else [value] for name, value in arguments.items()}
+            )
+        except (ValueError, AttributeError, re.error) as error:
+            self.write_message(json.dumps({"error": f"Invalid subscription: {error}"}))
+
+    def on_close(self) -> None:
+        self.server.clients.discard(self)
+
+    def send(self, message: str) -> None:
+        try:
+            self._track(self.write_message(message))
+        except WebSocketClosedError:
+            self.server.clients.discard(self)
+
+    def disconnect(self) -> None:
+        self.close(1008, "Client too slow")
+
+
+class EventsHandler(LiveClient, RequestHandler):
+    """Server-Sent Events on /events, the subscription is given by the host, path and key arguments of
+    the URL"""
+
+    def initialize(self, server: "LiveServer") -> None:
+        self._start_client(server)
+        self.closed: Event = Event()
+
+    async def get(self) -> None:
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.server.clients.add(self)
+        self.flush()
+        await self.closed.wait()
+        self.server.clients.discard(self)
+
+    def on_connection_close(self) -> None:
+        self.closed.set()
+
+    def send(self, message: str) -> None:
+        self.write(f"data: {message}\n\n")
+        self._track(self.flush())
+
+    def disconnect(self) -> None:
+        self.closed.set()
+        self.request.connection.close()
+
+
+class ValuesHandler(RequestHandler):
+    """The last value of the series matching the host, path and key arguments on /values, the field
+    argument (repeatable) limits the fields returned, max-age leaves out the series that haven't been updated
+    for that many seconds and limit caps the number of series returned"""
+
+    def initialize(self, server: "LiveServer") -> None:
+        self.server: LiveServer = server
+
+    def get(self) -> None:
+        try:
+            subscription: Subscription = Subscription.from_arguments(self.request.arguments)
+            fields: Optional[Pattern] = _globs(self.get_arguments("field"))
+            max_age: Optional[str] = self.get_argument("max-age", None)
+            limit: int = int(self.get_argument("limit", "10000"))
+            values: List[Dict[str, Any]] = self.server.cache.query(
+                subscription, fields, float(max_age) if max_age is not None else None, limit
+            )
+        except (ValueError, re.error) as error:
+            self.set_status(400)
+            self.write(json.dumps({"error": f"{error}"}))
+            return
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(values))
+
+
+class SeriesHandler(RequestHandler):
+    """The recent history of the numeric fields of the series matching the host, path, key and field
+    arguments on /series. range is the number of seconds of history (the whole retention by default),
+    function is raw or rates for points, or min, max, avg, sum, count, last, increase or rate for a value per
+    field, and limit caps the number of fields returned"""
+
+    def initialize(self, server: "LiveServer") -> None:
+        self.server: LiveServer = server
+
+    def get(self) -> None:
+        try:
+            subscription: Subscription = Subscription.from_arguments(self.request.arguments)
+            fields: Optional[Pattern] = _globs(self.get_arguments("field"))
+            seconds: Optional[str] = self.get_argument("range", None)
+            results: List[Dict[str, Any]] = self.server.history.query(
+                subscription, fields, float(seconds) if seconds is not None else None,
+                self.get_argument("function", "raw"), int(self.get_argument("limit", "10000"))
+            )
+        except (ValueError, re.error) as error:
+            self.set_status(400)
+            self.write(json.dumps({"error": f"{error}"}))
+            return
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(results))
+
+
+class LiveServer(Process):
+    """Receives the parsed rows of every worker and streams the ones each client subscribed to, as one
+    JSON array per batch, over a WebSocket on /stream or Server-Sent Events on /events. The last value of
+    every series is kept and served on /values, the recent samples of every numeric field on /series
+
+    :param name: The log name that will be used for logging
+    :type name: str
+    :param queue: The queue the workers publish their rows on
+    :type queue: Queue
+    :param port: The port to serve on
+    :type port: int
+    :param buffer_size: The number of messages a client can fall behind before being disconnected
+    :type buffer_size: int
+    :param ttl: The number of seconds after which a series that stopped updating is removed from the cache
+    :type ttl: float
+    :param retention: The number of seconds of samples kept for /series
+    :type retention: float
+    :param capacity: The maximum number of samples kept per field for /series
+    :type capacity: int
+
+    """
+
+    def __init__(self, name: str, queue: Queue, port: int, buffer_size: int = 1000, ttl: float = 86400.0,
+                 retention: float = 900.0, capacity: int = 180) -> None:
+        super().__init__(name=f"{name}-live")
+        self.log: Logger = getLogger(name)
+        self.queue: Queue = queue
+        self.port: int = port
+        self.buffer_size: int = buffer_size
+        self.clients: Set[LiveClient] = set()
+        self.cache: LastValueCache = LastValueCache(ttl)
+        self.history: SeriesHistory = SeriesHistory(retention, capacity)
+
+    def publish(self, rows: List[LiveRow]) -> None:
+        """Send the rows to the clients subscribed to them, called on the IOLoop
+
+        :param rows: The rows of a batch of a worker
+        :type rows: List[LiveRow]
+
+        """
+        for client in list(self.clients):
+            matched: List[LiveRow] = [row for row in rows if client.subscription.matches(row)]
+            if matched:
+                try:
+                    client.send(_to_json(matched))
+                except Exception as error:
+                    self.log.debug(f"Sending to a live client failed: {error}")
+                    self.clients.discard(client)
+
+    def handlers(self) -> List[Tuple[str, Any, Dict[str, Any]]]:
+        """The routes of the server
+
+        :returns: The tornado routes
+
+        """
+        return [
+            (r"/stream", StreamHandler, {"server": self}),
+            (r"/events", EventsHandler, {"server": self}),
+            (r"/values", ValuesHandler, {"server": self}),
+            (r"/series", SeriesHandler, {"server": self}),
+        ]
+
+    def receive(self, rows: List[LiveRow]) -> None:
+        """Handle the rows of a batch of a worker, called on the IOLoop
+
+        :param rows: The rows of a batch of a worker
+        :type rows: List[LiveRow]
+
+        """
+        self.cache.update(rows)
+        self.history.update(rows)
+        if self.clients:
+            self.publish(rows)
+
+    def _receive(self) -> None:
+        while True:
+            rows: Optional[List[LiveRow]] = self.queue.get()
+            if rows is None:
+                self.ioloop.add_callback(self.ioloop.stop)
+                return
+            self.ioloop.add_callback(self.receive, rows)
+
+    def _expire(self) -> None:
+        removed: int = self.cache.expire()
+        if removed:
+            self.log.info(f"Removed {removed} series not updated for {self.cache.ttl:.0f}s from the live cache")
+        metrics.set("rtnm_live_series", len(self.cache))
+        removed = self.history.expire()
+        if removed:
+            self.log.info(f"Removed {removed} fields without samples in the last {self.history.retention:.0f}s "
+                          f"from the live history")
+        metrics.set("rtnm_live_history_fields", len(self.history))
+
+    def run(self) -> None:
+        self.ioloop: IOLoop = IOLoop.current()
+        Thread(target=self._receive, name="live-receiver", daemon=True).start()
+        Application(self.handlers()).listen(self.port)
+        PeriodicCallback(self._expire, 60000).start()
+        self.log.info(f"Serving live telemetry on port {self.port}")
+        self.ioloop.start()
+
+
+def init_live(name: str, queue: Queue, port: Optional[int], buffer_size: int = 1000,
+              ttl: float = 86400.0, retention: float = 900.0, capacity: int = 180) -> Optional[LiveServer]:
+    """Start the live server
+
+    :param name: The log name that will be used for logging
+    :type name: str
+    :param queue: The queue the workers publish their rows on
+    :type queue: Queue
+    :param port: The port to serve on, the live server is disabled if None
+    :type port: int
+    :param buffer_size: The number of messages a client can fall behind before being disconnected
+    :type buffer_size: int
+    :param ttl: The number of seconds after which a series that stopped updating is removed from the cache
+    :type ttl: float
+    :param retention: The number of seconds of samples kept for /series
+    :type retention: float
+    :param capacity: The maximum number of samples kept per field for /series
+    :type capacity: int
+    :returns: The live server or None if it is disabled
+
+    """
+    if port is None:
+        return None
+    live_server: LiveServer = LiveServer(name, queue, port, buffer_size, ttl, retention, capacity)
+    live_server.start()
+    return live_server
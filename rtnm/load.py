@@ -0,0 +1,164 @@
+"""
+.. module:: load
+   :platform: Unix, Windows
+   :synopsis: Bulk loads the files written by a file output into the TSDB
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import gzip
+from argparse import ArgumentParser
+from pathlib import Path
+from logging import Logger
+from typing import List, Iterator, TextIO, Union
+from time import sleep, monotonic
+from multiprocessing import Queue
+from loggers.loggers import init_logs
+from errors.errors import ConfigError
+from utils.utils import generate_clients
+from databases.databases import Uploader, FILE_FORMATS
+
+
+def read_records(path: Path, lines_per_record: int) -> Iterator[str]:
+    """Read the records of a file written by a file output, a record cut short by RTNM stopping ends the file
+
+    :param path: The file, compressed with gzip if it ends with .gz
+    :type path: Path
+    :param lines_per_record: The number of lines of a record, 1 for line protocol and 2 for _bulk NDJSON
+    :type lines_per_record: int
+    :returns: The records, newline terminated
+
+    """
+    file_desc: TextIO = gzip.open(path, "rt") if ".gz" in path.suffixes else open(path)
+    with file_desc:
+        record: List[str] = []
+        try:
+            for line in file_desc:
+                if not line.endswith("\n"):
+                    return
+                record.append(line)
+                if len(record) == lines_per_record:
+                    yield "".join(record)
+                    record = []
+        except EOFError:
+            return
+
+
+def post_batch(uploader: Uploader, batch: str, retries: int, log: Logger) -> bool:
+    """Post a batch to the output, retrying with exponential backoff
+
+    :param uploader: The uploader of the output
+    :type uploader: Uploader
+    :param batch: The body to post
+    :type batch: str
+    :param retries: The number of times a failed post is retried
+    :type retries: int
+    :param log: The logger failures are written to
+    :type log: Logger
+    :returns: Whether the batch was posted
+
+    """
+    delay: float = 1.0
+    for attempt in range(retries + 1):
+        if attempt:
+            log.warning(f"Retrying in {delay:.0f}s")
+            sleep(delay)
+            delay = min(delay * 2, 60.0)
+        status: Union[int, str] = uploader.post(batch)
+        if status in [200, 201, 204]:
+            return True
+        log.error(f"Posting {len(batch)} bytes to {uploader.name} failed with {status}")
+    return False
+
+
+def main():
+    """Load the files written by a file output into an InfluxDB or ElasticSearch output of a configuration
+    file, in batches as large as the output accepts
+
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config", dest="config", help="Location of the configuration file", required=True)
+    parser.add_argument("-o", "--output", dest="output", help="Output section to load the files into", required=True)
+    parser.add_argument("-d", "--directory", dest="directory", help="Directory of the files to load", required=True)
+    parser.add_argument("-s", "--max-size", dest="max_size", type=int, default=8,
+                        help="Maximum size in MB of each batch posted to the output")
+    parser.add_argument("-n", "--max-records", dest="max_records", type=int, default=50000,
+                        help="Maximum number of lines or documents in each batch posted to the output")
+    parser.add_argument("-r", "--retries", dest="retries", type=int, default=5,
+                        help="Number of times a failed batch is retried before stopping")
+    parser.add_argument("-m", "--mark-loaded", dest="mark_loaded", action="store_true",
+                        help="Rename the files loaded to *.loaded so loading again skips them")
+    parser.add_argument("--include-in-progress", dest="include_in_progress", action="store_true",
+                        help="Also load the files RTNM is still writing, or left behind when it was killed, "
+                             "unless --mark-loaded is given")
+    parser.add_argument("-v", "--verbose", dest="debug", help="Enable debugging", action="store_true")
+    args = parser.parse_args()
+    try:
+        if not Path(args.config).is_file():
+            raise IOError(f"File {args.config} doesn't exist")
+        if not Path(args.directory).is_dir():
+            raise IOError(f"Directory {args.directory} doesn't exist")
+        _, outputs = generate_clients(args.config)
+        if args.output not in outputs:
+            raise ConfigError(f"No output {args.output} in {args.config}")
+        if outputs[args.output]["type"] not in FILE_FORMATS:
+            raise ConfigError(f"Output {args.output} must be of type influxdb, influxdbv2 or elasticsearch")
+    except ConfigError as error:
+        parser.error(f"{error}")
+    except KeyError as error:
+        parser.error(f"Error in the configuration file: No key for {error}.\nCan't parse the config file")
+    except Exception as error:
+        parser.error(f"{error}")
+
+    path: Path = Path().absolute() / "logs"
+    log_queue: Queue = Queue()
+    log_name: str = f"rtnm-load-{args.config.strip('ini').strip('.').split('/')[-1]}"
+    rtnm_log = init_logs(log_name, path, log_queue, args.debug)
+    try:
+        output_type: str = outputs[args.output]["type"]
+        uploader_class, extension = FILE_FORMATS[output_type]
+        outputs[args.output]["log_name"] = log_name
+        outputs[args.output]["name"] = args.output
+        uploader: Uploader = uploader_class(**outputs[args.output])
+        patterns: List[str] = [f"*.{extension}", f"*.{extension}.gz"]
+        if args.include_in_progress and args.mark_loaded:
+            # Renaming a file RTNM is still writing would make it lose everything written afterwards
+            rtnm_log.logger.warning("Not loading the files in progress, they can't be marked as loaded")
+        elif args.include_in_progress:
+            patterns.extend(f"{pattern}.inprogress" for pattern in patterns[:])
+        files: List[Path] = sorted({file for pattern in patterns for file in Path(args.directory).glob(pattern)})
+        lines_per_record: int = 2 if extension == "ndjson" else 1
+        max_size: int = args.max_size * 1048576
+        started: float = monotonic()
+        loaded: int = 0
+        for file in files:
+            rtnm_log.logger.info(f"Loading {file}")
+            batch: List[str] = []
+            batch_size: int = 0
+            complete: bool = True
+            for record in read_records(file, lines_per_record):
+                if batch and (batch_size + len(record) > max_size or len(batch) >= args.max_records):
+                    if not post_batch(uploader, "".join(batch), args.retries, rtnm_log.logger):
+                        complete = False
+                        break
+                    loaded += len(batch)
+                    batch, batch_size = [], 0
+                batch.append(record)
+                batch_size += len(record)
+            if complete and batch:
+                complete = post_batch(uploader, "".join(batch), args.retries, rtnm_log.logger)
+                loaded += len(batch) if complete else 0
+            if not complete:
+                rtnm_log.logger.error(f"Stopped loading at {file}, the batches before it were loaded")
+                break
+            if args.mark_loaded:
+                file.rename(file.with_name(f"{file.name}.loaded"))
+        rtnm_log.logger.info(f"Loaded {loaded} records in {monotonic() - started:.3f}s")
+    except Exception as error:
+        rtnm_log.logger.error(error)
+    except KeyboardInterrupt:
+        rtnm_log.logger.error("Shutting down due to user ctrl-c")
+    finally:
+        rtnm_log.queue.put(None)
+
+
+if __name__ == "__main__":
+    main()
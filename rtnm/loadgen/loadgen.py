@@ -0,0 +1,361 @@
+"""
+.. module:: loadgen
+   :platform: Unix, Windows
+   :synopsis: Synthetic routers and TSDB endpoints used for end to end load tests of RTNM
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import json
+import gzip
+import socket
+import grpc
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import ip_address
+from struct import Struct
+from threading import Thread, Event
+from time import perf_counter, sleep, time_ns
+from typing import List, Dict, Any, Iterator, Optional
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.web import Application, RequestHandler
+from protos.gnmi_pb2 import GetRequest, GetResponse, Notification, SubscribeResponse, TypedValue, Update
+from protos.gnmi_pb2_grpc import gNMIServicer, add_gNMIServicer_to_server
+from protos.cisco_mdt_dial_in_pb2 import CreateSubsArgs, CreateSubsReply
+from protos.cisco_mdt_dial_in_pb2_grpc import gRPCConfigOperServicer, add_gRPCConfigOperServicer_to_server
+from protos.telemetry_pb2 import Telemetry
+from benchmarks.fixtures import SHAPES, ems_telemetry, gnmi_response
+
+VERSION: str = "7.3.2"
+
+
+class Pacer:
+    """Sleep between messages so a stream keeps a fixed rate
+
+    :param rate: Messages per second, 0 sends as fast as possible
+    :type rate: float
+
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval: float = 1 / rate if rate else 0.0
+        self.next_send: float = perf_counter()
+
+    def wait(self) -> None:
+        if self.interval:
+            self.next_send += self.interval
+            delay: float = self.next_send - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+
+class Shape:
+    """The size of the messages sent by the fake devices
+
+    :param rows: The number of rows in each message
+    :type rows: int
+    :param leaves: The number of leaves in each row
+    :type leaves: int
+    :param depth: The number of containers the leaves are nested in
+    :type depth: int
+
+    """
+
+    def __init__(self, rows: int, leaves: int, depth: int) -> None:
+        self.rows: int = rows
+        self.leaves: int = leaves
+        self.depth: int = depth
+
+    def telemetry(self, hostname: str) -> Telemetry:
+        return ems_telemetry(self.rows, self.leaves, self.depth, hostname)
+
+    def gnmi(self) -> SubscribeResponse:
+        return gnmi_response(self.rows, self.leaves, self.depth)
+
+
+def stamp_telemetry(telemetry: Telemetry) -> bytes:
+    """Refresh the timestamps of a Telemetry message so latency can be measured at the sink"""
+    now: int = time_ns() // 1000000
+    telemetry.msg_timestamp = now
+    for gpbkv in telemetry.data_gpbkv:
+        gpbkv.timestamp = now
+    return telemetry.SerializeToString()
+
+
+class FakeGNMIServicer(gNMIServicer):
+    """A gNMI target answering the hostname and version Gets of RTNM and streaming synthetic updates
+
+    :param hostname: The hostname of the fake device
+    :type hostname: str
+    :param shape: The size of the updates
+    :type shape: Shape
+    :param rate: Updates per second of each subscription
+    :type rate: float
+    :param stop: Set to end every stream
+    :type stop: Event
+
+    """
+
+    def __init__(self, hostname: str, shape: Shape, rate: float, stop: Event) -> None:
+        self.hostname: str = hostname
+        self.shape: Shape = shape
+        self.rate: float = rate
+        self.stop: Event = stop
+
+    def Get(self, request: GetRequest, context) -> GetResponse:
+        if any("host-names" in elem.name for path in request.path for elem in path.elem):
+            value: Dict[str, str] = {"host-name": self.hostname}
+        else:
+            value = {"label": VERSION}
+        update: Update = Update(path=request.path[0], val=TypedValue(json_ietf_val=json.dumps(value).encode()))
+        return GetResponse(notification=[Notification(timestamp=time_ns(), update=[update])])
+
+    def Subscribe(self, request_iterator, context) -> Iterator[SubscribeResponse]:
+        next(request_iterator)
+        response: SubscribeResponse = self.shape.gnmi()
+        pacer: Pacer = Pacer(self.rate)
+        yield SubscribeResponse(sync_response=True)
+        while context.is_active() and not self.stop.is_set():
+            response.update.timestamp = time_ns()
+            yield response
+            pacer.wait()
+
+
+class FakeConfigOperServicer(gRPCConfigOperServicer):
+    """A Cisco EMS target streaming synthetic kv-GPB telemetry for every subscription
+
+    :param hostname: The hostname of the fake device
+    :type hostname: str
+    :param shape: The size of the messages
+    :type shape: Shape
+    :param rate: Messages per second of each subscription
+    :type rate: float
+    :param stop: Set to end every stream
+    :type stop: Event
+
+    """
+
+    def __init__(self, hostname: str, shape: Shape, rate: float, stop: Event) -> None:
+        self.hostname: str = hostname
+        self.shape: Shape = shape
+        self.rate: float = rate
+        self.stop: Event = stop
+
+    def CreateSubs(self, request: CreateSubsArgs, context) -> Iterator[CreateSubsReply]:
+        telemetry: Telemetry = self.shape.telemetry(self.hostname)
+        pacer: Pacer = Pacer(self.rate)
+        while context.is_active() and not self.stop.is_set():
+            yield CreateSubsReply(ResReqId=request.ReqId, data=stamp_telemetry(telemetry))
+            pacer.wait()
+
+
+def start_device(address: str, port: int, hostname: str, shape: Shape, rate: float, stop: Event,
+                 streams: int) -> grpc.Server:
+    """Start a fake device serving both gNMI and Cisco EMS on an address
+
+    :param address: The address the device listens on
+    :type address: str
+    :param port: The port the device listens on
+    :type port: int
+    :param hostname: The hostname of the device
+    :type hostname: str
+    :param shape: The size of the messages
+    :type shape: Shape
+    :param rate: Messages per second of each subscription
+    :type rate: float
+    :param stop: Set to end every stream
+    :type stop: Event
+    :param streams: The number of concurrent streams the device serves
+    :type streams: int
+    :returns: The started gRPC server
+
+    """
+    server: grpc.Server = grpc.server(ThreadPoolExecutor(max_workers=streams + 2))
+    add_gNMIServicer_to_server(FakeGNMIServicer(hostname, shape, rate, stop), server)
+    add_gRPCConfigOperServicer_to_server(FakeConfigOperServicer(hostname, shape, rate, stop), server)
+    server.add_insecure_port(f"{address}:{port}")
+    server.start()
+    return server
+
+
+def dial_out(target: str, hostname: str, shape: Shape, rate: float, stop: Event) -> None:
+    """Stream synthetic telemetry to the RTNM dial out server using the TCP framing of Cisco MDT
+
+    :param target: The address:port of the dial out server
+    :type target: str
+    :param hostname: The hostname of the fake device
+    :type hostname: str
+    :param shape: The size of the messages
+    :type shape: Shape
+    :param rate: Messages per second
+    :type rate: float
+    :param stop: Set to end the stream
+    :type stop: Event
+
+    """
+    header: Struct = Struct(">hhhhi")
+    address, port = target.rsplit(":", 1)
+    telemetry: Telemetry = shape.telemetry(hostname)
+    while not stop.is_set():
+        try:
+            with socket.create_connection((address, int(port))) as conn:
+                pacer: Pacer = Pacer(rate)
+                while not stop.is_set():
+                    data: bytes = stamp_telemetry(telemetry)
+                    conn.sendall(header.pack(1, 1, 1, 0, len(data)) + data)
+                    pacer.wait()
+        except OSError as error:
+            print(f"{hostname} dial out to {target} failed: {error}")
+            stop.wait(1)
+
+
+class SinkStats:
+    """Counters of the stub TSDB endpoints"""
+
+    def __init__(self) -> None:
+        self.requests: int = 0
+        self.bytes: int = 0
+        self.rows: int = 0
+        self.latencies: List[float] = []
+
+    def add(self, body: bytes, rows: int, timestamp: Optional[int]) -> None:
+        self.requests += 1
+        self.bytes += len(body)
+        self.rows += rows
+        if timestamp:
+            self.latencies.append((time_ns() - timestamp) / 1000000000)
+
+    def report(self, interval: float) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "requests/s": self.requests / interval,
+            "MB/s": self.bytes / interval / 1048576,
+            "rows/s": self.rows / interval,
+            "latency avg s": sum(self.latencies) / len(self.latencies) if self.latencies else None,
+            "latency max s": max(self.latencies) if self.latencies else None,
+        }
+        self.requests, self.bytes, self.rows, self.latencies = 0, 0, 0, []
+        return stats
+
+
+class InfluxWriteHandler(RequestHandler):
+    """Mimics the Influxdb /api/v2/write endpoint, the latency is taken from the last line's timestamp"""
+
+    def initialize(self, stats: SinkStats) -> None:
+        self.stats: SinkStats = stats
+
+    def post(self) -> None:
+        body: bytes = self.request.body
+        last_line: bytes = body.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        timestamp: Optional[int] = None
+        try:
+            timestamp = int(last_line.rsplit(b" ", 1)[-1])
+        except ValueError:
+            pass
+        self.stats.add(body, body.count(b"\n") + 1 if body else 0, timestamp)
+        self.set_status(204)
+
+
+class ElasticBulkHandler(RequestHandler):
+    """Mimics the ElasticSearch /_bulk endpoint, the latency is taken from the last document's @timestamp"""
+
+    def initialize(self, stats: SinkStats) -> None:
+        self.stats: SinkStats = stats
+
+    def post(self) -> None:
+        body: bytes = self.request.body
+        if self.request.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        lines: List[bytes] = body.rstrip(b"\n").split(b"\n")
+        timestamp: Optional[int] = None
+        try:
+            timestamp = int(json.loads(lines[-1])["@timestamp"])
+        except (ValueError, KeyError):
+            pass
+        self.stats.add(self.request.body, len(lines) // 2, timestamp)
+        self.write({"took": 0, "errors": False, "items": []})
+
+
+def main():
+    """Start the fake devices and stub TSDB endpoints and report the throughput and latency seen by the sinks"""
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--devices", dest="devices", type=int, default=0,
+                        help="Number of dial in devices serving both gNMI and Cisco EMS")
+    parser.add_argument("--base-address", dest="base_address", default="127.0.0.1",
+                        help="Address of the first dial in device, each device listens on the next address")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=57400, help="Port of the dial in devices")
+    parser.add_argument("--streams", dest="streams", type=int, default=16,
+                        help="Number of concurrent subscriptions each dial in device can serve")
+    parser.add_argument("-o", "--dial-out-devices", dest="dial_out_devices", type=int, default=0,
+                        help="Number of devices dialing out to the RTNM dial out server")
+    parser.add_argument("-t", "--dial-out-target", dest="dial_out_target", default="127.0.0.1:7777",
+                        help="address:port of the RTNM dial out server")
+    parser.add_argument("-r", "--rate", dest="rate", type=float, default=1.0,
+                        help="Messages per second of each subscription, 0 sends as fast as possible")
+    parser.add_argument("-s", "--shape", dest="shape", default="small", choices=list(SHAPES),
+                        help="Size of the messages")
+    parser.add_argument("--sink-port", dest="sink_port", type=int, default=0,
+                        help="Port of the stub Influxdb and ElasticSearch endpoints, 0 disables them")
+    parser.add_argument("--report-interval", dest="report_interval", type=float, default=5.0,
+                        help="Seconds between throughput reports of the stub endpoints")
+    parser.add_argument("-w", "--write-config", dest="write_config",
+                        help="Write an RTNM configuration file subscribing to the fake devices")
+    args = parser.parse_args()
+    shape: Shape = Shape(*SHAPES[args.shape])
+    stop: Event = Event()
+    servers: List[grpc.Server] = []
+    threads: List[Thread] = []
+    addresses: List[str] = [str(ip_address(args.base_address) + index) for index in range(args.devices)]
+    for index, address in enumerate(addresses):
+        servers.append(start_device(address, args.port, f"fake-router-{index}", shape, args.rate, stop, args.streams))
+    for index in range(args.dial_out_devices):
+        thread: Thread = Thread(target=dial_out, args=(args.dial_out_target, f"fake-dial-out-{index}", shape,
+                                                       args.rate, stop), daemon=True)
+        thread.start()
+        threads.append(thread)
+    if args.write_config:
+        write_config(args.write_config, addresses, args.port, args.sink_port)
+    print(f"Started {len(servers)} dial in devices and {len(threads)} dial out devices")
+    try:
+        if args.sink_port:
+            stats: SinkStats = SinkStats()
+            app: Application = Application([
+                (r"/api/v2/write", InfluxWriteHandler, {"stats": stats}),
+                (r"/_bulk", ElasticBulkHandler, {"stats": stats}),
+            ])
+            app.listen(args.sink_port)
+            PeriodicCallback(lambda: print(stats.report(args.report_interval)),
+                             args.report_interval * 1000).start()
+            IOLoop.current().start()
+        else:
+            stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for server in servers:
+            server.stop(None)
+
+
+def write_config(path: str, addresses: List[str], port: int, sink_port: int) -> None:
+    """Write an RTNM configuration file that subscribes to every fake device, alternating
+    between gNMI and Cisco EMS, and uploads to the stub Influxdb endpoint
+
+    """
+    sections: List[str] = []
+    for index, address in enumerate(addresses):
+        if index % 2 == 0:
+            sections.append(f"[fake-gnmi-{index}]\nio = input\ndial = in\nencoding = PROTO\nformat = gnmi\n"
+                            f"sensors = Cisco-IOS-XR-infra-statsd-oper:infra-statistics/interfaces\n"
+                            f"sample-interval = 1\nsubscription-mode = SAMPLE\nstream-mode = STREAM\n"
+                            f"address = {address}\nport = {port}\nusername = root\npassword = root\n"
+                            f"compression = False\nupload = True\n")
+        else:
+            sections.append(f"[fake-ems-{index}]\nio = input\ndial = in\nencoding = self-describing-gpb\n"
+                            f"format = cisco-ems\nsubscriptions = LOAD\naddress = {address}\nport = {port}\n"
+                            f"username = root\npassword = root\ncompression = False\nupload = True\n")
+    sections.append(f"[fake-sink]\nio = output\ntype = influxdb\naddress = 127.0.0.1\nport = {sink_port or 8086}\n"
+                    f"username = admin\npassword = admin\ndatabase = load-test\n")
+    with open(path, "w") as file_desc:
+        file_desc.write("\n".join(sections))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,136 @@
-from logging import getLogger, Logger, LogRecord, StreamHandler, Formatter, INFO, DEBUG
+from logging import getLogger, Logger, LogRecord, StreamHandler, Formatter, Filter, INFO, DEBUG
 from logging.handlers import RotatingFileHandler, QueueHandler
 from multiprocessing import Process, Queue
+from queue import Full
 from pathlib import Path
-from typing import Tuple
+from time import monotonic
+from typing import Tuple, Dict, Any, Optional
+
+# Child loggers of the RTNM logger, each can be given its own level
+LOG_CATEGORIES: Tuple[str, ...] = ("collector", "dispatch", "parser", "upload")
+
+
+def category_logger(log_name: str, category: str) -> Logger:
+    """Get the logger of a category of RTNM, which propagates to the RTNM logger
+
+    :param log_name: The log name used in RTNM
+    :type log_name: str
+    :param category: One of LOG_CATEGORIES
+    :type category: str
+    :returns: The logger of the category
+
+    """
+    return getLogger(f"{log_name}.{category}")
+
+
+class Payload:
+    """Defers rendering a payload (raw bytes, protobuf messages, batches) until a log record is actually
+    emitted and truncates it, so logging payloads costs nothing when the level is disabled and a bounded
+    amount when it isn't. Use with %s formatting, e.g. log.debug("Decoded %s", Payload(response))
+
+    :param payload: The payload to render
+    :type payload: Any
+    :param limit: The maximum number of characters rendered, defaults to Payload.limit
+    :type limit: int
+
+    """
+
+    limit: int = 512
+
+    def __init__(self, payload: Any, limit: Optional[int] = None) -> None:
+        self.payload: Any = payload
+        self.size: Optional[int] = limit
+
+    def __str__(self) -> str:
+        limit: int = self.size if self.size is not None else Payload.limit
+        if isinstance(self.payload, (bytes, bytearray, memoryview)):
+            data: bytes = bytes(self.payload[:limit])
+            rendered: str = repr(data)
+            remaining: int = len(self.payload) - len(data)
+            unit: str = "bytes"
+        else:
+            text: str = str(self.payload)
+            rendered = text[:limit]
+            remaining = len(text) - len(rendered)
+            unit = "characters"
+        if remaining > 0:
+            return f"{rendered}... ({remaining} more {unit})"
+        return rendered
+
+
+class SamplingFilter(Filter):
+    """Keeps one out of every N records below INFO, so debug logging of hot paths can stay enabled
+
+    :param rate: The one out of every N records kept
+    :type rate: int
+
+    """
+
+    def __init__(self, rate: int) -> None:
+        super().__init__()
+        self.rate: int = max(1, rate)
+        self._seen: int = 0
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno >= INFO:
+            return True
+        self._seen += 1
+        return (self._seen - 1) % self.rate == 0
+
+
+class RateLimitFilter(Filter):
+    """Limits the records of a process with a token bucket, the number of records suppressed is
+    appended to the next record let through
+
+    :param rate: The number of records per second
+    :type rate: float
+    :param burst: The number of records allowed at once
+    :type burst: float
+
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        super().__init__()
+        self.rate: float = rate
+        self.burst: float = burst if burst is not None else rate
+        self._tokens: float = self.burst
+        self._updated: float = monotonic()
+        self.suppressed: int = 0
+
+    def filter(self, record: LogRecord) -> bool:
+        if self.rate <= 0:
+            return True
+        now: float = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            self.suppressed += 1
+            return False
+        self._tokens -= 1
+        if self.suppressed:
+            record.msg = f"{record.msg} [{self.suppressed} log records suppressed by rate limiting]"
+            self.suppressed = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """A QueueHandler for a bounded queue that drops records instead of waiting when the queue is full,
+    so a slow log listener or disk never stalls the pipeline. The number of records dropped is appended
+    to the next record enqueued
+    """
+
+    def __init__(self, queue: Queue) -> None:
+        super().__init__(queue)
+        self.dropped: int = 0
+
+    def enqueue(self, record: LogRecord) -> None:
+        if self.dropped:
+            record.msg = f"{record.msg} [{self.dropped} log records dropped, the log queue was full]"
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except Full:
+            self.dropped += 1
 
 
 class RTNMRotatingFileHandler(RotatingFileHandler):
@@ -52,20 +180,30 @@ class MultiProcessQueueLogListener(Process):
 
 
 class MultiProcessQueueLogger(object):
-    def __init__(self, name: str, queue: Queue, debug: bool = False):
+    def __init__(self, name: str, queue: Queue, debug: bool = False, levels: Optional[Dict[str, str]] = None,
+                 sample: int = 1, rate: float = 0.0):
         self.name: str = name
         self.queue: Queue = queue
-        self.queue_handler: QueueHandler = QueueHandler(queue)
+        self.queue_handler: QueueHandler = NonBlockingQueueHandler(queue)
+        self.queue_handler.addFilter(RateLimitFilter(rate))
         self.logger: Logger = getLogger(name)
         self.logger.addHandler(self.queue_handler)
         if debug:
             self.logger.setLevel(DEBUG)
         else:
             self.logger.setLevel(INFO)
+        for category in LOG_CATEGORIES:
+            category_log: Logger = category_logger(name, category)
+            if sample > 1:
+                category_log.addFilter(SamplingFilter(sample))
+            if levels and category in levels:
+                category_log.setLevel(levels[category].upper())
 
 
-def init_logs(name, path: Path, queue: Queue, debug: bool = False) -> Tuple[MultiProcessQueueLogListener, MultiProcessQueueLogger]:
+def init_logs(name, path: Path, queue: Queue, debug: bool = False, levels: Optional[Dict[str, str]] = None,
+              sample: int = 1, rate: float = 0.0, payload_limit: int = 512) -> MultiProcessQueueLogger:
+    Payload.limit = payload_limit
     log_listener: MultiProcessQueueLogListener = MultiProcessQueueLogListener(name, path, queue)
     log_listener.start()
-    main_logger: MultiProcessQueueLogger = MultiProcessQueueLogger(name, queue, debug)
+    main_logger: MultiProcessQueueLogger = MultiProcessQueueLogger(name, queue, debug, levels, sample, rate)
     return main_logger
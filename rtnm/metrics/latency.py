@@ -0,0 +1,101 @@
+"""
+.. module:: latency
+   :platform: Unix, Windows
+   :synopsis: Per stage and end to end latency of the telemetry going through RTNM
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from time import monotonic
+from logging import Logger
+from typing import Dict, Tuple, List, Any, Iterable, Set
+from metrics.metrics import metrics
+
+LATENCY_STAGES: Tuple[str, ...] = ("collect", "queue", "parse", "upload", "end_to_end")
+
+
+class LatencyTracker:
+    """Records the latency of each stage a message goes through, from the timestamp set by the device
+    to the acknowledgment of the output. The stages are collect (device timestamp to receive), queue
+    (receive to the worker dequeuing it), parse (dequeue to parse complete), upload (parse complete to
+    the output acknowledging) and end_to_end (device timestamp to the output acknowledging). Each
+    latency goes to the rtnm_latency_seconds histogram and to a summary logged periodically
+
+    :param log: The logger the summaries are written to
+    :type log: Logger
+    :param summary_interval: The number of seconds between summaries
+    :type summary_interval: float
+
+    """
+
+    def __init__(self, log: Logger, summary_interval: float = 60.0) -> None:
+        self.log: Logger = log
+        self.summary_interval: float = summary_interval
+        self._summary: Dict[Tuple[str, str], List[Any]] = {}
+        self._last_summary: float = monotonic()
+
+    def observe(self, stage: str, seconds: float, device: str = "", output: str = "") -> None:
+        """Record the latency of a stage
+
+        :param stage: The stage, one of LATENCY_STAGES
+        :type stage: str
+        :param seconds: The latency
+        :type seconds: float
+        :param device: The device the latency is for
+        :type device: str
+        :param output: The output the latency is for
+        :type output: str
+
+        """
+        labels: Dict[str, str] = {"stage": stage}
+        if device:
+            labels["device"] = device
+        if output:
+            labels["output"] = output
+        metrics.observe("rtnm_latency_seconds", seconds, **labels)
+        summary: List[Any] = self._summary.setdefault((stage, output), [0, 0.0, float("-inf"), ""])
+        summary[0] += 1
+        summary[1] += seconds
+        if seconds > summary[2]:
+            summary[2] = seconds
+            summary[3] = device
+
+    def observe_received(self, batch_list: Iterable[Tuple[Any, ...]], dequeued: float) -> None:
+        """Record the queue stage of a batch of raw responses
+
+        :param batch_list: The raw responses, stamped with their receive time
+        :type batch_list: Iterable[Tuple[Any, ...]]
+        :param dequeued: The time the batch was dequeued by the worker
+        :type dequeued: float
+
+        """
+        for response in batch_list:
+            self.observe("queue", dequeued - response[5], device=response[4])
+
+    def observe_acked(self, timestamps: Set[Tuple[str, int]], parsed: float, acked: float, output: str) -> None:
+        """Record the upload and end to end stages of a batch uploaded to an output
+
+        :param timestamps: The unique device and device timestamp (ns) of the rows uploaded
+        :type timestamps: Set[Tuple[str, int]]
+        :param parsed: The time the batch finished parsing
+        :type parsed: float
+        :param acked: The time the output acknowledged the batch
+        :type acked: float
+        :param output: The name of the output
+        :type output: str
+
+        """
+        self.observe("upload", acked - parsed, output=output)
+        for device, timestamp in timestamps:
+            self.observe("end_to_end", acked - timestamp / 1e9, device=device, output=output)
+
+    def log_summary(self) -> None:
+        """Log the average and maximum latency of each stage since the last summary, along with the
+        device that had the maximum, once the summary interval has passed"""
+        if monotonic() - self._last_summary < self.summary_interval:
+            return
+        self._last_summary = monotonic()
+        for (stage, output), (count, total, maximum, device) in sorted(self._summary.items()):
+            target: str = f" to {output}" if output else ""
+            worst: str = f" from {device}" if device else ""
+            self.log.info(f"Latency of {stage}{target}: {count} samples, average {total / count:.3f}s, "
+                          f"maximum {maximum:.3f}s{worst}")
+        self._summary = {}
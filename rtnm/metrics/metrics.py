@@ -0,0 +1,349 @@
+"""
+.. module:: metrics
+   :platform: Unix, Windows
+   :synopsis: Pipeline metrics recorded in every RTNM process and served in the Prometheus text format
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import os
+import signal
+from bisect import bisect_left
+from multiprocessing import Process, Queue
+from queue import Full
+from threading import Lock, Thread
+from time import sleep
+from logging import Logger, getLogger
+from typing import Dict, Tuple, List, Optional, Any
+from tornado.ioloop import IOLoop
+from tornado.web import Application, RequestHandler
+
+Labels = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, Labels]
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                      1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+METRICS_HELP: Dict[str, Tuple[str, str]] = {
+    "rtnm_received_messages_total": ("counter", "Messages received from devices"),
+    "rtnm_received_bytes_total": ("counter", "Payload bytes received from devices"),
+    "rtnm_dropped_messages_total": ("counter", "Messages dropped by the overload policy of an input"),
+    "rtnm_reconnects_total": ("counter", "Connection retries of dial in devices"),
+    "rtnm_dial_out_connections_total": ("counter", "Connections of dial out devices"),
+    "rtnm_queue_depth": ("gauge", "Batches waiting in a queue"),
+    "rtnm_collector_batch_size": ("histogram", "Messages in each batch put on the data queue by the connectors"),
+    "rtnm_worker_batch_size": ("histogram", "Messages in each batch dispatched to a worker"),
+    "rtnm_parse_seconds": ("histogram", "Time spent decoding and parsing a batch"),
+    "rtnm_parsed_rows_total": ("counter", "Rows produced by parsing"),
+    "rtnm_aggregation_late_samples_total": ("counter", "Responses dropped by an aggregation as their window was closed"),
+    "rtnm_encode_seconds": ("histogram", "Time spent encoding a batch for an output"),
+    "rtnm_upload_seconds": ("histogram", "Time spent posting a batch to an output"),
+    "rtnm_uploads_total": ("counter", "Posts to an output by status"),
+    "rtnm_uploaded_rows_total": ("counter", "Rows accepted by an output"),
+    "rtnm_latency_seconds": ("histogram", "Latency of each stage from the device timestamp to the output acknowledging"),
+    "rtnm_live_dropped_rows_total": ("counter", "Rows not published to the live server because it couldn't keep up"),
+    "rtnm_live_disconnects_total": ("counter", "Live clients disconnected for falling too far behind"),
+    "rtnm_live_series": ("gauge", "Series in the last value cache of the live server"),
+    "rtnm_live_history_fields": ("gauge", "Fields with samples in the history of the live server"),
+    "rtnm_alerts_total": ("counter", "Alerts of a series that fired or resolved"),
+    "rtnm_alert_notifications_total": ("counter", "Alert notifications posted to webhooks by status"),
+}
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def queue_depth(queue: Queue) -> int:
+    """Get the number of items in a multiprocessing queue
+
+    :param queue: The queue
+    :type queue: Queue
+    :returns: The number of items or -1 where the platform can't tell (macOS)
+
+    """
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return -1
+
+
+class MetricsRecorder:
+    """Records counters, gauges and histograms in the memory of the current process and periodically
+    sends what changed to the metrics server, so recording on the hot path is only a dictionary update.
+    Recording does nothing until the recorder is configured with the metrics queue
+
+    """
+
+    def __init__(self) -> None:
+        self.queue: Optional[Queue] = None
+        self.interval: float = 1.0
+        self._pid: int = 0
+        self._lock: Lock = Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+        self._histograms: Dict[MetricKey, List[Any]] = {}
+
+    def configure(self, queue: Optional[Queue], interval: float = 1.0) -> None:
+        """Set the queue read by the metrics server, which is inherited by the processes started afterwards
+
+        :param queue: The metrics queue or None to disable recording
+        :type queue: Queue
+        :param interval: The number of seconds between the sends of each process
+        :type interval: float
+
+        """
+        self.queue = queue
+        self.interval = interval
+
+    @property
+    def enabled(self) -> bool:
+        """Whether metrics are recorded, used to skip work only needed for recording"""
+        return self.queue is not None
+
+    def _check_process(self) -> None:
+        # The recorder is inherited from the parent when forking, start over with a sender of our own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = Lock()
+            self._counters, self._gauges, self._histograms = {}, {}, {}
+            Thread(target=self._send_loop, name="metrics-sender", daemon=True).start()
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """Increment a counter
+
+        :param name: The name of the counter
+        :type name: str
+        :param value: The amount to increment by
+        :type value: float
+
+        """
+        if self.queue is None:
+            return
+        self._check_process()
+        key: MetricKey = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """Set a gauge
+
+        :param name: The name of the gauge
+        :type name: str
+        :param value: The current value
+        :type value: float
+
+        """
+        if self.queue is None:
+            return
+        self._check_process()
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels: Any) -> None:
+        """Add an observation to a histogram
+
+        :param name: The name of the histogram
+        :type name: str
+        :param value: The observed value
+        :type value: float
+        :param buckets: The upper bounds of the buckets
+        :type buckets: Tuple[float, ...]
+
+        """
+        if self.queue is None:
+            return
+        self._check_process()
+        key: MetricKey = (name, _labels(labels))
+        with self._lock:
+            histogram: Optional[List[Any]] = self._histograms.get(key)
+            if histogram is None:
+                histogram = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+                self._histograms[key] = histogram
+            histogram[1][bisect_left(buckets, value)] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def send(self) -> None:
+        """Send what was recorded since the last send to the metrics server"""
+        with self._lock:
+            if not (self._counters or self._gauges or self._histograms):
+                return
+            update: Tuple[Dict, Dict, Dict] = (self._counters, self._gauges, self._histograms)
+            self._counters, self._gauges, self._histograms = {}, {}, {}
+        try:
+            self.queue.put_nowait(update)
+        except Full:
+            self._merge_back(update)
+        except (ValueError, AssertionError):
+            pass
+
+    def _merge_back(self, update: Tuple[Dict, Dict, Dict]) -> None:
+        # Keep an update the metrics server had no room for so it goes out with the next send
+        counters, gauges, histograms = update
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0.0) + value
+            for key, value in gauges.items():
+                # A gauge set since is newer
+                self._gauges.setdefault(key, value)
+            for key, histogram in histograms.items():
+                current: Optional[List[Any]] = self._histograms.get(key)
+                if current is None:
+                    self._histograms[key] = histogram
+                else:
+                    current[1] = [count + other for count, other in zip(current[1], histogram[1])]
+                    current[2] += histogram[2]
+                    current[3] += histogram[3]
+
+    def _send_loop(self) -> None:
+        while True:
+            sleep(self.interval)
+            self.send()
+
+
+metrics: MetricsRecorder = MetricsRecorder()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    pairs: List[str] = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsHandler(RequestHandler):
+    def initialize(self, server: "MetricsServer") -> None:
+        self.server: MetricsServer = server
+
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.server.render())
+
+
+class ProfileHandler(RequestHandler):
+    def post(self) -> None:
+        """Profile every RTNM process by signalling the main process, which started the metrics server"""
+        if not hasattr(signal, "SIGUSR2"):
+            self.set_status(501)
+            self.write("Profiling isn't supported on this platform\n")
+            return
+        os.kill(os.getppid(), signal.SIGUSR2)
+        self.write("Profiling started, the profiles are written to the logs directory\n")
+
+
+class MetricsServer(Process):
+    """Merges the metrics sent by every RTNM process and serves them on /metrics, a POST to /profile
+    triggers profiling of every RTNM process
+
+    :param name: The log name that will be used for logging
+    :type name: str
+    :param queue: The queue the processes send their metrics on
+    :type queue: Queue
+    :param port: The port to serve the metrics on
+    :type port: int
+
+    """
+
+    def __init__(self, name: str, queue: Queue, port: int) -> None:
+        super().__init__(name=f"{name}-metrics")
+        self.log: Logger = getLogger(name)
+        self.queue: Queue = queue
+        self.port: int = port
+        self._lock: Lock = Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+        self.histograms: Dict[MetricKey, List[Any]] = {}
+
+    def merge(self, update: Tuple[Dict, Dict, Dict]) -> None:
+        """Merge the metrics sent by a process
+
+        :param update: The counters, gauges and histograms recorded since the last send
+        :type update: Tuple[Dict, Dict, Dict]
+
+        """
+        counters, gauges, histograms = update
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0.0) + value
+            self.gauges.update(gauges)
+            for key, (buckets, counts, total, count) in histograms.items():
+                histogram: Optional[List[Any]] = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = [buckets, list(counts), total, count]
+                else:
+                    histogram[1] = [old + new for old, new in zip(histogram[1], counts)]
+                    histogram[2] += total
+                    histogram[3] += count
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format
+
+        :returns: The metrics
+
+        """
+        lines: Dict[str, List[str]] = {}
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), (buckets, counts, total, count) in sorted(self.histograms.items()):
+                samples: List[str] = lines.setdefault(name, [])
+                cumulative: int = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels: str = _format_labels(labels, f'le="{bound}"')
+                    samples.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                inf_labels: str = _format_labels(labels, 'le="+Inf"')
+                samples.append(f"{name}_bucket{inf_labels} {count}")
+                samples.append(f"{name}_sum{_format_labels(labels)} {total}")
+                samples.append(f"{name}_count{_format_labels(labels)} {count}")
+        output: List[str] = []
+        for name, samples in lines.items():
+            metric_type, description = METRICS_HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(samples)
+        return "\n".join(output) + "\n"
+
+    def _receive(self) -> None:
+        while True:
+            update: Optional[Tuple[Dict, Dict, Dict]] = self.queue.get()
+            if update is None:
+                self.ioloop.add_callback(self.ioloop.stop)
+                return
+            self.merge(update)
+
+    def run(self) -> None:
+        self.ioloop: IOLoop = IOLoop.current()
+        Thread(target=self._receive, name="metrics-receiver", daemon=True).start()
+        Application([
+            (r"/metrics", MetricsHandler, {"server": self}),
+            (r"/profile", ProfileHandler),
+        ]).listen(self.port)
+        self.log.info(f"Serving metrics on port {self.port}")
+        self.ioloop.start()
+
+
+def init_metrics(name: str, queue: Queue, port: Optional[int]) -> Optional[MetricsServer]:
+    """Start the metrics server and enable recording in this process and the processes started afterwards
+
+    :param name: The log name that will be used for logging
+    :type name: str
+    :param queue: The queue the processes send their metrics on
+    :type queue: Queue
+    :param port: The port to serve the metrics on, metrics are disabled if None
+    :type port: int
+    :returns: The metrics server or None if metrics are disabled
+
+    """
+    if port is None:
+        return None
+    metrics_server: MetricsServer = MetricsServer(name, queue, port)
+    metrics_server.start()
+    metrics.configure(queue)
+    return metrics_server
@@ -0,0 +1,196 @@
+"""
+.. module:: Filters
+   :platform: Unix, Windows
+   :synopsis: Field include and exclude filters consulted while parsing responses
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from fnmatch import fnmatchcase
+from typing import List, Dict, Tuple, Any, Optional
+
+_GLOB_CHARACTERS: str = "*?["
+
+
+class TrieNode:
+    """A single path segment of the compiled field patterns"""
+
+    __slots__ = ("children", "globs", "terminal")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "TrieNode"] = {}
+        self.globs: List[Tuple[str, "TrieNode"]] = []
+        self.terminal: bool = False
+
+    def insert(self, pattern: str) -> None:
+        node: TrieNode = self
+        for segment in pattern.strip("/").split("/"):
+            if any(character in segment for character in _GLOB_CHARACTERS):
+                for glob, child in node.globs:
+                    if glob == segment:
+                        node = child
+                        break
+                else:
+                    child = TrieNode()
+                    node.globs.append((segment, child))
+                    node = child
+            else:
+                node = node.children.setdefault(segment, TrieNode())
+        node.terminal = True
+
+    def step(self, name: str) -> List["TrieNode"]:
+        nodes: List[TrieNode] = []
+        child: Optional[TrieNode] = self.children.get(name)
+        if child is not None:
+            nodes.append(child)
+        for glob, child in self.globs:
+            if fnmatchcase(name, glob):
+                nodes.append(child)
+        return nodes
+
+
+class FilterState:
+    """The position of a parser in the include and exclude tries. The transitions
+    of every state are cached, so once a sensor path has been seen checking a field
+    is a dictionary lookup
+
+    :param include_nodes: The nodes of the include trie that are still being matched
+    :type include_nodes: Tuple[TrieNode, ...]
+    :param exclude_nodes: The nodes of the exclude trie that are still being matched
+    :type exclude_nodes: Tuple[TrieNode, ...]
+    :param included: If an include pattern already matched this path or one of its parents
+    :type included: bool
+
+    """
+
+    __slots__ = ("include_nodes", "exclude_nodes", "included", "_children")
+
+    def __init__(self, include_nodes: Tuple[TrieNode, ...], exclude_nodes: Tuple[TrieNode, ...],
+                 included: bool) -> None:
+        self.include_nodes: Tuple[TrieNode, ...] = include_nodes
+        self.exclude_nodes: Tuple[TrieNode, ...] = exclude_nodes
+        self.included: bool = included
+        self._children: Dict[Tuple[str, bool], Optional[FilterState]] = {}
+
+    def child(self, name: str, sensor: bool = False) -> Optional["FilterState"]:
+        """Get the state of a child path
+
+        :param name: The name of the child container or leaf
+        :type name: str
+        :param sensor: If the child is still part of the sensor path, in which case a sensor
+        without include patterns is included entirely
+        :type sensor: bool
+        :returns: The state of the child or None if the child and everything under it is filtered
+
+        """
+        key: Tuple[str, bool] = (name, sensor)
+        if key in self._children:
+            return self._children[key]
+        state: Optional[FilterState] = None
+        exclude_nodes: List[TrieNode] = [child for node in self.exclude_nodes for child in node.step(name)]
+        if not any(node.terminal for node in exclude_nodes):
+            if self.included:
+                state = FilterState((), tuple(exclude_nodes), True)
+            else:
+                include_nodes: List[TrieNode] = [child for node in self.include_nodes for child in node.step(name)]
+                if include_nodes:
+                    state = FilterState(tuple(include_nodes), tuple(exclude_nodes),
+                                        any(node.terminal for node in include_nodes))
+                elif sensor:
+                    state = FilterState((), tuple(exclude_nodes), True)
+        self._children[key] = state
+        return state
+
+    def keep(self, name: str) -> bool:
+        """Check if a leaf should be parsed
+
+        :param name: The name of the leaf
+        :type name: str
+
+        """
+        state: Optional[FilterState] = self.child(name)
+        return state is not None and state.included
+
+
+class FieldFilter:
+    """Compile include and exclude field path patterns into tries. Patterns are the yang path
+    of the sensor followed by the path of the field, each segment may use shell style globbing
+
+    :param include: The field paths to keep, a sensor path without any include pattern keeps every field
+    :type include: List[str]
+    :param exclude: The field paths to drop, along with everything under them
+    :type exclude: List[str]
+
+    """
+
+    def __init__(self, include: List[str], exclude: List[str]) -> None:
+        self.include: TrieNode = TrieNode()
+        self.exclude: TrieNode = TrieNode()
+        for pattern in include:
+            self.include.insert(pattern)
+        for pattern in exclude:
+            self.exclude.insert(pattern)
+        self._root: FilterState = FilterState((self.include,) if include else (), (self.exclude,), not include)
+        self._sensors: Dict[str, Optional[FilterState]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._root.include_nodes) or bool(self.exclude.children) or bool(self.exclude.globs)
+
+    def start(self, sensor_path: str) -> Optional[FilterState]:
+        """Get the state of a sensor path
+
+        :param sensor_path: The yang path the response was sent for
+        :type sensor_path: str
+        :returns: The state to walk the fields of the response with or None if the sensor is filtered
+
+        """
+        if sensor_path not in self._sensors:
+            state: Optional[FilterState] = self._root
+            for segment in sensor_path.strip("/").split("/"):
+                state = state.child(segment, sensor=True)
+                if state is None:
+                    break
+            self._sensors[sensor_path] = state
+        return self._sensors[sensor_path]
+
+
+class FieldFilters:
+    """The field filters of every input, selected by the address and encoding of the device a response
+    came from. Dial-out inputs don't know the addresses of their devices up front, so the patterns of the
+    dial-out inputs make up the filter of every device that isn't a dial-in input
+
+    :param inputs: The inputs of the config file
+    :type inputs: Dict[str, Dict[str, Any]]
+
+    """
+
+    def __init__(self, inputs: Dict[str, Dict[str, Any]]) -> None:
+        patterns: Dict[Tuple[str, str], Tuple[List[str], List[str]]] = {}
+        default_include: List[str] = []
+        default_exclude: List[str] = []
+        for client in inputs.values():
+            if client["dial"] == "in":
+                encoding: str = "gnmi" if client["format"] == "gnmi" else "ems"
+                include, exclude = patterns.setdefault((client["address"], encoding), ([], []))
+            else:
+                include, exclude = default_include, default_exclude
+            include.extend(client["include-fields"])
+            exclude.extend(client["exclude-fields"])
+        self.by_device: Dict[Tuple[str, str], FieldFilter] = {
+            device: FieldFilter(include, exclude) for device, (include, exclude) in patterns.items()
+        }
+        self.default: FieldFilter = FieldFilter(default_include, default_exclude)
+
+    def __bool__(self) -> bool:
+        return bool(self.default) or any(self.by_device.values())
+
+    def get(self, ip: str, encoding: str) -> Optional[FieldFilter]:
+        """Get the filter of a device
+
+        :param ip: The address the response came from
+        :type ip: str
+        :param encoding: The encoding of the response, gnmi or ems
+        :type encoding: str
+        :returns: The filter of the input of the device or None if it doesn't filter anything
+
+        """
+        field_filter: FieldFilter = self.by_device.get((ip, encoding), self.default)
+        return field_filter if field_filter else None
@@ -7,9 +7,12 @@
 
 import json
 from typing import List, Union, Optional, Tuple, Dict, Any
-from logging import getLogger, Logger
+from logging import Logger
 from protos.gnmi_pb2 import SubscribeResponse, TypedValue, Update
 from protos.telemetry_pb2 import Telemetry, TelemetryField
+from parsers.Filters import FieldFilter, FieldFilters, FilterState
+from metrics.latency import LatencyTracker
+from loggers.loggers import category_logger, Payload
 
 
 class ParsedResponse:
@@ -27,10 +30,13 @@ class ParsedResponse:
 
 
 class RTNMParser:
-    def __init__(self, batch_list: List[Tuple[str, str, Optional[str], Optional[str], str]],
-                 log_name: str) -> None:
-        self.raw_responses: List[Tuple[str, str, Optional[str], Optional[str], str]] = batch_list
-        self.log: Logger = getLogger(log_name)
+    def __init__(self, batch_list: List[Tuple[str, str, Optional[str], Optional[str], str, float]],
+                 log_name: str, field_filters: Optional[FieldFilters] = None,
+                 latency: Optional[LatencyTracker] = None) -> None:
+        self.raw_responses: List[Tuple[str, str, Optional[str], Optional[str], str, float]] = batch_list
+        self.latency: Optional[LatencyTracker] = latency
+        self.log: Logger = category_logger(log_name, "parser")
+        self.field_filters: Optional[FieldFilters] = field_filters if field_filters else None
 
     def process_header(self, header: Update) -> Tuple[Dict[str, str], str]:
         """Separate the update header into keys and the starting yang path
@@ -87,29 +93,41 @@ class RTNMParser:
 
     def _decode(self, raw_message: Tuple[str, str, Optional[str], Optional[str]]) -> Union[SubscribeResponse, Telemetry]:
         if raw_message[0] == "gnmi":
-            self.log.debug("In decode gnmi")
-            self.log.debug(raw_message[1])
+            self.log.debug("Decoding gnmi response %s", Payload(raw_message[1]))
             sub = SubscribeResponse()
             sub.ParseFromString(raw_message[1])
-            self.log.debug(sub)
+            self.log.debug("Decoded gnmi response %s", Payload(sub))
             return sub
         else:
-            self.log.debug("In decode ems")
-            self.log.debug(raw_message[1])
+            self.log.debug("Decoding ems response %s", Payload(raw_message[1]))
             tele = Telemetry()
             tele.ParseFromString(raw_message[1])
-            self.log.debug(tele)
+            self.log.debug("Decoded ems response %s", Payload(tele))
             return tele
         
     def parse_gnmi(self, response: SubscribeResponse, hostname: str, version: str, ip: str) -> List[ParsedResponse]:
         self.log.debug("In parse_gnmi")
         keys, start_yang_path = self.process_header(response.update)
+        sensor_state: Optional[FilterState] = None
+        field_filter: Optional[FieldFilter] = self.field_filters.get(ip, "gnmi") if self.field_filters else None
+        if field_filter is not None:
+            sensor_state = field_filter.start(start_yang_path)
+            if sensor_state is None:
+                return []
         content_list: List[Dict[str, Any]] = []
         for update in response.update.update:
             yang_paths = []
-            value = self.get_value(update.val)
             for elem in update.path.elem:
                 yang_paths.append(elem.name)
+            if sensor_state is not None:
+                field_state: Optional[FilterState] = sensor_state
+                for name in yang_paths[:-1]:
+                    field_state = field_state.child(name)
+                    if field_state is None:
+                        break
+                if field_state is None or not field_state.keep(yang_paths[-1]):
+                    continue
+            value = self.get_value(update.val)
             leaf = yang_paths.pop()
             end_yang_path = "/".join(yang_paths)
             if yang_paths:
@@ -153,13 +171,22 @@ class RTNMParser:
             keys[field.name] = self.get_ems_values(field.WhichOneof("value_by_type"), field)
         return keys
 
-    def parse_content(self, content_tf: TelemetryField, path: str, parsed_content: Dict[str, Dict[str, Any]]) -> None:
+    def parse_content(self, content_tf: TelemetryField, path: str, parsed_content: Dict[str, Dict[str, Any]],
+                      field_state: Optional[FilterState] = None) -> None:
         content_dict: Dict[str, Any] = {}
         leaf_level: bool = False
         for field in content_tf.fields:
+            child_state: Optional[FilterState] = None
+            if field_state is not None:
+                # Filtered subtrees are never walked or converted
+                child_state = field_state.child(field.name)
+                if child_state is None:
+                    continue
             if field.fields:
-                self.parse_content(field, f"{path}/{field.name}", parsed_content)
+                self.parse_content(field, f"{path}/{field.name}", parsed_content, child_state)
             else:
+                if child_state is not None and not child_state.included:
+                    continue
                 leaf_level = True
                 content_dict[field.name] = self.get_ems_values(field.WhichOneof("value_by_type"), field)
         if leaf_level:
@@ -172,6 +199,12 @@ class RTNMParser:
         parsed_list: List[ParsedResponse] = []
         node_str: str = response.node_id_str
         start_yang_path: str = response.encoding_path
+        sensor_state: Optional[FilterState] = None
+        field_filter: Optional[FieldFilter] = self.field_filters.get(ip, "ems") if self.field_filters else None
+        if field_filter is not None:
+            sensor_state = field_filter.start(start_yang_path)
+            if sensor_state is None:
+                return parsed_list
         keys: Dict[str, Any] = {}
         for gpbkv in response.data_gpbkv:
             timestamp: int = gpbkv.timestamp
@@ -183,7 +216,7 @@ class RTNMParser:
                         parsed_content: Dict[str, Dict[str, Any]] = {'', {"delete": True}}
                     else:
                         parsed_content: Dict[str, Dict[str, Any]] = {}
-                        self.parse_content(telemetry_field, "", parsed_content)
+                        self.parse_content(telemetry_field, "", parsed_content, sensor_state)
             for pc_path, pc_data in parsed_content.items():
                 for data in pc_data:
                     total_yang_path = f"{start_yang_path}{pc_path}"
@@ -199,10 +232,14 @@ class RTNMParser:
                 gpb_encoding = response[0]
                 decoded_response = self._decode(response)
                 if gpb_encoding == "gnmi":
-                    parsed_list.extend(self.parse_gnmi(decoded_response,
-                                                       response[2], response[3], response[4]))
+                    parsed: List[ParsedResponse] = self.parse_gnmi(decoded_response,
+                                                                   response[2], response[3], response[4])
                 else:
-                    parsed_list.extend(self.parse_ems(decoded_response, response[3], response[4]))
+                    parsed = self.parse_ems(decoded_response, response[3], response[4])
+                if self.latency is not None and parsed and len(response) > 5:
+                    # Time from the device stamping the message to RTNM receiving it
+                    self.latency.observe("collect", response[5] - parsed[0].timestamp / 1e9, device=response[4])
+                parsed_list.extend(parsed)
         except Exception as error:
             self.log.error(error)
             import traceback
@@ -0,0 +1,146 @@
+"""
+.. module:: profiling
+   :platform: Unix
+   :synopsis: On demand profiling of the running RTNM processes triggered by SIGUSR2
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+import os
+import sys
+import signal
+import cProfile
+from collections import Counter
+from datetime import datetime
+from multiprocessing import current_process
+from pathlib import Path
+from threading import Thread, Lock, get_ident, enumerate as enumerate_threads
+from time import sleep, monotonic
+from types import FrameType
+from typing import Dict, List, Optional
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+def _profile_path(path: Path, suffix: str) -> Path:
+    stamp: str = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return path / f"profile-{current_process().name}-{os.getpid()}-{stamp}.{suffix}"
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """Profiles the process it is running in for a number of seconds and writes the result to the logs
+    directory, either as collapsed stacks of a statistical sampler of every thread (usable with
+    flamegraph.pl or speedscope) or as the pstats of cProfile running on the main thread
+
+    :param path: The directory the profiles are written to
+    :type path: Path
+    :param duration: The number of seconds to profile for
+    :type duration: float
+    :param interval: The number of seconds between samples of the sampler
+    :type interval: float
+    :param mode: Either sample or cprofile
+    :type mode: str
+
+    """
+
+    def __init__(self, path: Path, duration: float = 30.0, interval: float = 0.01, mode: str = "sample") -> None:
+        self.path: Path = path
+        self.duration: float = duration
+        self.interval: float = interval
+        self.mode: str = mode
+        self._lock: Lock = Lock()
+        self._running: bool = False
+        self._pid: int = os.getpid()
+
+    def start(self) -> bool:
+        """Start profiling unless a profile is already being taken
+
+        :returns: Whether a profile was started
+
+        """
+        if self._pid != os.getpid():
+            # Inherited from the parent when forking, which may have been profiling at the time
+            self._pid = os.getpid()
+            self._lock = Lock()
+            self._running = False
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        if self.mode == "cprofile":
+            # cProfile only sees the thread enabling it, the main thread when called from the signal handler
+            profile: cProfile.Profile = cProfile.Profile()
+            profile.enable()
+            Thread(target=self._stop_cprofile, args=(profile,), name="profiler", daemon=True).start()
+        else:
+            Thread(target=self._sample, name="profiler", daemon=True).start()
+        return True
+
+    def _stop_cprofile(self, profile: cProfile.Profile) -> None:
+        try:
+            sleep(self.duration)
+            profile.disable()
+            self.path.mkdir(exist_ok=True)
+            profile.dump_stats(str(_profile_path(self.path, "pstats")))
+        finally:
+            self._running = False
+
+    def _sample(self) -> None:
+        try:
+            own_ident: int = get_ident()
+            stacks: Counter = Counter()
+            end: float = monotonic() + self.duration
+            while monotonic() < end:
+                names: Dict[int, str] = {thread.ident: thread.name for thread in enumerate_threads()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    labels: List[str] = []
+                    current: Optional[FrameType] = frame
+                    while current is not None:
+                        labels.append(_frame_label(current))
+                        current = current.f_back
+                    labels.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(labels))] += 1
+                sleep(self.interval)
+            self.path.mkdir(exist_ok=True)
+            with open(_profile_path(self.path, "collapsed"), "w") as file_desc:
+                for stack, count in stacks.most_common():
+                    file_desc.write(f"{stack} {count}\n")
+        finally:
+            self._running = False
+
+
+def install_profiler(path: Path, duration: float = 30.0, interval: float = 0.01, mode: str = "sample") -> None:
+    """Profile a process when it receives SIGUSR2. Installed in the main process before any other process
+    is started so every process inherits the handler. The main process forwards the signal to its process
+    group, so signalling it profiles every RTNM process, including the processes forked by the dial out
+    server which aren't multiprocessing children. The signal it gets back from the group is ignored as a
+    profile is already being taken
+
+    :param path: The directory the profiles are written to
+    :type path: Path
+    :param duration: The number of seconds to profile for
+    :type duration: float
+    :param interval: The number of seconds between samples of the sampler
+    :type interval: float
+    :param mode: Either sample or cprofile
+    :type mode: str
+
+    """
+    if not hasattr(signal, "SIGUSR2"):
+        return
+    profiler: Profiler = Profiler(path, duration, interval, mode)
+    main_pid: int = os.getpid()
+
+    def handle_signal(signum: int, frame: Optional[FrameType]) -> None:
+        if profiler.start() and os.getpid() == main_pid:
+            try:
+                os.killpg(os.getpgid(0), signal.SIGUSR2)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGUSR2, handle_signal)
@@ -0,0 +1,106 @@
+"""
+.. module:: replay
+   :platform: Unix, Windows
+   :synopsis: Replays captured raw responses through the parsers and the configured outputs
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Tuple, Optional
+from os import cpu_count
+from time import time, sleep, monotonic
+from multiprocessing import Queue
+from loggers.loggers import init_logs
+from errors.errors import ConfigError
+from capture.capture import read_capture
+from utils.utils import generate_clients, generate_aggregations
+from workers.workers import ParserWorker, worker_index
+from parsers.Filters import FieldFilters
+
+
+def main():
+    """Replay a capture taken with rtnm.py --capture through the workers and the outputs of a configuration
+    file, at the pace the responses were received, a multiple of it or as fast as possible
+
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config", dest="config", help="Location of the configuration file", required=True)
+    parser.add_argument("-d", "--capture", dest="capture", help="Directory of the capture to replay", required=True)
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
+                        help="Batch size of the upload to the outputs", required=True)
+    parser.add_argument("-w", "--worker-pool-size", dest="worker_pool_size", type=int,
+                        help="Number of workers used for parsing and uploading")
+    parser.add_argument("-s", "--speed", dest="speed", type=float, default=1.0,
+                        help="Multiple of the original pace to replay at, 0 replays as fast as possible")
+    parser.add_argument("-v", "--verbose", dest="debug", help="Enable debugging", action="store_true")
+    args = parser.parse_args()
+    try:
+        if not Path(args.config).is_file():
+            raise IOError(f"File {args.config} doesn't exist")
+        if not Path(args.capture).is_dir():
+            raise IOError(f"Directory {args.capture} doesn't exist")
+        inputs, outputs = generate_clients(args.config)
+        aggregations = generate_aggregations(args.config)
+    except ConfigError as error:
+        parser.error(f"{error}")
+    except KeyError as error:
+        parser.error(f"Error in the configuration file: No key for {error}.\nCan't parse the config file")
+    except Exception as error:
+        parser.error(f"{error}")
+
+    path: Path = Path().absolute() / "logs"
+    log_queue: Queue = Queue()
+    log_name: str = f"rtnm-replay-{args.config.strip('ini').strip('.').split('/')[-1]}"
+    rtnm_log = init_logs(log_name, path, log_queue, args.debug)
+    workers: List[ParserWorker] = []
+    try:
+        field_filters: FieldFilters = FieldFilters(inputs)
+        worker_count: int = args.worker_pool_size or cpu_count() or 1
+        workers = [ParserWorker(index, log_name, outputs, aggregations, field_filters, 16)
+                   for index in range(worker_count)]
+        for worker in workers:
+            worker.start()
+        batch_lists: List[List[Tuple[str, bytes, Optional[str], Optional[str], str, float]]] = [[] for _ in workers]
+        replayed: int = 0
+        started: float = monotonic()
+        first_received: Optional[float] = None
+        last_dispatch: float = started
+        for encoding, payload, hostname, version, ip, received in read_capture(Path(args.capture)):
+            if args.speed > 0:
+                if first_received is None:
+                    first_received = received
+                delay: float = (received - first_received) / args.speed - (monotonic() - started)
+                if delay > 0:
+                    # Don't hold responses back for more than a second while waiting for the next ones
+                    if delay > last_dispatch + 1.0 - monotonic():
+                        for index, batch_list in enumerate(batch_lists):
+                            if batch_list:
+                                workers[index].dispatch(batch_list)
+                                batch_lists[index] = []
+                        last_dispatch = monotonic()
+                    sleep(delay)
+            index: int = worker_index(ip, worker_count)
+            # Stamped with the time of the replay so the latencies of the pipeline stay meaningful
+            batch_lists[index].append((encoding, payload, hostname, version, ip, time()))
+            if len(batch_lists[index]) >= args.batch_size:
+                workers[index].dispatch(batch_lists[index])
+                batch_lists[index] = []
+            replayed += 1
+        for index, batch_list in enumerate(batch_lists):
+            if batch_list:
+                workers[index].dispatch(batch_list)
+        rtnm_log.logger.info(f"Replayed {replayed} responses in {monotonic() - started:.3f}s")
+    except Exception as error:
+        rtnm_log.logger.error(error)
+    except KeyboardInterrupt:
+        rtnm_log.logger.error("Shutting down due to user ctrl-c")
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+        rtnm_log.queue.put(None)
+
+
+if __name__ == "__main__":
+    main()
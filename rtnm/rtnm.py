@@ -5,55 +5,27 @@
 .. moduleauthor:: Greg Brown <gsb5067@gmail.com>
 """
 from argparse import ArgumentParser
+from logging import Logger
 from pathlib import Path
-from typing import List, Dict, Union, Tuple, Optional
-from multiprocessing import Pool, Queue
+from typing import List, Dict, Any, Union, Tuple, Optional
+from os import cpu_count
+from time import time, monotonic
+from multiprocessing import Queue
 from queue import Empty
-from logging import getLogger, Logger
-from datetime import datetime
-from parsers.Parsers import RTNMParser, ParsedResponse
-from loggers.loggers import init_logs
-from databases.databases import InfluxdbUploader, ElasticSearchUploader, Influxdb2Uploader
+from loggers.loggers import init_logs, category_logger, Payload, LOG_CATEGORIES
 from errors.errors import ConfigError
 from connectors.DialInClients import DialInClient, TLSDialInClient
+from connectors.AsyncDialInClients import AsyncDialInCollector
+from discovery.discovery import DiscoveryCache, DiscoveryProcess
+from connectors.ReconnectSchedulers import ReconnectScheduler
 from connectors.DialOutClients import DialOutClient
-from utils.utils import generate_clients
-
-
-def process_and_upload_data(*args):
-    """Process the raw responses from gRPC/gNMI client and upload to a TSDB
-
-    :param batch_list: The raw responses from either Cisco gRPC or gNMI clients or from both.
-    :type batch_list: List[Tuple[str, str, Optional[str], Optional[str]]]
-    :param log_name: Name of the logger used in RTNM to acquire
-    :type log_name: str
-    :param tsdb_args: The arguments of the TSDB (username, port, password, etc.)
-    :type tsdb_args: Dict[str, str]
-
-    """
-    try:
-        tsdb_args = args[-1]
-        log_name = args[-2]
-        batch_list = list(args[:-2])
-        processor_log: Logger = getLogger(log_name)
-        parser = RTNMParser(batch_list, log_name)
-        start = datetime.now()
-        parsed_responses: List[ParsedResponse] = parser.decode_and_parse_raw_responses()
-        for tsdb_endpoint in tsdb_args.keys():
-            tsdb_args[tsdb_endpoint]["log_name"] = log_name
-            if tsdb_args[tsdb_endpoint]["type"] == "elasticsearch":
-                uploader = ElasticSearchUploader(**tsdb_args[tsdb_endpoint])
-            elif tsdb_args[tsdb_endpoint]["type"] == "influxdb":
-                uploader = InfluxdbUploader(**tsdb_args[tsdb_endpoint])
-            else:
-                uploader = Influxdb2Uploader(**tsdb_args[tsdb_endpoint])
-            uploader.upload(parsed_responses)
-        end = datetime.now()
-        total_time = end - start
-        processor_log.info(f"Total Batch time took {total_time}")
-    except Exception as error:
-        processor_log.error(error)
-        processor_log.debug(args)
+from utils.utils import generate_clients, generate_aggregations, generate_alerts
+from workers.workers import ParserWorker, worker_index
+from parsers.Filters import FieldFilters
+from metrics.metrics import init_metrics, metrics, queue_depth, MetricsServer
+from profiling.profiling import install_profiler, PROFILE_MODES
+from capture.capture import CaptureWriter
+from live.live import init_live, LiveServer
 
 
 def main():
@@ -66,14 +38,84 @@ def main():
     parser.add_argument("-c", "--config", dest="config", help="Location of the configuration file", required=True)
     parser.add_argument("-b", "--batch-size", dest="batch_size", type=int,
                         help="Batch size of the upload to ElasticSearch", required=True)
+    parser.add_argument("--max-batch-age", dest="max_batch_age", type=float, default=1.0,
+                        help="Maximum number of seconds responses wait for their batch to fill before being "
+                             "dispatched to a worker anyway")
     parser.add_argument("-w", "--worker-pool-size", dest="worker_pool_size", type=int,
-                        help="Number of workers in the worker pool used for uploading")
+                        help="Number of workers used for parsing and uploading, each device is always handled by the same worker")
     parser.add_argument("-v", "--verbose", dest="debug", help="Enable debugging", action="store_true")
     parser.add_argument("-r", "--retry", dest="retry", help="Enable retrying", action="store_true")
+    parser.add_argument("-a", "--async-collectors", dest="async_collectors", type=int, default=0,
+                        help="Number of asyncio collector processes the dial in inputs are spread across, "
+                             "by default every dial in input gets its own process")
+    parser.add_argument("--discovery-concurrency", dest="discovery_concurrency", type=int, default=16,
+                        help="Maximum number of devices having their hostname and version discovered at once")
+    parser.add_argument("--discovery-rate", dest="discovery_rate", type=float, default=10.0,
+                        help="Maximum number of devices to start discovering per second")
+    parser.add_argument("--discovery-ttl", dest="discovery_ttl", type=int, default=86400,
+                        help="Number of seconds a cached hostname and version of a device is used for")
+    parser.add_argument("--reconnect-rate", dest="reconnect_rate", type=float, default=20.0,
+                        help="Maximum number of dial in connections made per second across every connector")
+    parser.add_argument("--reconnect-burst", dest="reconnect_burst", type=int, default=20,
+                        help="Maximum number of dial in connections made at once across every connector")
+    parser.add_argument("--healthy-stream-time", dest="healthy_stream_time", type=float, default=60.0,
+                        help="Number of seconds a stream has to stay up for its reconnect backoff to reset")
+    parser.add_argument("-q", "--queue-size", dest="queue_size", type=int, default=1024,
+                        help="Maximum number of batches of responses waiting to be dispatched, once reached the "
+                             "overload policy of each input is applied")
+    parser.add_argument("--worker-queue-size", dest="worker_queue_size", type=int, default=16,
+                        help="Maximum number of batches waiting for each worker, once reached dispatching blocks")
+    parser.add_argument("-m", "--metrics-port", dest="metrics_port", type=int,
+                        help="Port to serve the pipeline metrics on in the Prometheus format at /metrics")
+    parser.add_argument("--profile-duration", dest="profile_duration", type=float, default=30.0,
+                        help="Number of seconds each process is profiled for when RTNM receives SIGUSR2")
+    parser.add_argument("--profile-interval", dest="profile_interval", type=float, default=10.0,
+                        help="Number of milliseconds between the stack samples of the profiler")
+    parser.add_argument("--profile-mode", dest="profile_mode", choices=PROFILE_MODES, default="sample",
+                        help="Take collapsed stacks of every thread with a sampler or pstats of the main thread "
+                             "with cProfile")
+    parser.add_argument("--log-level", dest="log_levels", action="append", default=[], metavar="CATEGORY=LEVEL",
+                        help=f"Level of a category of logs, one of {', '.join(LOG_CATEGORIES)}, can be repeated")
+    parser.add_argument("--log-sample", dest="log_sample", type=int, default=1,
+                        help="Keep one out of every N debug records of each category")
+    parser.add_argument("--log-rate", dest="log_rate", type=float, default=1000.0,
+                        help="Maximum number of log records per second of each process, 0 for no limit")
+    parser.add_argument("--log-payload-limit", dest="log_payload_limit", type=int, default=512,
+                        help="Maximum number of characters of a payload (raw response, document, post body) logged")
+    parser.add_argument("--log-queue-size", dest="log_queue_size", type=int, default=10000,
+                        help="Maximum number of log records waiting to be written, further records are dropped")
+    parser.add_argument("--capture", dest="capture",
+                        help="Directory to capture every raw response received into, for replay.py")
+    parser.add_argument("--capture-segment-size", dest="capture_segment_size", type=int, default=256,
+                        help="Size in MB at which a new capture segment file is started")
+    parser.add_argument("--live-port", dest="live_port", type=int,
+                        help="Port to stream the parsed telemetry on, over a WebSocket at /stream and "
+                             "Server-Sent Events at /events")
+    parser.add_argument("--live-buffer", dest="live_buffer", type=int, default=1000,
+                        help="Number of messages a live client can fall behind before being disconnected")
+    parser.add_argument("--live-queue-size", dest="live_queue_size", type=int, default=1024,
+                        help="Maximum number of batches of rows waiting for the live server, further rows "
+                             "aren't published")
+    parser.add_argument("--live-ttl", dest="live_ttl", type=float, default=86400.0,
+                        help="Number of seconds after which a series that stopped updating is removed from the "
+                             "last value cache")
+    parser.add_argument("--live-retention", dest="live_retention", type=float, default=900.0,
+                        help="Number of seconds of samples of every numeric field kept in memory for /series")
+    parser.add_argument("--live-samples", dest="live_samples", type=int, default=180,
+                        help="Maximum number of samples kept in memory per numeric field for /series")
     args = parser.parse_args()
+    log_levels: Dict[str, str] = {}
+    for log_level in args.log_levels:
+        category, _, level = log_level.partition("=")
+        if category not in LOG_CATEGORIES or level.upper() not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+            parser.error(f"Invalid log level {log_level}, expected CATEGORY=LEVEL with a category of "
+                         f"{', '.join(LOG_CATEGORIES)}")
+        log_levels[category] = level
     try:
         if Path(args.config).is_file():
             inputs, outputs = generate_clients(args.config)
+            aggregations = generate_aggregations(args.config)
+            alerts = generate_alerts(args.config)
         else:
             raise IOError(f"File {args.config} doesn't exist")
     except ConfigError as error:
@@ -84,65 +126,149 @@ def main():
         parser.error(f"{error}")
 
     path: Path = Path().absolute() / "logs"
-    log_queue: Queue = Queue()
+    log_queue: Queue = Queue(args.log_queue_size)
     log_name: str = f"rtnm-{args.config.strip('ini').strip('.').split('/')[-1]}"
-    rtnm_log = init_logs(log_name, path, log_queue, args.debug)
+    install_profiler(path, args.profile_duration, args.profile_interval / 1000, args.profile_mode)
+    rtnm_log = init_logs(log_name, path, log_queue, args.debug, log_levels, args.log_sample, args.log_rate,
+                         args.log_payload_limit)
+    dispatch_log: Logger = category_logger(log_name, "dispatch")
+    metrics_queue: Queue = Queue(10000)
+    metrics_server: Optional[MetricsServer] = init_metrics(log_name, metrics_queue, args.metrics_port)
+    live_queue: Queue = Queue(args.live_queue_size)
+    live_server: Optional[LiveServer] = init_live(log_name, live_queue, args.live_port, args.live_buffer,
+                                                  args.live_ttl, args.live_retention, args.live_samples)
+    client_conns: List[Union[DialInClient, TLSDialInClient, DialOutClient, AsyncDialInCollector]] = []
+    workers: List[ParserWorker] = []
+    capture_writer: Optional[CaptureWriter] = None
+    discovery: Optional[DiscoveryProcess] = None
     try:
-        client_conns: List[Union[DialInClient, TLSDialInClient]] = []
-        data_queue: Queue = Queue()
+        if args.capture:
+            capture_writer = CaptureWriter(Path(args.capture), args.capture_segment_size * 1048576)
+        data_queue: Queue = Queue(args.queue_size)
+        discovery_cache: DiscoveryCache = DiscoveryCache(Path().absolute() / "cache" / f"{log_name}-discovery.json",
+                                                         args.discovery_ttl)
+        discovery_started: float = time()
+        discovery = DiscoveryProcess(log_name, inputs, discovery_cache, args.discovery_concurrency,
+                                     args.discovery_rate, discovery_started)
+        discovery.start()
+        # The cached devices are refreshed by the discovery process while the connectors run
+        while not discovery.discovered.wait(1) and discovery.is_alive():
+            pass
         rtnm_log.logger.info("Starting inputs and outputs")
+        reconnect_scheduler: ReconnectScheduler = ReconnectScheduler(args.reconnect_rate, args.reconnect_burst)
+        collector_inputs: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(args.async_collectors)]
         for client in inputs:
             if inputs[client]["dial"] == "in":
                 inputs[client]["debug"] = args.debug
                 inputs[client]["retry"] = args.retry
-                if "pem-file" in inputs[client]:
+                if args.async_collectors:
+                    index: int = worker_index(inputs[client]["address"], args.async_collectors)
+                    collector_inputs[index][client] = inputs[client]
+                elif "pem-file" in inputs[client]:
                     with open(inputs[client]["pem-file"], "rb") as file_desc:
                         pem = file_desc.read()
                     rtnm_log.logger.info(f"Creating TLS Connector for {client}")
                     client_conns.append(TLSDialInClient(pem, data_queue,
                                                         log_name, **inputs[client],
-                                                        name=client))
+                                                        name=client, discovery_cache=discovery_cache,
+                                                        discovery_started=discovery_started,
+                                                        reconnect_scheduler=reconnect_scheduler,
+                                                        healthy_stream_time=args.healthy_stream_time))
                 else:
                     rtnm_log.logger.info(f"Creating Connector for {client}")
                     client_conns.append(DialInClient(data_queue,
-                                                     log_name, **inputs[client], name=client))
+                                                     log_name, **inputs[client], name=client,
+                                                     discovery_cache=discovery_cache,
+                                                     discovery_started=discovery_started,
+                                                     reconnect_scheduler=reconnect_scheduler,
+                                                     healthy_stream_time=args.healthy_stream_time))
             else:
                 client_conns.append(DialOutClient(data_queue, log_name, inputs[client], client))
+        for index, collector_input in enumerate(collector_inputs):
+            if collector_input:
+                rtnm_log.logger.info(f"Creating asyncio collector {index} for {len(collector_input)} inputs")
+                client_conns.append(AsyncDialInCollector(index, data_queue, log_name, collector_input,
+                                                         discovery_cache, discovery_started,
+                                                         reconnect_scheduler, args.healthy_stream_time))
+        field_filters: FieldFilters = FieldFilters(inputs)
+        worker_count: int = args.worker_pool_size or cpu_count() or 1
+        workers = [ParserWorker(index, log_name, outputs, aggregations, field_filters, args.worker_queue_size,
+                                live_queue if live_server is not None else None, alerts)
+                   for index in range(worker_count)]
+        for worker in workers:
+            worker.start()
         for client in client_conns:
             client.start()
-        batch_list: List[Tuple[str, str, Optional[str], Optional[str], str]] = []
-        with Pool(processes=args.worker_pool_size) as worker_pool:
-            while all([client.is_alive() for client in client_conns]):
-                try:
-                    data: Tuple[str, str, Optional[str], Optional[str], str] = data_queue.get(timeout=10)
-                    if data is not None:
-                        batch_list.append(data)
-                        if len(batch_list) >= args.batch_size:
-                            rtnm_log.logger.debug("Uploading full batch size")
-                            rtnm_log.logger.debug(batch_list)
-                            result = worker_pool.apply_async(process_and_upload_data,
-                                                             args=[*batch_list, log_name, outputs])
-                            batch_list.clear()
-                except Empty:
+        batch_lists: List[List[Tuple[str, str, Optional[str], Optional[str], str, float]]] = [[] for _ in workers]
+        # When the first response of each batch was added
+        batch_started: List[float] = [0.0 for _ in workers]
+        while all([client.is_alive() for client in client_conns]) and all([worker.is_alive() for worker in workers]):
+            try:
+                # Wait no longer than the oldest batch has left before it has to be dispatched
+                pending: List[float] = [batch_started[index] for index, batch_list in enumerate(batch_lists)
+                                        if batch_list]
+                timeout: float = max(min(pending) + args.max_batch_age - monotonic(), 0.0) if pending else 10.0
+                # The connectors put lists of raw responses
+                queued: List[Tuple[str, str, Optional[str], Optional[str], str, float]] = data_queue.get(
+                    timeout=timeout)
+                metrics.set("rtnm_queue_depth", queue_depth(data_queue), queue="data")
+                if capture_writer is not None:
+                    for data in queued:
+                        capture_writer.write(data)
+                for data in queued:
+                    index: int = worker_index(data[4], worker_count)
+                    batch_list = batch_lists[index]
+                    if not batch_list:
+                        batch_started[index] = monotonic()
+                    batch_list.append(data)
+                    if len(batch_list) >= args.batch_size:
+                        dispatch_log.debug("Uploading full batch size to %s: %s", workers[index].name,
+                                           Payload(batch_list))
+                        workers[index].dispatch(batch_list)
+                        batch_lists[index] = []
+                now: float = monotonic()
+                for index, batch_list in enumerate(batch_lists):
+                    if batch_list and now - batch_started[index] >= args.max_batch_age:
+                        dispatch_log.debug("Uploading batch of length %s older than %ss to %s", len(batch_list),
+                                           args.max_batch_age, workers[index].name)
+                        workers[index].dispatch(batch_list)
+                        batch_lists[index] = []
+            except Empty:
+                if capture_writer is not None:
+                    capture_writer.flush()
+                for index, batch_list in enumerate(batch_lists):
                     if len(batch_list) != 0:
-                        rtnm_log.logger.debug(f"Uploading data of length {len(batch_list)}")
-                        result = worker_pool.apply_async(process_and_upload_data,
-                                                         args=[*batch_list, log_name, outputs])
-                        batch_list.clear()
-                except Exception as error:
-                    rtnm_log.logger.error(error)
-                    rtnm_log.logger.error("Error during worker pool, going to cleanup")
-                    for client in client_conns:
-                        client.terminate()
+                        dispatch_log.debug("Uploading data of length %s to %s", len(batch_list), workers[index].name)
+                        workers[index].dispatch(batch_list)
+                        batch_lists[index] = []
+            except Exception as error:
+                rtnm_log.logger.error(error)
+                rtnm_log.logger.error("Error during dispatching to the workers, going to cleanup")
+                for client in client_conns:
+                    client.terminate()
     except Exception as error:
         rtnm_log.logger.error(error)
     except KeyboardInterrupt as error:
         rtnm_log.logger.error("Shutting down due to user ctrl-c")
     finally:
         rtnm_log.logger.info("In cleanup")
-        rtnm_log.queue.put(None)
+        if capture_writer is not None:
+            capture_writer.close()
+        if discovery is not None and discovery.is_alive():
+            discovery.terminate()
         for client in client_conns:
             client.terminate()
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+        if live_server is not None:
+            live_queue.put(None)
+            live_server.join()
+        if metrics_server is not None:
+            metrics_queue.put(None)
+            metrics_server.join()
+        rtnm_log.queue.put(None)
 
 
 if __name__ == "__main__":
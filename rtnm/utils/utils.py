@@ -6,12 +6,18 @@
 """
 import sys
 import re
+import json
+from zlib import crc32
+from importlib.util import find_spec
 from datetime import datetime
 from distutils.util import strtobool
 from typing import Tuple, Dict, Any, List
 from configparser import ConfigParser
 from errors.errors import ConfigError
+from connectors.QueueBatchers import OVERLOAD_POLICIES
 from protos.gnmi_pb2 import (
+    GetRequest,
+    GetResponse,
     PathElem,
     Path,
     Encoding,
@@ -19,6 +25,14 @@ from protos.gnmi_pb2 import (
     SubscriptionList
 )
 
+# Outputs writing to the local disk, which don't have an address and port
+FILE_OUTPUTS: Tuple[str, ...] = ("parquet", "file")
+# Optional packages required by an output type
+OUTPUT_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    "parquet": ("pyarrow",),
+    "timescaledb": ("psycopg2",),
+}
+
 
 def generate_clients(in_file: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """ Generate both the input and output clients based on
@@ -51,6 +65,19 @@ def generate_clients(in_file: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
                 else:
                     input_clients[section]["address"] = config[section]["address"]
                 input_clients[section]["port"] = config[section]["port"]
+                input_clients[section]["include-fields"] = [
+                    x.strip() for x in config[section].get("include-fields", "").split(",") if x.strip()
+                ]
+                input_clients[section]["exclude-fields"] = [
+                    x.strip() for x in config[section].get("exclude-fields", "").split(",") if x.strip()
+                ]
+                input_clients[section]["batch-count"] = int(config[section].get("batch-count", "64"))
+                input_clients[section]["batch-bytes"] = int(config[section].get("batch-bytes", "1048576"))
+                input_clients[section]["batch-linger-ms"] = float(config[section].get("batch-linger-ms", "5"))
+                input_clients[section]["overload-policy"] = config[section].get("overload-policy", "block")
+                if input_clients[section]["overload-policy"] not in OVERLOAD_POLICIES:
+                    raise ConfigError(f"Input {section} overload-policy must be one of {', '.join(OVERLOAD_POLICIES)}")
+                input_clients[section]["overload-sample"] = int(config[section].get("overload-sample", "10"))
                 input_clients[section]["dial"] = "out"
                 if config[section]["dial"] == "in":
                     input_clients[section]["dial"] = "in"
@@ -69,6 +96,7 @@ def generate_clients(in_file: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
                         input_clients[section]["encoding"] = Encoding.Value(config[section]["encoding"])
                         input_clients[section]["stream-mode"] = SubscriptionList.Mode.Value(
                             config[section]["stream-mode"])
+                        input_clients[section]["passthrough"] = bool(strtobool(config[section].get("passthrough", "False")))
                     else:
                         input_clients[section]["format"] = "cisco-ems"
                         # Valid encode values- gpb:2, self-describing-gpb:3, json:4
@@ -79,11 +107,19 @@ def generate_clients(in_file: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
                         ]
                     if "pem-file" in config[section]:
                         input_clients[section]["pem-file"] = config[section]["pem-file"]
-            else:
+            elif config[section]["io"] == "output":
                 output_clients[section] = {}
-                output_clients[section]["address"] = config[section]["address"]
-                output_clients[section]["port"] = config[section]["port"]
                 output_clients[section]["type"] = config[section]["type"]
+                if output_clients[section]["type"] not in FILE_OUTPUTS:
+                    output_clients[section]["address"] = config[section]["address"]
+                    output_clients[section]["port"] = config[section]["port"]
+                for module in OUTPUT_DEPENDENCIES.get(output_clients[section]["type"], ()):
+                    if find_spec(module) is None:
+                        raise ConfigError(f"Output {section} of type {output_clients[section]['type']} "
+                                          f"requires the {module} package")
+                output_clients[section]["data"] = config[section].get("data", "raw")
+                if output_clients[section]["data"] not in ["raw", "aggregated"]:
+                    raise ConfigError(f"Output {section} data must be either raw or aggregated")
                 if output_clients[section]["type"] == "influxdb":
                     output_clients[section]["database"] = config[section]["database"]
                     output_clients[section]["username"] = config[section]["username"]
@@ -92,9 +128,114 @@ def generate_clients(in_file: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
                     output_clients[section]["token"] = config[section]["token"]
                     output_clients[section]["org"] = config[section]["org"]
                     output_clients[section]["bucket"] = config[section]["bucket"]
+                elif output_clients[section]["type"] == "parquet":
+                    output_clients[section]["path"] = config[section]["path"]
+                    output_clients[section]["roll-size"] = int(config[section].get("roll-size", "128"))
+                    output_clients[section]["roll-interval"] = int(config[section].get("roll-interval", "300"))
+                    output_clients[section]["compression"] = config[section].get("compression", "zstd")
+                    output_clients[section]["row-group-rows"] = int(config[section].get("row-group-rows", "100000"))
+                    output_clients[section]["row-group-size"] = int(config[section].get("row-group-size", "16"))
+                    output_clients[section]["max-buffer-size"] = int(config[section].get("max-buffer-size", "256"))
+                    output_clients[section]["max-open-files"] = int(config[section].get("max-open-files", "64"))
+                elif output_clients[section]["type"] == "prometheus-remote-write":
+                    output_clients[section]["path"] = config[section].get("path", "/api/v1/write")
+                    output_clients[section]["concurrency"] = int(config[section].get("concurrency", "4"))
+                    output_clients[section]["max-samples-per-send"] = int(
+                        config[section].get("max-samples-per-send", "2000"))
+                    output_clients[section]["retries"] = int(config[section].get("retries", "3"))
+                    for key in ("token", "username", "password"):
+                        if key in config[section]:
+                            output_clients[section][key] = config[section][key]
+                elif output_clients[section]["type"] == "clickhouse":
+                    output_clients[section]["database"] = config[section].get("database", "default")
+                    output_clients[section]["ttl"] = int(config[section].get("ttl", "0"))
+                    if "username" in config[section]:
+                        output_clients[section]["username"] = config[section]["username"]
+                        output_clients[section]["password"] = config[section].get("password", "")
+                elif output_clients[section]["type"] == "timescaledb":
+                    output_clients[section]["database"] = config[section]["database"]
+                    output_clients[section]["username"] = config[section]["username"]
+                    output_clients[section]["password"] = config[section].get("password", "")
+                    output_clients[section]["content"] = config[section].get("content", "columns")
+                    if output_clients[section]["content"] not in ["columns", "jsonb"]:
+                        raise ConfigError(f"Output {section} content must be either columns or jsonb")
+                    output_clients[section]["hypertable"] = bool(strtobool(config[section].get("hypertable", "True")))
+                    output_clients[section]["pool-size"] = int(config[section].get("pool-size", "2"))
+                elif output_clients[section]["type"] == "file":
+                    output_clients[section]["path"] = config[section]["path"]
+                    output_clients[section]["format"] = config[section].get("format", "influxdbv2")
+                    if output_clients[section]["format"] not in ["influxdb", "influxdbv2", "elasticsearch"]:
+                        raise ConfigError(f"Output {section} format must be either influxdb, influxdbv2 or elasticsearch")
+                    output_clients[section]["rotate-size"] = int(config[section].get("rotate-size", "256"))
+                    output_clients[section]["compression"] = config[section].get("compression", "gzip")
+                    if output_clients[section]["compression"] not in ["gzip", "none"]:
+                        raise ConfigError(f"Output {section} compression must be either gzip or none")
+                    output_clients[section]["fsync-interval"] = float(config[section].get("fsync-interval", "0"))
         return input_clients, output_clients
 
 
+def generate_aggregations(in_file: str) -> Dict[str, Dict[str, Any]]:
+    """ Generate the aggregations of sensor paths based on
+    the input configuration file
+
+    :param in_file: The name of the input config file to parse
+    :type in_file: str
+    :returns: The arguments of each aggregation section
+
+    """
+    config: ConfigParser = ConfigParser()
+    config.read(in_file)
+    aggregations: Dict[str, Dict[str, Any]] = {}
+    for section in config.sections():
+        if config[section]["io"] == "aggregation":
+            aggregations[section] = {}
+            aggregations[section]["name"] = section
+            aggregations[section]["sensor"] = config[section]["sensor"].strip()
+            aggregations[section]["window"] = int(config[section]["window"])
+            aggregations[section]["functions"] = [
+                x.strip() for x in config[section].get("functions", "min, max, avg, last").split(",")
+            ]
+            aggregations[section]["group_by"] = [
+                x.strip() for x in config[section].get("group-by", "").split(",") if x.strip()
+            ]
+            aggregations[section]["fields"] = [
+                x.strip() for x in config[section].get("fields", "").split(",") if x.strip()
+            ]
+            aggregations[section]["forward_raw"] = bool(strtobool(config[section].get("forward-raw", "True")))
+    return aggregations
+
+
+def generate_alerts(in_file: str) -> Dict[str, Dict[str, Any]]:
+    """ Generate the alert rules evaluated by the workers based on
+    the input configuration file
+
+    :param in_file: The name of the input config file to parse
+    :type in_file: str
+    :returns: The arguments of each alert section
+
+    """
+    config: ConfigParser = ConfigParser()
+    config.read(in_file)
+    alerts: Dict[str, Dict[str, Any]] = {}
+    for section in config.sections():
+        if config[section]["io"] == "alert":
+            alerts[section] = {}
+            alerts[section]["name"] = section
+            alerts[section]["sensor"] = config[section]["sensor"].strip()
+            alerts[section]["condition"] = config[section]["condition"].strip()
+            alerts[section]["field"] = config[section].get("field", "").strip()
+            alerts[section]["operator"] = config[section].get("operator", ">").strip()
+            alerts[section]["threshold"] = float(config[section]["threshold"])
+            alerts[section]["duration"] = float(config[section].get("for", "0"))
+            alerts[section]["keys"] = [
+                x.strip() for x in config[section].get("keys", "").split(",") if x.strip()
+            ]
+            alerts[section]["webhook"] = config[section]["webhook"].strip()
+            alerts[section]["severity"] = config[section].get("severity", "warning").strip()
+            alerts[section]["repeat_interval"] = float(config[section].get("repeat-interval", "0"))
+    return alerts
+
+
 def create_gnmi_path(path: str) -> Path:
     """ Take a string representation of a gNMI path and transform
     it into the gNMI Path object
@@ -123,6 +264,46 @@ def create_gnmi_path(path: str) -> Path:
     return Path(elem=path_elements)
 
 
+def version_request() -> GetRequest:
+    """Build the gNMI Get request of the software version of a device"""
+    return GetRequest(
+        path=[create_gnmi_path(
+            'Cisco-IOS-XR-install-oper:install/version')],
+        type=GetRequest.DataType.Value("STATE"),
+        encoding=Encoding.Value("JSON_IETF"),
+    )
+
+
+def parse_version_response(version: GetResponse) -> str:
+    """Get the software version label out of the response of a version_request"""
+    for notification in version.notification:
+        for update in notification.update:
+            if update.val.json_ietf_val:
+                rc = json.loads(update.val.json_ietf_val)
+                return rc["label"]
+            else:
+                return "Error"
+
+
+def hostname_request() -> GetRequest:
+    """Build the gNMI Get request of the configured hostname of a device"""
+    return GetRequest(
+        path=[create_gnmi_path("Cisco-IOS-XR-shellutil-cfg:host-names")],
+        type=GetRequest.DataType.Value("CONFIG"),
+        encoding=Encoding.Value("JSON_IETF"),
+    )
+
+
+def parse_hostname_response(hostname_response: GetResponse) -> str:
+    """Get the hostname out of the response of a hostname_request"""
+    for notification in hostname_response.notification:
+        for update in notification.update:
+            hostname: str = update.val.json_ietf_val
+            if not hostname:
+                return "Error"
+            return json.loads(hostname)["host-name"]
+
+
 def get_date() -> str:
     """ Get the current date in year-month-day format
 
@@ -135,6 +316,23 @@ def get_date() -> str:
     return ".".join([str(now.year), month, day])
 
 
+def yang_path_to_table_name(yang_path: str, max_length: int = 200) -> str:
+    """ Convert a given yang path to a name usable as a table or directory name. Names longer than
+    the maximum length are truncated and suffixed with a hash of the yang path to stay unique
+
+    :param yang_path: The yang path name to be converted
+    :type yang_path: str
+    :param max_length: The maximum length of the name
+    :type max_length: int
+    :returns: The table name
+
+    """
+    name: str = re.sub(r"[^0-9a-zA-Z]+", "_", yang_path).strip("_").lower()
+    if len(name) > max_length:
+        name = f"{name[:max_length - 9]}_{crc32(yang_path.encode()):08x}"
+    return name
+
+
 def yang_path_to_es_index(yang_path: str) -> str:
     """ Convert a given yang path to Elastic Search index format
 
@@ -0,0 +1,221 @@
+"""
+.. module:: workers
+   :platform: Unix, Windows
+   :synopsis: Worker processes that parse and upload batches of raw responses
+.. moduleauthor:: Greg Brown <gsb5067@gmail.com>
+"""
+from zlib import crc32
+from datetime import datetime
+from multiprocessing import Process, Queue
+from queue import Empty
+from time import time, time_ns, perf_counter
+from logging import getLogger, Logger
+from typing import List, Dict, Any, Tuple, Optional, Set
+from parsers.Parsers import RTNMParser, ParsedResponse
+from parsers.Filters import FieldFilters
+from databases.databases import (
+    Uploader,
+    InfluxdbUploader,
+    ElasticSearchUploader,
+    Influxdb2Uploader,
+    ParquetUploader,
+    PrometheusRemoteWriteUploader,
+    ClickHouseUploader,
+    TimescaleDBUploader,
+    FileUploader,
+    is_accepted
+)
+from aggregators.aggregators import WindowAggregator, aggregate
+from metrics.metrics import metrics, queue_depth, SIZE_BUCKETS
+from metrics.latency import LatencyTracker
+from loggers.loggers import Payload
+from live.live import publish_rows
+from alerts.alerts import AlertEngine, AlertRule
+
+
+def worker_index(device: str, worker_count: int) -> int:
+    """Map a device to the index of the worker that owns it. A stable hash is used
+    so a device is always handled by the same worker for the lifetime of RTNM
+
+    :param device: The ip address or hostname of the device
+    :type device: str
+    :param worker_count: The number of workers data is being partitioned across
+    :type worker_count: int
+    :returns: The index of the worker that handles the device
+
+    """
+    return crc32(str(device).encode()) % worker_count
+
+
+class ParserWorker(Process):
+    """A dedicated process that parses and uploads the batches of the devices routed to it.
+    Since a device is always routed to the same worker, any state kept in the worker
+    (uploaders, caches, etc.) only ever sees the series of its own devices
+
+    :param worker_id: The index of the worker
+    :type worker_id: int
+    :param log_name: Name of the logger used in RTNM to acquire
+    :type log_name: str
+    :param tsdb_args: The arguments of the TSDB (username, port, password, etc.)
+    :type tsdb_args: Dict[str, Dict[str, Any]]
+    :param aggregations: The arguments of the aggregations of sensor paths
+    :type aggregations: Dict[str, Dict[str, Any]]
+    :param field_filters: The fields of each input to include or exclude while parsing
+    :type field_filters: FieldFilters
+    :param queue_size: The maximum number of batches waiting for the worker, dispatching blocks once reached
+    :type queue_size: int
+    :param live_queue: The queue of the live server the parsed rows are published on
+    :type live_queue: Queue
+    :param alerts: The arguments of the alert rules evaluated on the parsed responses
+    :type alerts: Dict[str, Dict[str, Any]]
+
+    """
+
+    def __init__(self, worker_id: int, log_name: str, tsdb_args: Dict[str, Dict[str, Any]],
+                 aggregations: Optional[Dict[str, Dict[str, Any]]] = None,
+                 field_filters: Optional[FieldFilters] = None, queue_size: int = 0,
+                 live_queue: Optional[Queue] = None, alerts: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        super().__init__(name=f"{log_name}-worker-{worker_id}")
+        self.worker_id: int = worker_id
+        self.log_name: str = log_name
+        self.tsdb_args: Dict[str, Dict[str, Any]] = tsdb_args
+        self.queue: Queue = Queue(queue_size)
+        self.live_queue: Optional[Queue] = live_queue
+        self.alert_rules: List[AlertRule] = [AlertRule(**alert) for alert in (alerts or {}).values()]
+        self.alert_engine: Optional[AlertEngine] = None
+        self.log: Logger = getLogger(log_name)
+        self.uploaders: List[Uploader] = []
+        self.aggregated_uploaders: List[Uploader] = []
+        self.field_filters: Optional[FieldFilters] = field_filters
+        self.latency: LatencyTracker = LatencyTracker(self.log)
+        self.aggregators: List[WindowAggregator] = [
+            WindowAggregator(**aggregation) for aggregation in (aggregations or {}).values()
+        ]
+
+    def dispatch(self, batch_list: List[Tuple[str, str, Optional[str], Optional[str], str, float]]) -> None:
+        """Hand a batch of raw responses to the worker, blocking while the queue of the worker is full so
+        the data queue fills up and the overload policies of the inputs take over
+
+        :param batch_list: The raw responses of the devices owned by this worker
+        :type batch_list: List[Tuple[str, str, Optional[str], Optional[str], str, float]]
+
+        """
+        metrics.observe("rtnm_worker_batch_size", len(batch_list), SIZE_BUCKETS, worker=self.name)
+        self.queue.put(batch_list)
+        metrics.set("rtnm_queue_depth", queue_depth(self.queue), queue=self.name)
+
+    def stop(self) -> None:
+        """Tell the worker to finish the batches it has and exit"""
+        self.queue.put(None)
+
+    def _create_uploaders(self, data: str) -> List[Uploader]:
+        uploaders: List[Uploader] = []
+        for tsdb_endpoint in self.tsdb_args.keys():
+            if self.tsdb_args[tsdb_endpoint].get("data", "raw") != data:
+                continue
+            self.tsdb_args[tsdb_endpoint]["log_name"] = self.log_name
+            self.tsdb_args[tsdb_endpoint]["name"] = tsdb_endpoint
+            if self.tsdb_args[tsdb_endpoint]["type"] == "elasticsearch":
+                uploaders.append(ElasticSearchUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "influxdb":
+                uploaders.append(InfluxdbUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "parquet":
+                uploaders.append(ParquetUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "prometheus-remote-write":
+                uploaders.append(PrometheusRemoteWriteUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "clickhouse":
+                uploaders.append(ClickHouseUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "timescaledb":
+                uploaders.append(TimescaleDBUploader(**self.tsdb_args[tsdb_endpoint]))
+            elif self.tsdb_args[tsdb_endpoint]["type"] == "file":
+                uploaders.append(FileUploader(**self.tsdb_args[tsdb_endpoint]))
+            else:
+                uploaders.append(Influxdb2Uploader(**self.tsdb_args[tsdb_endpoint]))
+        return uploaders
+
+    def upload_aggregated(self, aggregated_responses: List[ParsedResponse]) -> None:
+        """Upload the responses of closed aggregation windows to the aggregated outputs
+
+        :param aggregated_responses: The aggregated responses
+        :type aggregated_responses: List[ParsedResponse]
+
+        """
+        if aggregated_responses:
+            self.log.debug(f"Uploading {len(aggregated_responses)} aggregated responses")
+            for uploader in self.aggregated_uploaders:
+                uploader.upload(aggregated_responses)
+
+    def process_and_upload_data(self, batch_list: List[Tuple[str, str, Optional[str], Optional[str], str, float]],
+                                dequeued: Optional[float] = None) -> None:
+        """Process the raw responses from gRPC/gNMI client and upload to a TSDB
+
+        :param batch_list: The raw responses from either Cisco gRPC or gNMI clients or from both.
+        :type batch_list: List[Tuple[str, str, Optional[str], Optional[str], str, float]]
+        :param dequeued: The time the batch was taken off the queue of the worker
+        :type dequeued: float
+
+        """
+        try:
+            dequeued = dequeued or time()
+            self.latency.observe_received(batch_list, dequeued)
+            parser = RTNMParser(batch_list, self.log_name, self.field_filters, self.latency)
+            start = datetime.now()
+            parse_start: float = perf_counter()
+            parsed_responses: List[ParsedResponse] = parser.decode_and_parse_raw_responses()
+            metrics.observe("rtnm_parse_seconds", perf_counter() - parse_start, worker=self.name)
+            metrics.inc("rtnm_parsed_rows_total", len(parsed_responses), worker=self.name)
+            parsed: float = time()
+            self.latency.observe("parse", parsed - dequeued)
+            if self.live_queue is not None:
+                publish_rows(self.live_queue, parsed_responses, self.name)
+            if self.alert_engine is not None:
+                self.alert_engine.evaluate(parsed_responses)
+            if self.aggregators:
+                parsed_responses, aggregated_responses = aggregate(self.aggregators, parsed_responses)
+                self.upload_aggregated(aggregated_responses)
+            timestamps: Set[Tuple[str, int]] = {(row.ip_addr, row.timestamp) for row in parsed_responses}
+            for uploader in self.uploaders:
+                if is_accepted(uploader.upload(parsed_responses)):
+                    self.latency.observe_acked(timestamps, parsed, time(), uploader.name)
+            self.latency.log_summary()
+            end = datetime.now()
+            total_time = end - start
+            self.log.info(f"Total Batch time took {total_time}")
+        except Exception as error:
+            self.log.error(error)
+            self.log.debug("Failed batch %s", Payload(batch_list))
+
+    def run(self) -> None:
+        self.uploaders = self._create_uploaders("raw")
+        self.aggregated_uploaders = self._create_uploaders("aggregated")
+        if self.alert_rules:
+            self.alert_engine = AlertEngine(self.alert_rules, self.log)
+        self.log.info("Started worker [%s]", self.name)
+        last_flush: float = time()
+        while True:
+            try:
+                batch_list: Optional[List[Tuple[str, str, Optional[str], Optional[str], str, float]]] = self.queue.get(timeout=1)
+                dequeued: float = time()
+            except Empty:
+                # Close the windows of series that stopped sending
+                for aggregator in self.aggregators:
+                    self.upload_aggregated(aggregator.flush(time_ns()))
+                batch_list = []
+            if batch_list is None:
+                break
+            if batch_list:
+                self.process_and_upload_data(batch_list, dequeued)
+            if time() - last_flush >= 1:
+                for uploader in self.uploaders + self.aggregated_uploaders:
+                    uploader.flush()
+                if self.alert_engine is not None:
+                    self.alert_engine.check_absence()
+                last_flush = time()
+        for aggregator in self.aggregators:
+            self.upload_aggregated(aggregator.flush())
+        for uploader in self.uploaders + self.aggregated_uploaders:
+            uploader.close()
+        if self.alert_engine is not None:
+            self.alert_engine.close()
+        metrics.send()
+        self.log.info("Stopping worker [%s]", self.name)